@@ -0,0 +1,81 @@
+"""
+Сравнение скорости кодирования корпуса: один процесс против пула процессов.
+
+Тексты берутся из JSON-файлов data_raw (повторяются до --n-texts).
+Для каждого значения --workers корпус кодируется CorpusEncoder с параметрами
+секции 'encoding' config; workers=1 — текущий однопроцессный путь.
+
+--backends сравнивает backend модели (torch | onnx | onnx_int8, см. секцию
+'embedder' config): скорость и косинусное сходство эмбеддингов с первым
+прогоном (torch). ONNX-модели кодируют в одном процессе.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_encoding --n-texts 5000 --workers 1 2 4
+    python -m benchmarks.bench_encoding --workers 1 --backends torch onnx onnx_int8
+"""
+import argparse
+import json
+import time
+from itertools import cycle, islice
+from pathlib import Path
+
+import numpy as np
+from src.embedder import agreement, load_embedder
+from src.encoding import CorpusEncoder
+
+
+def load_texts(n_texts: int):
+    texts = [record['text'] for path in sorted((Path.cwd()/'data_raw').glob('*.json'))
+             for record in json.load(open(path, encoding='utf-8'))]
+    return list(islice(cycle(texts), n_texts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n-texts', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--backends', nargs='+', default=['torch'])
+    parser.add_argument('--out', default='logs/bench_encoding.json')
+    args = parser.parse_args()
+
+    with open(Path.cwd()/'config'/'config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    texts = load_texts(args.n_texts)
+
+    results, reference = [], None
+    for backend in args.backends:
+        config_backend = {**config, 'embedder': {**config.get('embedder', {}), 'backend': backend,
+                                                 'agreement_check': False}}
+        model = load_embedder(config_backend, Path.cwd()/config['folder_model'], 'cpu')
+        for workers in (args.workers if backend == 'torch' else [1]):
+            config_encoding = {**config.get('encoding', {}), 'workers': workers, 'min_parallel_texts': 0}
+            encoder = CorpusEncoder(model, config_encoding)
+            if encoder.workers > 1:
+                encoder._get_pool()  # запуск пула не входит в замер
+            start = time.perf_counter()
+            embs = encoder.encode(texts)
+            elapsed = time.perf_counter() - start
+            encoder.close()
+            if reference is None:
+                reference = embs
+            results.append({
+                'backend': backend,
+                'workers': workers,
+                'threads_per_worker': encoder.threads_per_worker,
+                'seconds': elapsed,
+                'texts_per_sec': len(texts) / elapsed,
+                'max_abs_diff_vs_first': float(np.abs(embs - reference).max()),
+                **{f'{key}_vs_first': value for key, value in agreement(reference, embs).items()},
+            })
+            print(f"{backend:<10} workers={workers:<3} {elapsed:8.2f} с  {len(texts) / elapsed:8.1f} текстов/с  "
+                  f"косинус с первым: мин {results[-1]['min_cosine_vs_first']:.4f}")
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump({'n_texts': len(texts), 'results': results}, f, indent=4)
+    print(f'Результаты сохранены в {out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Общие функции бенчмарков: наборы запросов, перцентили и запись результатов.
+
+Результаты пишутся в logs/bench/<имя бенчмарка>/<commit>.json вместе с
+метаданными запуска (commit, время, число CPU, параметры), чтобы прогоны разных
+коммитов можно было сравнить (python -m benchmarks.compare).
+"""
+import json
+import os
+import platform
+import re
+import subprocess
+import time
+from itertools import cycle, islice
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+        return f'{commit}-dirty' if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """Среднее и перцентили p50 / p95 / p99 (мс или с — в единицах values)."""
+    if not values:
+        return {'mean': None, 'p50': None, 'p95': None, 'p99': None}
+    values = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'mean': float(values.mean()), 'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+
+def corpus_texts(n_texts: int = None) -> List[str]:
+    """Абзацы из JSON-файлов data_raw (повторяются до n_texts)."""
+    texts = [record['text'] for path in sorted((Path.cwd()/'data_raw').glob('*.json'))
+             for record in json.load(open(path, encoding='utf-8'))]
+    return texts if n_texts is None else list(islice(cycle(texts), n_texts))
+
+
+def load_queries(path: str = None, n_queries: int = None) -> List[str]:
+    """
+    Набор запросов для нагрузочного теста.
+
+    path — JSONL-файл (строка — JSON-строка или объект с полем query / question / text)
+    или текстовый файл (запрос на строку). Без path запросы синтезируются из предложений
+    абзацев data_raw (без повторов). Набор повторяется до n_queries, только если он короче.
+    """
+    if path:
+        queries = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = line
+                if isinstance(record, dict):
+                    record = record.get('query') or record.get('question') or record.get('text')
+                if record:
+                    queries.append(str(record))
+    else:
+        sentences = (sentence for text in corpus_texts() for sentence in _SENTENCE_END.split(text.strip()))
+        queries = list(dict.fromkeys(sentence for sentence in sentences if len(sentence.split()) >= 4))
+    if not queries:
+        raise SystemExit('Набор запросов пуст')
+    return queries if n_queries is None else list(islice(cycle(queries), n_queries))
+
+
+def save_results(name: str, results: Dict, args=None, out_dir: str = 'logs/bench') -> Path:
+    """
+    Записывает результаты в <out_dir>/<name>/<commit>.json.
+
+    Returns:
+        Path: Путь к файлу результатов.
+    """
+    commit = git_commit()
+    path = Path(out_dir)/name/f'{commit}.json'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        'benchmark': name,
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'cpu_count': os.cpu_count(), 'platform': platform.platform(),
+                 'python': platform.python_version()},
+        'args': vars(args) if args is not None else {},
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=4)
+    return path
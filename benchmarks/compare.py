@@ -0,0 +1,69 @@
+"""
+Сравнение результатов бенчмарка двух коммитов (файлы logs/bench/<имя>/<commit>.json).
+
+Числовые метрики сопоставляются по пути в JSON (строки списков результатов
+идентифицируются ключевыми полями: endpoint, concurrency, n_vectors, type, rows …).
+Выводится относительное изменение; изменения в худшую сторону больше --threshold
+отмечаются как регрессия (для метрик задержки и времени хуже — рост,
+для throughput / qps / per_sec / recall — падение). Код возврата 1 при регрессиях.
+
+Запуск из корня проекта:
+    python -m benchmarks.compare logs/bench/load_test/abc1234.json logs/bench/load_test/def5678.json
+"""
+import argparse
+import json
+from typing import Dict
+
+KEY_FIELDS = ('endpoint', 'concurrency', 'n_vectors', 'type', 'storage', 'rows', 'texts', 'workers', 'param')
+HIGHER_IS_BETTER = ('throughput', 'qps', 'per_sec', 'recall', 'ok', 'hit_rate')
+
+
+def flatten(value, prefix: str = '') -> Dict[str, float]:
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            if key not in KEY_FIELDS:
+                items.update(flatten(item, f'{prefix}.{key}' if prefix else key))
+        return items
+    if isinstance(value, list):
+        items = {}
+        for i, item in enumerate(value):
+            label = ','.join(f'{key}={item[key]}' for key in KEY_FIELDS if isinstance(item, dict) and key in item)
+            items.update(flatten(item, f'{prefix}[{label or i}]'))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1, help='допустимое ухудшение (доля)')
+    args = parser.parse_args()
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+    base_metrics, new_metrics = flatten(base['results']), flatten(new['results'])
+
+    print(f"{base.get('commit')} -> {new.get('commit')}")
+    regressions = 0
+    for path in sorted(base_metrics.keys() & new_metrics.keys()):
+        old, cur = base_metrics[path], new_metrics[path]
+        if old == 0:
+            continue
+        change = (cur - old) / abs(old)
+        worse = -change if any(word in path for word in HIGHER_IS_BETTER) else change
+        mark = ''
+        if worse > args.threshold:
+            mark = '  REGRESSION'
+            regressions += 1
+        print(f'{path:<80}{old:>14.3f}{cur:>14.3f}{change:>+9.1%}{mark}')
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Отчёт recall@k / latency для типов FAISS-индекса относительно точного IndexFlatL2.
+
+Часть корпуса (n_queries векторов) откладывается как запросы, остальное
+индексируется. Для каждого типа индекса и каждого значения nprobe / efSearch
+считается recall@k против Flat и задержка одиночного запроса (p50/p95, мс).
+
+Для форматов хранения (float16 / sq8 / pq) и размерностей PCA дополнительно
+считаются байты на вектор (размер сериализованного индекса / число векторов)
+и recall@k без re-ranking и с re-ranking по точным векторам.
+
+Запуск из корня проекта:
+    python -m benchmarks.index_report --embeddings embs.npy --k 10
+    python -m benchmarks.index_report            # векторы сегментов текущего хранилища
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from src.index_factory import build_index, train_index, search_params, rerank_exact
+from src.segments import SegmentStore
+
+
+def load_embeddings(args, config) -> np.ndarray:
+    if args.embeddings:
+        return np.load(args.embeddings).astype(np.float32)
+    store = SegmentStore(Path.cwd()/config['folder_model']/'faiss', config, logger=None)
+    if not store.load():
+        raise SystemExit('Хранилище не найдено: создайте индекс (/create_index) или передайте --embeddings')
+    return np.vstack([np.asarray(segment.vectors(), dtype=np.float32) for segment in store.segments])
+
+
+def recall_at_k(approx_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    k = exact_ids.shape[1]
+    hits = sum(len(np.intersect1d(a[a >= 0], e)) for a, e in zip(approx_ids, exact_ids))
+    return hits / (k * len(exact_ids))
+
+
+def measure(index, queries: np.ndarray, k: int, params=None) -> dict:
+    latencies = []
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        _, found = index.search(q.reshape(1, -1), k, params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids[i] = found[0]
+    start = time.perf_counter()
+    index.search(queries, k, params=params)
+    batch_qps = len(queries) / (time.perf_counter() - start)
+    return {
+        'ids': ids,
+        'latency_p50_ms': float(np.percentile(latencies, 50)),
+        'latency_p95_ms': float(np.percentile(latencies, 95)),
+        'batch_qps': float(batch_qps),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embeddings', help='npy-файл с эмбеддингами корпуса (иначе векторы сегментов хранилища)')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--n-queries', type=int, default=1000)
+    parser.add_argument('--types', nargs='+', default=['ivf_flat', 'ivf_pq', 'hnsw'])
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--storage', nargs='+', default=['float32', 'float16', 'sq8', 'pq'])
+    parser.add_argument('--pca-dim', type=int, nargs='*', default=[256])
+    parser.add_argument('--rerank-factor', type=int, default=4)
+    parser.add_argument('--out', default='logs/index_report.json')
+    args = parser.parse_args()
+
+    with open(Path.cwd()/'config'/'config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config_index = config.get('index_type', {})
+
+    embs = load_embeddings(args, config)
+    rng = np.random.default_rng(0)
+    n_queries = min(args.n_queries, len(embs) // 10 or 1)
+    perm = rng.permutation(len(embs))
+    queries, base = embs[perm[:n_queries]], embs[perm[n_queries:]]
+    dim = base.shape[1]
+
+    flat = faiss.IndexFlatL2(dim)
+    flat.add(base)
+    exact = measure(flat, queries, args.k)
+    report = [{'type': 'flat', 'param': None, 'recall_at_k': 1.0,
+               **{key: value for key, value in exact.items() if key != 'ids'}}]
+
+    for index_type in args.types:
+        index = build_index(dim, len(base), config_index, index_type=index_type)
+        start = time.perf_counter()
+        train_index(index, base, config_index)
+        index.add(base)
+        build_s = time.perf_counter() - start
+        grid = args.ef_search if index_type == 'hnsw' else args.nprobe
+        for value in grid:
+            params = search_params(index, nprobe=value, ef_search=value)
+            result = measure(index, queries, args.k, params)
+            report.append({
+                'type': index_type,
+                'param': {'ef_search' if index_type == 'hnsw' else 'nprobe': value},
+                'recall_at_k': recall_at_k(result.pop('ids'), exact['ids']),
+                'build_s': build_s,
+                **result,
+            })
+
+    print(f"{'type':<10}{'param':<22}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p95 ms':>10}{'batch qps':>12}")
+    for row in report:
+        print(f"{row['type']:<10}{str(row['param']):<22}{row['recall_at_k']:>10.3f}"
+              f"{row['latency_p50_ms']:>10.3f}{row['latency_p95_ms']:>10.3f}{row['batch_qps']:>12.0f}")
+
+    # форматы хранения: байты на вектор и потеря recall (Flat-поиск по сжатым векторам)
+    variants = [(storage, None) for storage in args.storage] + [('float32', dim) for dim in args.pca_dim if dim < base.shape[1]]
+    storage_report = []
+    for storage, pca_dim in variants:
+        config_variant = {**config_index, 'storage': storage, 'pca_dim': pca_dim}
+        index = build_index(dim, len(base), config_variant, index_type='flat')
+        train_index(index, base, config_variant)
+        index.add(base)
+        row = {'storage': storage, 'pca_dim': pca_dim,
+               'bytes_per_vector': len(faiss.serialize_index(index)) / index.ntotal}
+        result = measure(index, queries, args.k)
+        row['recall_at_k'] = recall_at_k(result['ids'], exact['ids'])
+        row['latency_p50_ms'] = result['latency_p50_ms']
+        if args.rerank_factor > 1 and (storage != 'float32' or pca_dim):
+            _, candidates = index.search(queries, args.k * args.rerank_factor)
+            _, reranked = rerank_exact(queries, candidates, base, args.k)
+            row['recall_at_k_rerank'] = recall_at_k(reranked, exact['ids'])
+        storage_report.append(row)
+
+    print(f"\n{'storage':<10}{'pca':>6}{'bytes/vec':>12}{'recall@' + str(args.k):>10}{'+rerank':>10}")
+    for row in storage_report:
+        rerank = row.get('recall_at_k_rerank')
+        print(f"{row['storage']:<10}{str(row['pca_dim'] or '-'):>6}{row['bytes_per_vector']:>12.1f}"
+              f"{row['recall_at_k']:>10.3f}{(f'{rerank:.3f}' if rerank is not None else '-'):>10}")
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump({'n_base': len(base), 'n_queries': n_queries, 'k': args.k, 'results': report,
+                   'storage': storage_report, 'rerank_factor': args.rerank_factor}, f, indent=4)
+    print(f'Отчёт сохранён в {out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Нагрузочный тест сервисов: воспроизведение набора запросов к /search_texts,
+/answer_question и /answer_question_stream с заданной конкурентностью.
+
+Для каждого эндпоинта и уровня конкурентности считаются пропускная способность
+(успешных запросов в секунду), число ошибок по кодам ответа (429 — отказ очереди
+LLM) и задержки p50 / p95 / p99 — общая и по этапам:
+    search         — total (время ответа indexer);
+    answer         — total, retrieval, prompt, llm (timings_ms ответа сервиса);
+    answer_stream  — total, retrieval, ttft (время до первого токена), generation.
+
+Для прогона без модели и GPU answer запускается с "llm_backend": "stub"
+в config/config.json (детерминированная заглушка StubLlama).
+
+Кэши сервисов (answer_cache, query_cache) отвечают на повторные запросы без поиска
+и генерации, поэтому по умолчанию тест требует их выключить в config/config.json;
+с --with-cache прогон идёт с кэшами, а рядом с каждым уровнем выводится доля
+попаданий в каждый кэш за этот уровень.
+
+Запуск из корня проекта (сервисы уже запущены):
+    python -m benchmarks.load_test --endpoints search answer --concurrency 1 4 16
+    python -m benchmarks.load_test --queries queries.jsonl --n-queries 2000
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.common import load_queries, percentiles, save_results
+
+
+async def request_search(client: httpx.AsyncClient, args, query: str) -> Dict:
+    response = await client.post(args.indexer_url.rstrip('/') + '/search_texts', json=query)
+    return {'status': response.status_code}
+
+
+async def request_answer(client: httpx.AsyncClient, args, query: str) -> Dict:
+    response = await client.post(args.answer_url.rstrip('/') + '/answer_question', json=query)
+    if response.status_code != 200:
+        return {'status': response.status_code}
+    return {'status': 200, **response.json().get('timings_ms', {})}
+
+
+async def request_answer_stream(client: httpx.AsyncClient, args, query: str) -> Dict:
+    start = time.perf_counter()
+    stages, event = {}, None
+    async with client.stream('POST', args.answer_url.rstrip('/') + '/answer_question_stream', json=query) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {'status': response.status_code}
+        async for line in response.aiter_lines():
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: '):
+                data = json.loads(line[len('data: '):])
+                if event == 'retrieval':
+                    stages['retrieval'] = data.get('retrieval_ms')
+                elif event == 'token' and 'ttft' not in stages:
+                    stages['ttft'] = (time.perf_counter() - start) * 1000
+                elif event == 'error':
+                    return {'status': 'stream_error'}
+    if 'ttft' in stages:
+        stages['generation'] = (time.perf_counter() - start) * 1000 - stages['ttft']
+    return {'status': 200, **stages}
+
+
+REQUESTS = {
+    'search': request_search,
+    'answer': request_answer,
+    'answer_stream': request_answer_stream,
+}
+
+
+async def cache_counters(client: httpx.AsyncClient, args) -> Dict[str, Dict]:
+    """Счётчики включённых кэшей сервисов: {answer_exact | answer_semantic | query_embeddings | query_results: stats}."""
+    counters = {}
+    for prefix, url in (('answer', args.answer_url.rstrip('/') + '/cache_stats'),
+                        ('query', args.indexer_url.rstrip('/') + '/query_cache_stats')):
+        try:
+            stats = (await client.get(url)).json()
+        except (httpx.HTTPError, ValueError):
+            continue
+        for name, value in stats.items():
+            if isinstance(value, dict) and 'hits' in value:
+                counters[f'{prefix}_{name}'] = value
+    return counters
+
+
+def hit_rates(before: Dict[str, Dict], after: Dict[str, Dict]) -> Dict[str, Optional[float]]:
+    """Доля попаданий в каждый кэш между двумя снимками счётчиков."""
+    rates = {}
+    for name, stats in after.items():
+        hits = stats['hits'] - before.get(name, {}).get('hits', 0)
+        total = hits + stats['misses'] - before.get(name, {}).get('misses', 0)
+        rates[name] = hits / total if total else None
+    return rates
+
+
+async def enabled_caches(args) -> List[str]:
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        return list(await cache_counters(client, args))
+
+
+async def run_level(endpoint: str, queries: List[str], concurrency: int, args) -> Dict:
+    """Прогон набора запросов с concurrency одновременными клиентами."""
+    send = REQUESTS[endpoint]
+    pending = iter(queries)
+    samples: List[Dict] = []
+
+    async def client_loop(client):
+        for query in pending:
+            start = time.perf_counter()
+            try:
+                sample = await send(client, args, query)
+            except httpx.HTTPError as e:
+                sample = {'status': type(e).__name__}
+            sample['total'] = (time.perf_counter() - start) * 1000
+            samples.append(sample)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        # прогрев: соединения, кэши сервисов; в результаты не входит
+        for query in queries[:args.warmup]:
+            await send(client, args, query)
+        counters = await cache_counters(client, args)
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        cache_hit_rate = hit_rates(counters, await cache_counters(client, args))
+
+    ok = [sample for sample in samples if sample['status'] == 200]
+    stages = defaultdict(list)
+    for sample in ok:
+        for stage, value in sample.items():
+            if stage != 'status' and value is not None:
+                stages[stage].append(value)
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'ok': len(ok),
+        'errors': dict(Counter(str(sample['status']) for sample in samples if sample['status'] != 200)),
+        'seconds': elapsed,
+        'throughput_rps': len(ok) / elapsed if elapsed > 0 else None,
+        'latency_ms': {stage: percentiles(values) for stage, values in stages.items()},
+        'cache_hit_rate': cache_hit_rate,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--indexer-url', default='http://localhost:8000/')
+    parser.add_argument('--answer-url', default='http://localhost:8001/')
+    parser.add_argument('--endpoints', nargs='+', choices=list(REQUESTS), default=['search', 'answer'])
+    parser.add_argument('--queries', help='JSONL / текстовый файл запросов (иначе синтетические из data_raw)')
+    parser.add_argument('--n-queries', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--with-cache', action='store_true',
+                        help='не требовать выключенных answer_cache / query_cache (доля попаданий — в результатах)')
+    parser.add_argument('--out-dir', default='logs/bench')
+    args = parser.parse_args()
+
+    caches = asyncio.run(enabled_caches(args))
+    if caches and not args.with_cache:
+        raise SystemExit(f'Включены кэши сервисов ({", ".join(caches)}): повторные запросы и прогрев '
+                         'обслуживаются из кэша. Выключите answer_cache / query_cache в config/config.json '
+                         'или запустите с --with-cache')
+    queries = load_queries(args.queries, args.n_queries)
+    results = []
+    for endpoint in args.endpoints:
+        for concurrency in args.concurrency:
+            results.append(asyncio.run(run_level(endpoint, queries, concurrency, args)))
+
+    print(f"{'endpoint':<15}{'conc':>6}{'rps':>9}{'errors':>8}  {'stage':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in results:
+        rps = f"{row['throughput_rps']:.1f}" if row['throughput_rps'] is not None else '-'
+        head = f"{row['endpoint']:<15}{row['concurrency']:>6}{rps:>9}{row['requests'] - row['ok']:>8}"
+        for stage, stats in row['latency_ms'].items():
+            print(f"{head}  {stage:<12}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}")
+            head = ' ' * len(head)
+        if not row['latency_ms']:
+            print(head)
+        if row['cache_hit_rate']:
+            rates = ', '.join(f"{name} {rate:.0%}" if rate is not None else f'{name} -'
+                              for name, rate in row['cache_hit_rate'].items())
+            print(f"{' ' * 29}cache hit rate: {rates}")
+
+    path = save_results('load_test', results, args, args.out_dir)
+    print(f'Результаты: {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Микро-бенчмарки отдельных этапов на синтетических данных:
+    index   — построение индекса (обучение + добавление) и поиск FAISS
+              (задержка одиночного запроса p50/p95/p99, пропускная способность пакета)
+              для корпусов --sizes векторов (10k … 10M);
+    clean   — DataPreprocessor.clean на синтетическом DataFrame (--clean-rows строк,
+              с пропусками, дубликатами и короткими текстами);
+    encode  — кодирование абзацев data_raw моделью эмбеддингов (CorpusEncoder).
+
+Синтетические векторы — смесь гауссовых кластеров, нормированная как эмбеддинги
+LaBSE; генерируются и добавляются в индекс порциями, поэтому 10M векторов
+не требуют хранить корпус целиком (сам индекс float32 при dim=768 занимает ~30 ГБ:
+для больших корпусов используйте --storage sq8 / pq или меньший --dim).
+
+Запуск из корня проекта:
+    python -m benchmarks.micro --stages index clean --sizes 10000 100000 1000000
+    python -m benchmarks.micro --stages index --sizes 10000000 --types ivf_flat --storage pq
+"""
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Dict, Iterator
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import corpus_texts, percentiles, save_results
+from src.index_factory import build_index, index_type_name, search_params, train_index
+from src.preprocessing import DataPreprocessor
+
+
+def synthetic_vectors(n: int, dim: int, seed: int, n_clusters: int = 256,
+                      chunk: int = 100_000) -> Iterator[np.ndarray]:
+    """Порции нормированных векторов вокруг n_clusters общих центров (центры зависят только от dim)."""
+    centers = np.random.default_rng(dim).standard_normal((n_clusters, dim)).astype(np.float32)
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, chunk):
+        size = min(chunk, n - start)
+        vectors = centers[rng.integers(0, n_clusters, size)] + 0.5 * rng.standard_normal((size, dim), dtype=np.float32)
+        yield vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def bench_index(args, config_index: Dict) -> list:
+    queries = next(synthetic_vectors(args.n_queries, args.dim, seed=1))
+    results = []
+    for n in args.sizes:
+        for index_type in args.types:
+            config_variant = {**config_index, 'storage': args.storage}
+            index = build_index(args.dim, n, config_variant, index_type=index_type)
+
+            start = time.perf_counter()
+            chunks = synthetic_vectors(n, args.dim, seed=0)
+            first = next(chunks)
+            train_index(index, first[:config_variant.get('train_sample', 100_000)], config_variant)
+            train_s = time.perf_counter() - start
+            index.add(first)
+            for vectors in chunks:
+                index.add(vectors)
+            build_s = time.perf_counter() - start
+
+            params = search_params(index, config_index.get('nprobe'), config_index.get('ef_search'))
+            latencies = []
+            for q in queries[:args.n_single]:
+                t = time.perf_counter()
+                index.search(q.reshape(1, -1), args.k, params=params)
+                latencies.append((time.perf_counter() - t) * 1000)
+            t = time.perf_counter()
+            index.search(queries, args.k, params=params)
+            batch_s = time.perf_counter() - t
+
+            results.append({
+                'n_vectors': n,
+                'type': index_type_name(index),
+                'storage': args.storage,
+                'train_s': train_s,
+                'build_s': build_s,
+                'vectors_per_sec': n / build_s,
+                'search_latency_ms': percentiles(latencies),
+                'batch_qps': len(queries) / batch_s,
+            })
+            print(f"index  n={n:<10} {results[-1]['type']:<14} build {build_s:8.1f} s  "
+                  f"p50 {results[-1]['search_latency_ms']['p50']:.3f} ms  batch {results[-1]['batch_qps']:.0f} qps")
+            del index
+    return results
+
+
+def synthetic_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """DataFrame в формате RuBQ (uid, ru_wiki_pageid, text): ~1% пропусков, ~5% дубликатов, ~5% коротких текстов."""
+    rng = np.random.default_rng(seed)
+    texts = np.array(corpus_texts(), dtype=object)
+    text = texts[rng.integers(0, len(texts), n_rows)] + ' ' + pd.Series(np.arange(n_rows)).astype(str).to_numpy()
+    uid = np.arange(n_rows).astype(object)
+
+    dup = rng.random(n_rows) < 0.05
+    source = rng.integers(0, n_rows, int(dup.sum()))
+    text[dup] = text[source]
+    short = rng.random(n_rows) < 0.05
+    text[short] = 'короткий текст'
+    missing = rng.random(n_rows) < 0.01
+    text[missing] = None
+    pageid = np.where(rng.random(n_rows) < 0.01, None, rng.integers(0, 10**6, n_rows)).astype(object)
+    return pd.DataFrame({'uid': uid, 'ru_wiki_pageid': pageid, 'text': text})
+
+
+def bench_clean(args, config: Dict) -> list:
+    logger = logging.getLogger('benchmarks.micro')
+    config_preprocessing = config.get('preprocessing', {})
+    results = []
+    for n_rows in args.clean_rows:
+        df = synthetic_frame(n_rows)
+        dp = DataPreprocessor(None, logger, config.get('min_words', 20), df=df, **config_preprocessing)
+        start = time.perf_counter()
+        df_clean = dp.clean()
+        elapsed = time.perf_counter() - start
+        results.append({'rows': n_rows, 'rows_kept': len(df_clean), 'seconds': elapsed,
+                        'rows_per_sec': n_rows / elapsed})
+        print(f"clean  rows={n_rows:<10} {elapsed:8.2f} s  {n_rows / elapsed:,.0f} rows/s")
+    return results
+
+
+def bench_encode(args, config: Dict) -> list:
+    from sentence_transformers import SentenceTransformer
+    from src.encoding import CorpusEncoder
+
+    model = SentenceTransformer(config['model_embed_name'], cache_folder=Path.cwd()/config['folder_model'], device='cpu')
+    model.max_seq_length = 512
+    texts = corpus_texts(args.encode_texts)
+    encoder = CorpusEncoder(model, config.get('encoding', {}))
+    start = time.perf_counter()
+    encoder.encode(texts)
+    elapsed = time.perf_counter() - start
+    encoder.close()
+    print(f"encode texts={len(texts):<10} {elapsed:8.2f} s  {len(texts) / elapsed:,.1f} texts/s")
+    return [{'texts': len(texts), 'seconds': elapsed, 'texts_per_sec': len(texts) / elapsed}]
+
+
+STAGES = {'index': bench_index, 'clean': bench_clean, 'encode': bench_encode}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=['index', 'clean'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--types', nargs='+', default=['flat', 'ivf_flat', 'hnsw'])
+    parser.add_argument('--storage', default='float32')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--n-queries', type=int, default=1000)
+    parser.add_argument('--n-single', type=int, default=200, help='число одиночных запросов для замера задержки')
+    parser.add_argument('--clean-rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--encode-texts', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=None, help='число потоков FAISS (по умолчанию все ядра)')
+    parser.add_argument('--out-dir', default='logs/bench')
+    args = parser.parse_args()
+
+    with open(Path.cwd()/'config'/'config.json', 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    results = {}
+    for stage in args.stages:
+        results[stage] = (bench_index(args, config.get('index_type', {})) if stage == 'index'
+                          else STAGES[stage](args, config))
+
+    path = save_results('micro', results, args, args.out_dir)
+    print(f'Результаты: {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,19 @@
-
 import numpy as np
 import uvicorn
-import requests
+import httpx
 import json
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from urllib.parse import urljoin
 from typing import Literal, List, Dict, Tuple
-from llama_cpp import Llama
 from huggingface_hub import hf_hub_download
 from src.llm_answer import LLMService
-from fastapi import FastAPI, Body, HTTPException
+from src.llm_stub import load_llm
+from src.llm_pool import LLMWorkerPool, QueueFullError, DeadlineExceededError
+from src.answer_cache import AnswerCache
+from src.telemetry import span, trace_headers, trace_middleware, setup_spans, register_stats, metrics_body
+from fastapi import FastAPI, Body, Query, HTTPException, Response
+from fastapi.responses import StreamingResponse
 
 path_config = Path.cwd()/'config'
 with open(path_config/'config.json', 'r', encoding='utf-8') as f:
@@ -18,43 +22,211 @@ with open(path_config/'config.json', 'r', encoding='utf-8') as f:
 path_model =Path.cwd()/config['folder_model']
 path_model .mkdir(exist_ok=True)
 
-app = FastAPI()
+config_client = config.get('indexer_client', {})
 
-WINDOW_SIZE = 10240
-model_path = hf_hub_download(**config['model_llm_name'], cache_dir= path_model)
-llama = Llama(model_path=model_path, n_ctx=WINDOW_SIZE,verbose=False)
+# llm_backend='stub' — детерминированная заглушка вместо модели (бенчмарки, CI без сети)
+model_path = (hf_hub_download(**config['model_llm_name'], cache_dir= path_model)
+              if config.get('llm_backend', 'llama') != 'stub' else None)
 
-llm_service = LLMService (llama, config)
+# Генерация выполняется пулом процессов-воркеров с ограниченной приоритетной очередью;
+# в основном процессе модель загружается только со словарём (для подготовки prompt)
+llm_pool = LLMWorkerPool(model_path, config)
+llm_service = LLMService(load_llm(model_path, config, vocab_only=True, verbose=False), config, generation=False)
 
-# Эндпоинт: генерация ответа на вопрос 
-@app.post("/answer_question")
-async def answer_question(query: str = Body(...)):
 
-    base_url = 'http://localhost:8000/' 
-    endpoint_indexer = 'search_texts'
-    url = urljoin(base_url, endpoint_indexer)
-    # запрос поиска схожих  текстов 
-    response = requests.post(
-    url, json.dumps(query),
-    headers={"Content-Type": "application/json"}
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Пул соединений к indexer с keep-alive и таймаутами
+    app.state.indexer_client = httpx.AsyncClient(
+        base_url=config_client.get('base_url', 'http://localhost:8000/'),
+        timeout=httpx.Timeout(config_client.get('timeout_s', 60), connect=config_client.get('connect_timeout_s', 5)),
+        limits=httpx.Limits(max_connections=config_client.get('max_connections', 20),
+                            max_keepalive_connections=config_client.get('max_keepalive_connections', 10)),
     )
+    await llm_pool.start()
+    yield
+    await app.state.indexer_client.aclose()
+    llm_pool.close()
+
+
+app = FastAPI(lifespan=lifespan)
+# trace id (заголовок X-Trace-Id, передаётся в indexer) и длительность запросов; этапы — logs/spans.log
+app.middleware('http')(trace_middleware)
+setup_spans(config)
+
+# Двухуровневый кэш ответов (точный + семантический), сбрасывается при смене версии индекса
+config_answer_cache = config.get('answer_cache', {})
+answer_cache = AnswerCache(config_answer_cache) if config_answer_cache.get('enabled', True) else None
+
+# Метрики пула LLM и кэша ответов для /metrics (читаются при каждом опросе)
+register_stats('llm_pool', llm_pool.stats)
+if answer_cache is not None:
+    register_stats('answer_cache', answer_cache.stats)
+
+async def retrieve(query: str) -> Tuple[Dict, np.ndarray]:
+    """
+    Запрос поиска схожих текстов к indexer.
+    Returns:
+        Tuple[Dict, np.ndarray]: ответ indexer и эмбеддинг запроса (None, если кэш ответов выключен).
+    """
+    endpoint_indexer = 'search_texts'
+    try:
+        with span('indexer_request'):
+            response = await app.state.indexer_client.post(
+                endpoint_indexer, json=query, params={'return_embedding': answer_cache is not None},
+                headers=trace_headers())
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=504, detail=f"Ошибка запроса к indexer: {e!r}")
     if response.status_code != 200:
         raise HTTPException(status_code=500, detail=f"Ошибка запроса к indexer: {response.text}")
 
     result = response.json()
+    query_embedding = result.pop('query_embedding', None)
+    if query_embedding is not None:
+        query_embedding = np.array(query_embedding, dtype=np.float32)
+    # при частичном ответе шардов (partial) версии индекса нет — кэш ответов не сбрасывается
+    if answer_cache is not None and result.get('index_version') is not None:
+        answer_cache.check_version(result['index_version'])
+    return result, query_embedding
+
+
+def queue_full(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e),
+                         headers={'Retry-After': str(llm_pool.retry_after_s)})
+
+# Эндпоинт: генерация ответа на вопрос
+# priority: меньшее значение обслуживается раньше; deadline_s: дедлайн запроса к LLM, с
+@app.post("/answer_question")
+async def answer_question(query: str = Body(...), priority: int = Query(0),
+                          deadline_s: float = Query(None, gt=0)):
+
+    # запрос поиска схожих  текстов
+    start = time.perf_counter()
+    result, query_embedding = await retrieve(query)
+    retrieved_at = time.perf_counter()
 
     # return {"similarity_scores": similarity_scores.tolist(), "retrieved_texts": retrieved_texts }
     similarity_scores = np.array(result['similarity_scores'])
     retrieved_texts = result['retrieved_texts']
 
-    # prompt_prepare(self, query: str, similarity_scores: np.ndarray, content: List[str]) -> str:
-    prompt = llm_service.prompt_prepare(query, similarity_scores, retrieved_texts)
-    answer = llm_service.answer_question(prompt)
+    if answer_cache is not None:
+        answer, cache_level = answer_cache.get(query, retrieved_texts, query_embedding)
+        if answer is not None:
+            return {'query': query, 'answer': answer, 'result_indexer': result, 'cached': cache_level,
+                    'timings_ms': {'retrieval': (retrieved_at - start) * 1000}}
+
+    # prompt_prepare(self, query: str, similarity_scores: np.ndarray, content: List[str], nearest_distance) -> str:
+    prompt = llm_service.prompt_prepare(query, similarity_scores, retrieved_texts,
+                                        result.get('nearest_distance'))
+    prepared_at = time.perf_counter()
+    try:
+        answer = await llm_pool.generate(prompt, priority, deadline_s)
+    except QueueFullError as e:
+        raise queue_full(e)
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    end = time.perf_counter()
+    if answer_cache is not None:
+        answer_cache.put(query, retrieved_texts, answer, query_embedding)
     return {
-        'query': query, 
+        'query': query,
         'answer': answer,
-        'result_indexer': result
+        'result_indexer': result,
+        # время по этапам: поиск в indexer, подготовка prompt, очередь + генерация LLM
+        'timings_ms': {'retrieval': (retrieved_at - start) * 1000,
+                       'prompt': (prepared_at - retrieved_at) * 1000,
+                       'llm': (end - prepared_at) * 1000},
     }
+
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# Эндпоинт: потоковая генерация ответа (server-sent events).
+# События: retrieval (результат indexer), token (фрагмент ответа),
+# done (ответ целиком, время до первого токена и скорость генерации), error
+@app.post("/answer_question_stream")
+async def answer_question_stream(query: str = Body(...), priority: int = Query(0),
+                                 deadline_s: float = Query(None, gt=0)):
+    start = time.perf_counter()
+    result, query_embedding = await retrieve(query)
+    retrieval_ms = (time.perf_counter() - start) * 1000
+    similarity_scores = np.array(result['similarity_scores'])
+    retrieved_texts = result['retrieved_texts']
+
+    # место в очереди LLM резервируется до начала ответа, чтобы при переполнении вернуть 429;
+    # сам запрос ставится в очередь уже при отправке тела: если клиент отключился раньше,
+    # генерация не запускается, а резерв освобождается по llm_pool.reservation_timeout_s
+    prompt, reservation = None, None
+    cached_answer, cache_level = (answer_cache.get(query, retrieved_texts, query_embedding)
+                                  if answer_cache is not None else (None, None))
+    if cached_answer is None:
+        prompt = llm_service.prompt_prepare(query, similarity_scores, retrieved_texts,
+                                        result.get('nearest_distance'))
+        try:
+            reservation = llm_pool.reserve()
+        except QueueFullError as e:
+            raise queue_full(e)
+
+    async def events():
+        yield sse_event('retrieval', {'query': query, 'result_indexer': result, 'retrieval_ms': retrieval_ms})
+
+        if cached_answer is not None:
+            yield sse_event('token', {'text': cached_answer})
+            yield sse_event('done', {'answer': cached_answer, 'cached': cache_level,
+                                     'ttft_ms': (time.perf_counter() - start) * 1000})
+            return
+
+        pieces, first_token_at, generation = [], None, None
+        try:
+            generation = await llm_pool.submit(prompt, priority, deadline_s, reservation)
+            async for piece in generation:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                pieces.append(piece)
+                yield sse_event('token', {'text': piece})
+        except Exception as e:
+            yield sse_event('error', {'detail': repr(e)})
+            return
+        finally:
+            reservation.release()
+            # клиент отключился посреди ответа — запрос снимается с очереди / генерация останавливается
+            if generation is not None:
+                await generation.aclose()
+
+        end = time.perf_counter()
+        answer = ''.join(pieces)
+        if answer_cache is not None:
+            answer_cache.put(query, retrieved_texts, answer, query_embedding)
+        generation_s = end - first_token_at if first_token_at is not None else 0.0
+        yield sse_event('done', {
+            'answer': answer,
+            'ttft_ms': ((first_token_at or end) - start) * 1000,
+            'tokens': len(pieces),
+            'tokens_per_sec': (len(pieces) - 1) / generation_s if generation_s > 0 else None,
+        })
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Статистика кэша ответов
+@app.get("/cache_stats")
+def cache_stats():
+    return answer_cache.stats() if answer_cache is not None else {"enabled": False}
+
+# Состояние пула LLM-воркеров: свободные/занятые воркеры, длина очереди, отказы
+@app.get("/llm_pool_stats")
+def llm_pool_stats():
+    return llm_pool.stats()
+
+# Метрики в формате prometheus: гистограммы этапов и HTTP-запросов, tokens/sec,
+# очередь пула LLM, попадания в кэш ответов
+@app.get("/metrics")
+def metrics():
+    body, content_type = metrics_body()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main_answer:app", host="0.0.0.0", port=8001)
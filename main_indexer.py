@@ -1,4 +1,5 @@
 
+import os
 import pandas as pd
 import  json
 import yaml
@@ -7,14 +8,24 @@ import gc
 import  torch
 import numpy as np
 import uvicorn
+import asyncio
+import contextvars
+from functools import partial
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib  import Path
 from src.custom_logging import Customlogger
 from src.preprocessing import DataPreprocessor
 from src.faiss_service import FaissIndexerService
+from src.batching import QueryBatcher
+from src.embedder import load_embedder
+from src.streaming import iter_records
+from src.telemetry import trace_middleware, setup_spans, register_stats, metrics_body
 from sentence_transformers import SentenceTransformer
 from huggingface_hub import hf_hub_download
 from typing import Literal, List, Dict, Tuple
-from fastapi import FastAPI, Body
+from fastapi import FastAPI, Body, Response
 from fastapi import HTTPException
 
 # Загружаем  словарь  config
@@ -22,7 +33,19 @@ path_config = Path.cwd()/'config'
 with open(path_config/'config.json', 'r', encoding='utf-8') as f:
     config = json.load(f)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # останавливаем пул процессов кодирования и фоновую компакцию
+    indexer.encoder.close()
+    if hasattr(indexer, 'store'):
+        indexer.store.close()
+
+
+app = FastAPI(lifespan=lifespan)
+# trace id (заголовок X-Trace-Id) и длительность запросов; этапы пишутся в logs/spans.log
+app.middleware('http')(trace_middleware)
+setup_spans(config)
 # Папка  для
 path_data = Path.cwd()/'data_raw'
 path_data.mkdir(exist_ok=True)
@@ -31,9 +54,15 @@ path_data.mkdir(exist_ok=True)
 path_model =Path.cwd()/config['folder_model']
 path_model .mkdir(exist_ok=True)
 
-# Папка для записи  файлов индекса и связанных текстов
-path_faiss =  Path.cwd()/config['folder_model']/'faiss'
-path_faiss.mkdir(exist_ok=True)
+# Шард indexer (запуск через main_router.py): INDEXER_SHARD_ID из INDEXER_NUM_SHARDS,
+# шард хранит только документы, uid которых попадает в него по хэшу
+shard_id = os.environ.get('INDEXER_SHARD_ID')
+shard = (int(shard_id), int(os.environ['INDEXER_NUM_SHARDS'])) if shard_id is not None else None
+
+# Папка для записи  файлов индекса и связанных текстов (у каждого шарда своя)
+path_faiss = (Path.cwd()/config['folder_model']/'faiss' if shard is None else
+              Path.cwd()/config['folder_model']/'shards'/f'shard_{shard[0]}'/'faiss')
+path_faiss.mkdir(parents=True, exist_ok=True)
 
 
 
@@ -43,15 +72,42 @@ path_json_init = Path.cwd()/'data_raw'/config['name_json_init']
 
 logger_1 = Customlogger()
 
-#  Инициализация модели для получения эмбеддингов
+#  Инициализация модели для получения эмбеддингов: backend torch | onnx | onnx_int8 (секция 'embedder' config);
+#  тексты для проверки согласия ONNX с torch берутся из начального JSON
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
-model_emb= SentenceTransformer(config['model_embed_name'], cache_folder=path_model)
-model_emb.max_seq_length = 512
-model_emb.to(device)
+check_texts = None
+if config.get('embedder', {}).get('backend', 'torch') != 'torch' and path_json_init.is_file():
+    # потоково: читаются только первые check_texts записей, а не весь корпус
+    check_texts = [record['text'] for record in islice(iter_records(path_json_init),
+                                                       config.get('embedder', {}).get('check_texts', 64))
+                   if record.get('text')]
+model_emb = load_embedder(config, path_model, device, logger_1, check_texts)
 
 #инициализация экземпляра класса FaissIndexerService
-indexer = FaissIndexerService(model_emb, logger_1, path_faiss, path_json_init, config)
+indexer = FaissIndexerService(model_emb, logger_1, path_faiss, path_json_init, config, shard=shard)
+
+# Ограниченный пул потоков для CPU-задач поиска (model.encode, index.search),
+# чтобы не блокировать event loop
+config_concurrency = config.get('concurrency', {})
+search_executor = ThreadPoolExecutor(max_workers=config_concurrency.get('search_workers', 4),
+                                     thread_name_prefix='search')
+
+# Коалесцер запросов: одиночные запросы /search_texts объединяются в пакеты
+config_batching = config.get('batching', {})
+batcher = QueryBatcher(partial(indexer.search_texts_batch, return_embeddings=True), logger_1,
+                       max_batch_size=config_batching.get('max_batch_size', 32),
+                       max_wait_ms=config_batching.get('max_wait_ms', 5),
+                       executor=search_executor)
+
+# Метрики хранилища и коалесцера для /metrics (читаются при каждом опросе)
+def index_metrics() -> Dict:
+    store = indexer.live_store
+    return {'n': store.ntotal, 'n_live': store.n_live, 'segments': len(store.segments)} if store is not None else {}
+
 
+register_stats('index', index_metrics)
+register_stats('batching', lambda: {key: value for key, value in batcher.stats().items() if key != 'histogram'})
+register_stats('query_cache', indexer.query_cache_stats)
 
 
 #  Эндпоинт  инициализации храанилища
@@ -72,17 +128,110 @@ def add_index(path_json_add: str = Body(...)):
     indexer.add_index(path_json_add)
     return {"status": f"Added texts from file {path_json_add} to index"}
 
+#  Эндпоинт для потоковой загрузки больших JSON / JSONL файлов порциями,
+#  прерванная загрузка того же файла продолжается с последней зафиксированной порции
+@app.post("/add_index_stream")
+def add_index_stream(path_json_add: str = Body(...)):
+    path = Path(path_json_add)
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="File not found at the specified path")
+    added = indexer.ingest_stream(path)
+    return {"status": f"Added {added} texts from file {path_json_add} to index"}
+
+# Эндпоинт добавления / замены документов по uid.
+# Принимает список документов [{"uid": ..., "ru_wiki_pageid": ..., "text": ...}],
+# прежние версии документов с теми же uid помечаются удалёнными
+@app.post("/upsert_documents")
+def upsert_documents(records: List[Dict] = Body(...)):
+    if any('uid' not in record or 'text' not in record for record in records):
+        raise HTTPException(status_code=400, detail="Each document must contain 'uid' and 'text'")
+    return indexer.upsert_documents(records)
+
+# Эндпоинт добавления документов с семантикой /add_index (почти дубликаты и uid,
+# уже имеющиеся в индексе, пропускаются); маршрутизатор шардов отправляет сюда порции /add_index
+@app.post("/add_documents")
+def add_documents(records: List[Dict] = Body(...)):
+    if any('uid' not in record or 'text' not in record for record in records):
+        raise HTTPException(status_code=400, detail="Each document must contain 'uid' and 'text'")
+    return indexer.add_documents(records)
+
+# Эндпоинт удаления документов по списку uid (без перестроения индекса)
+@app.post("/delete_documents")
+def delete_documents(uids: List[str | int] = Body(...)):
+    return indexer.delete_documents(uids)
+
 # Эндпоинт для поиска схожих текстов.
 # Принимает строку (json строка) и возвращает список расстояний и найденных текстов
+# nprobe / ef_search - опциональные query-параметры ANN-индекса (IVF / HNSW)
+# return_embedding - вернуть эмбеддинг запроса (для семантического кэша answer)
 @app.post("/search_texts")
-async def search_texts(text: str = Body(...)):
+async def search_texts(text: str = Body(...), nprobe: int = None, ef_search: int = None,
+                       return_embedding: bool = False):
 
     try:
-        similarity_scores, retrieved_texts = indexer.search_texts(text)
+        # запросы с индивидуальными параметрами поиска идут в обход коалесцера
+        if config_batching.get('enabled', True) and nprobe is None and ef_search is None:
+            similarity_scores, retrieved_texts, emb, nearest = await batcher.submit(text)
+        else:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                search_executor, contextvars.copy_context().run,
+                partial(indexer.search_texts_batch, [text], None, nprobe, ef_search, return_embeddings=True))
+            similarity_scores, retrieved_texts, emb, nearest = (part[0] for part in result)
     except Exception:
         raise HTTPException(status_code=500, detail="Vector database search error")   
 
-    return {"similarity_scores": similarity_scores.tolist(), "retrieved_texts": retrieved_texts }
+    # nearest_distance — расстояние до ближайшего по FAISS текста (при гибридном поиске он может
+    # не попасть в выдачу RRF); null — индекс пуст
+    response = {"similarity_scores": similarity_scores.tolist(), "retrieved_texts": retrieved_texts,
+                "nearest_distance": nearest if np.isfinite(nearest) else None,
+                "index_version": indexer.index_version}
+    if return_embedding:
+        response["query_embedding"] = emb.tolist()
+    return response
+
+# Эндпоинт для пакетного поиска схожих текстов.
+# Принимает список строк (json массив), k - опционально (query-параметр),
+# возвращает для каждого запроса список расстояний и найденных текстов
+@app.post("/search_texts_batch")
+async def search_texts_batch(texts: List[str] = Body(...), k: int = None,
+                             nprobe: int = None, ef_search: int = None):
+
+    try:
+        loop = asyncio.get_running_loop()
+        similarity_scores, retrieved_texts = await loop.run_in_executor(
+            search_executor, contextvars.copy_context().run, indexer.search_texts_batch, texts, k, nprobe, ef_search)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Vector database search error")
+
+    return [
+        {"similarity_scores": scores.tolist(), "retrieved_texts": texts_}
+        for scores, texts_ in zip(similarity_scores, retrieved_texts)
+    ]
+
+# Статистика коалесцера: распределение размеров пакетов
+@app.get("/batching_stats")
+def batching_stats():
+    return batcher.stats()
+
+# Статистика кэшей запросов: эмбеддинги запросов и результаты поиска (попадания / промахи)
+@app.get("/query_cache_stats")
+def query_cache_stats():
+    return indexer.query_cache_stats()
+
+# Состав хранилища и расход памяти: тип индекса и байт на вектор по сегментам
+@app.get("/index_stats")
+def index_stats():
+    store = indexer.live_store
+    if store is None:
+        raise HTTPException(status_code=404, detail="Index is not initialized")
+    return store.stats()
+
+# Метрики в формате prometheus: гистограммы этапов и HTTP-запросов, размер индекса, коалесцер
+@app.get("/metrics")
+def metrics():
+    body, content_type = metrics_body()
+    return Response(content=body, media_type=content_type)
 
 # Удаляет файлы сотояния хранилища, после возможна инициализация на новых данных
 @app.delete("/delete_index_files")
@@ -94,5 +243,5 @@ def delete_index_files():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main_indexer:app", host="0.0.0.0", port=8000)
+    uvicorn.run("main_indexer:app", host="0.0.0.0", port=int(os.environ.get('INDEXER_PORT', 8000)))
 
@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+import uvicorn
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import List, Dict
+from fastapi import FastAPI, Body, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from src.sharding import ShardRouter
+from src.streaming import iter_records, iter_chunks
+from src.telemetry import trace_middleware, setup_spans, register_stats, metrics_body
+
+# Маршрутизатор шардированного indexer: API совпадает с main_indexer, поэтому
+# answer подключается к нему через indexer_client.base_url без изменений.
+path_config = Path.cwd()/'config'
+with open(path_config/'config.json', 'r', encoding='utf-8') as f:
+    config = json.load(f)
+
+config_sharding = config.get('sharding', {})
+# список шардов можно переопределить переменной окружения ROUTER_SHARDS (URL через запятую)
+shards = os.environ.get('ROUTER_SHARDS')
+router = ShardRouter(config_sharding, shards.split(',') if shards else None, config.get('bm25', {}))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await router.start()
+    yield
+    await router.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.middleware('http')(trace_middleware)
+setup_spans(config)
+register_stats('router', router.stats)
+
+
+def shard_error(e: Exception) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"Ошибка запроса к шардам: {e!r}")
+
+
+# Поиск по всем шардам (scatter-gather), top-k объединяется по расстоянию.
+# partial=True — часть шардов не ответила за sharding.deadline_s
+@app.post("/search_texts")
+async def search_texts(text: str = Body(...), nprobe: int = None, ef_search: int = None,
+                       return_embedding: bool = False):
+    params = {key: value for key, value in
+              {'nprobe': nprobe, 'ef_search': ef_search, 'return_embedding': return_embedding}.items()
+              if value is not None}
+    try:
+        return await router.search(text, config['top_k_faiss'], params)
+    except Exception as e:
+        raise shard_error(e)
+
+
+@app.post("/search_texts_batch")
+async def search_texts_batch(texts: List[str] = Body(...), k: int = None,
+                             nprobe: int = None, ef_search: int = None):
+    params = {key: value for key, value in {'nprobe': nprobe, 'ef_search': ef_search}.items() if value is not None}
+    try:
+        return await router.search_batch(texts, k or config['top_k_faiss'], params)
+    except Exception as e:
+        raise shard_error(e)
+
+
+# Инициализация: каждый шард строит индекс из своей части name_json_init (по хэшу uid)
+@app.post("/create_index")
+async def create_index():
+    results = await router.scatter('POST', 'create_index')
+    if len(results) < router.n_shards:
+        raise HTTPException(status_code=503, detail=f"Индекс создан на {len(results)} из {router.n_shards} шардов")
+    return {"status": "Index created successfully", "shards": len(results)}
+
+
+# Добавление текстов из JSON / JSONL: записи читаются порциями (в пуле потоков, не блокируя
+# event loop) и распределяются по шардам по хэшу uid (/add_documents шарда — семантика /add_index:
+# почти дубликаты и уже имеющиеся uid пропускаются)
+@app.post("/add_index")
+async def add_index(path_json_add: str = Body(...)):
+    path = Path(path_json_add)
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="File not found at the specified path")
+    added, skipped, rejected = 0, 0, []
+    chunks = iter_chunks(iter_records(path), config.get('streaming', {}).get('chunk_size', 10_000))
+    try:
+        while (chunk := await run_in_threadpool(next, chunks, None)) is not None:
+            result = await router.add([record for record in chunk if 'uid' in record and 'text' in record])
+            added += result['added']
+            skipped += result['skipped']
+            rejected += result['rejected']
+    except Exception as e:
+        raise shard_error(e)
+    return {"status": f"Added {added} texts from file {path_json_add} to index",
+            "skipped": skipped, "rejected": len(rejected)}
+
+
+@app.post("/upsert_documents")
+async def upsert_documents(records: List[Dict] = Body(...)):
+    if any('uid' not in record or 'text' not in record for record in records):
+        raise HTTPException(status_code=400, detail="Each document must contain 'uid' and 'text'")
+    try:
+        return await router.upsert(records)
+    except Exception as e:
+        raise shard_error(e)
+
+
+@app.post("/delete_documents")
+async def delete_documents(uids: List[str | int] = Body(...)):
+    try:
+        return await router.delete(uids)
+    except Exception as e:
+        raise shard_error(e)
+
+
+# Состав шардов: /index_stats каждого шарда и счётчики таймаутов / ошибок
+@app.get("/shards_stats")
+async def shards_stats():
+    results = await router.scatter('GET', 'index_stats', router.deadline_s)
+    return {**router.stats(), 'index': {router.shards[shard]: result for shard, result in sorted(results.items())}}
+
+
+@app.delete("/delete_index_files")
+async def delete_index_files():
+    results = await router.scatter('DELETE', 'delete_index_files')
+    return {"status": "Index files deleted", "shards": len(results)}
+
+
+@app.get("/metrics")
+def metrics():
+    body, content_type = metrics_body()
+    return Response(content=body, media_type=content_type)
+
+
+def start_local_shards(n_shards: int, base_port: int) -> List[subprocess.Popen]:
+    """
+    Запускает n_shards процессов main_indexer.py на одной машине (порты base_port + i,
+    хранилище .cashe/shards/shard_<i>) и передаёт их адреса роутеру через ROUTER_SHARDS.
+    """
+    processes, urls = [], []
+    for shard in range(n_shards):
+        env = {**os.environ, 'INDEXER_SHARD_ID': str(shard), 'INDEXER_NUM_SHARDS': str(n_shards),
+               'INDEXER_PORT': str(base_port + shard)}
+        processes.append(subprocess.Popen([sys.executable, 'main_indexer.py'], env=env))
+        urls.append(f'http://localhost:{base_port + shard}/')
+    os.environ['ROUTER_SHARDS'] = ','.join(urls)
+    return processes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Маршрутизатор шардированного indexer')
+    parser.add_argument('--port', type=int, default=config_sharding.get('router_port', 8002))
+    parser.add_argument('--local-shards', type=int, default=0,
+                        help='запустить столько шардов main_indexer.py локально (порты base_port + i)')
+    parser.add_argument('--base-port', type=int, default=config_sharding.get('base_port', 8010))
+    args = parser.parse_args()
+
+    processes = start_local_shards(args.local_shards, args.base_port) if args.local_shards else []
+    try:
+        uvicorn.run("main_router:app", host="0.0.0.0", port=args.port)
+    finally:
+        for process in processes:
+            process.terminate()
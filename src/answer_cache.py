@@ -0,0 +1,154 @@
+import time
+import hashlib
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from src.caching import LRUCache
+from src.embedding_cache import normalize_text
+
+
+def normalize_query(query: str) -> str:
+    return normalize_text(query).lower().rstrip('?!. ')
+
+
+def context_fingerprint(retrieved_texts: List[str]) -> str:
+    """Отпечаток найденного контекста: одинаковые тексты в том же порядке дают один отпечаток."""
+    h = hashlib.blake2b(digest_size=16)
+    for text in retrieved_texts:
+        h.update(text.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class SemanticCache:
+    """
+    Кэш ответов по близости эмбеддингов запроса: ответ переиспользуется, если
+    косинусное расстояние до сохранённого запроса не больше max_distance.
+    Записи хранятся в кольцевом буфере фиксированного размера (вытесняются
+    самые старые) с общим TTL.
+    """
+
+    def __init__(self, max_size: int, max_distance: float, ttl_s: Optional[float] = None):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._embs = None
+        self._entries: List[Optional[Tuple[str, str, float]]] = [None] * max_size
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def get(self, emb: np.ndarray, fingerprint: Optional[str]) -> Optional[str]:
+        with self._lock:
+            if self._embs is None:
+                self.misses += 1
+                return None
+            emb = emb / (np.linalg.norm(emb) or 1.0)
+            similarity = self._embs @ emb
+            now = time.monotonic()
+            for i in np.argsort(-similarity):
+                entry = self._entries[i]
+                if entry is None or 1 - similarity[i] > self.max_distance:
+                    break
+                answer, entry_fingerprint, expires = entry
+                if expires is not None and expires <= now:
+                    continue
+                if fingerprint is None or fingerprint == entry_fingerprint:
+                    self.hits += 1
+                    return answer
+            self.misses += 1
+            return None
+
+    def put(self, emb: np.ndarray, fingerprint: str, answer: str) -> None:
+        emb = np.asarray(emb, dtype=np.float32)
+        with self._lock:
+            if self._embs is None:
+                self._embs = np.zeros((self.max_size, emb.shape[0]), dtype=np.float32)
+            self._embs[self._next] = emb / (np.linalg.norm(emb) or 1.0)
+            expires = time.monotonic() + self.ttl_s if self.ttl_s else None
+            self._entries[self._next] = (answer, fingerprint, expires)
+            self._next = (self._next + 1) % self.max_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._embs = None
+            self._entries = [None] * self.max_size
+            self._next = 0
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {'size': sum(entry is not None for entry in self._entries), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+class AnswerCache:
+    """
+    Двухуровневый кэш ответов перед LLMService.
+
+    - Уровень 1 (точный): ключ — нормализованный запрос + отпечаток найденного контекста, LRU + TTL.
+    - Уровень 2 (семантический): эмбеддинг запроса в пределах max_distance от сохранённого
+      (при same_context — только при том же контексте).
+
+    Кэш полностью сбрасывается, когда меняется версия индекса, которую indexer
+    возвращает вместе с результатами поиска (add_index, delete_index_files и т.п.).
+
+    Args:
+        config_cache (Dict): Секция 'answer_cache' конфигурации.
+        logger: Экземпляр логгера (необязательно).
+    """
+
+    def __init__(self, config_cache: Dict, logger=None):
+        self.logger = logger
+        ttl_s = config_cache.get('ttl_s')
+        self.exact = LRUCache(config_cache.get('max_size', 1024), ttl_s)
+        config_semantic = config_cache.get('semantic', {})
+        self.semantic = None
+        if config_semantic.get('enabled', True):
+            self.semantic = SemanticCache(config_semantic.get('max_size', 1024),
+                                          config_semantic.get('max_distance', 0.05), ttl_s)
+        self.same_context = config_semantic.get('same_context', True)
+        self.index_version = None
+        self._lock = threading.Lock()
+
+    def check_version(self, index_version) -> None:
+        """Сбрасывает кэш, если версия индекса изменилась."""
+        with self._lock:
+            if index_version != self.index_version:
+                if self.index_version is not None:
+                    self.clear()
+                    if self.logger is not None:
+                        self.logger.info(f'Кэш ответов сброшен: версия индекса {self.index_version} -> {index_version}')
+                self.index_version = index_version
+
+    def get(self, query: str, retrieved_texts: List[str],
+            query_embedding: Optional[np.ndarray] = None) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Returns:
+            Tuple[str | None, str | None]: ответ и уровень кэша ('exact' / 'semantic'), либо (None, None).
+        """
+        fingerprint = context_fingerprint(retrieved_texts)
+        answer = self.exact.get((normalize_query(query), fingerprint))
+        if answer is not None:
+            return answer, 'exact'
+        if self.semantic is not None and query_embedding is not None:
+            answer = self.semantic.get(query_embedding, fingerprint if self.same_context else None)
+            if answer is not None:
+                return answer, 'semantic'
+        return None, None
+
+    def put(self, query: str, retrieved_texts: List[str], answer: str,
+            query_embedding: Optional[np.ndarray] = None) -> None:
+        fingerprint = context_fingerprint(retrieved_texts)
+        self.exact.put((normalize_query(query), fingerprint), answer)
+        if self.semantic is not None and query_embedding is not None:
+            self.semantic.put(query_embedding, fingerprint, answer)
+
+    def clear(self) -> None:
+        self.exact.clear()
+        if self.semantic is not None:
+            self.semantic.clear()
+
+    def stats(self) -> Dict:
+        return {'index_version': self.index_version, 'exact': self.exact.stats(),
+                'semantic': self.semantic.stats() if self.semantic is not None else None}
@@ -0,0 +1,112 @@
+import asyncio
+import contextvars
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Tuple
+from src.telemetry import trace_id_var
+
+
+class QueryBatcher:
+    """
+    Асинхронный коалесцер поисковых запросов.
+
+    Запросы, пришедшие в пределах окна max_wait_ms (или пока не набралось
+    max_batch_size запросов), объединяются в один пакет и обрабатываются одним
+    вызовом search_fn(texts). Каждый вызывающий получает свой срез результата.
+    search_fn выполняется с trace id всех запросов пакета (через запятую),
+    чтобы этапы поиска в журнале spans были связаны с запросами.
+
+    Args:
+        search_fn (Callable): Пакетная функция поиска, например FaissIndexerService.search_texts_batch.
+        logger: Экземпляр логгера (Customlogger).
+        max_batch_size (int): Максимальный размер пакета.
+        max_wait_ms (float): Максимальное время ожидания набора пакета, мс.
+        executor: Пул потоков для выполнения search_fn (None — пул по умолчанию event loop).
+        log_every (int): Как часто (в пакетах) писать распределение размеров пакетов в лог.
+    """
+
+    def __init__(self,
+                 search_fn: Callable[[List[str]], Tuple[list, list]],
+                 logger,
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0,
+                 executor=None,
+                 log_every: int = 1000):
+        self.search_fn = search_fn
+        self.logger = logger
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self.log_every = log_every
+
+        self._queue = None
+        self._worker = None
+        self.batch_sizes = Counter()
+
+    async def submit(self, text: str):
+        """
+        Ставит запрос в очередь и ожидает результат своего элемента пакета.
+
+        Returns:
+            Tuple: i-е элементы каждой части результата search_fn, например (расстояния, тексты).
+        """
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future, trace_id_var.get()))
+        return await future
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future, str]]:
+        # ждём первый запрос без ограничения, затем добираем пакет до дедлайна
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            texts = [text for text, _, _ in batch]
+            self._record(len(batch))
+            context = contextvars.copy_context()
+            context.run(trace_id_var.set, ','.join(trace_id for _, _, trace_id in batch if trace_id) or None)
+            try:
+                result = await loop.run_in_executor(self.executor, context.run, self.search_fn, texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for i, (_, future, _) in enumerate(batch):
+                if not future.done():
+                    future.set_result(tuple(part[i] for part in result))
+
+    def _record(self, size: int) -> None:
+        self.batch_sizes[size] += 1
+        n_batches = sum(self.batch_sizes.values())
+        if self.log_every and n_batches % self.log_every == 0:
+            self.logger.info(f'QueryBatcher: распределение размеров пакетов {self.stats()}')
+
+    def stats(self) -> Dict:
+        """
+        Returns:
+            Dict: число пакетов и запросов, средний размер пакета и гистограмма размеров.
+        """
+        n_batches = sum(self.batch_sizes.values())
+        n_queries = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            'batches': n_batches,
+            'queries': n_queries,
+            'mean_batch_size': n_queries / n_batches if n_batches else 0.0,
+            'histogram': dict(sorted(self.batch_sizes.items())),
+        }
@@ -0,0 +1,169 @@
+import re
+import hashlib
+import numpy as np
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+# слова кириллицей/латиницей и числа (как в DataPreprocessor._check_min_words, плюс цифры:
+# в вопросах RuBQ важны годы и количества)
+_TOKEN = re.compile(r'[а-яёa-z0-9]+')
+
+BM25_PARTS = ('terms', 'offsets', 'docs', 'tf', 'lens')
+
+
+def tokenize(text: str, stem_prefix: int = 6) -> List[str]:
+    """
+    Токенизация для BM25: нижний регистр, ё -> е, слова усекаются до stem_prefix
+    символов (грубый стемминг для русской морфологии), числа не усекаются.
+    """
+    tokens = _TOKEN.findall(text.lower().replace('ё', 'е'))
+    if not stem_prefix:
+        return tokens
+    return [token if token.isdigit() else token[:stem_prefix] for token in tokens]
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def term_hashes(terms: Iterable[str]) -> np.ndarray:
+    return np.fromiter((term_hash(term) for term in terms), dtype=np.uint64)
+
+
+def bm25_paths(prefix: Path) -> Dict[str, Path]:
+    prefix = Path(prefix)
+    return {part: prefix.with_name(f'{prefix.name}.bm25_{part}.npy') for part in BM25_PARTS}
+
+
+def build_postings(texts: Iterable[str], stem_prefix: int = 6) -> Dict[str, np.ndarray]:
+    """
+    Строит инвертированный индекс на массивах: термины (64-битные хэши,
+    отсортированы), смещения списков, номера документов (int32),
+    частоты (uint16) и длины документов.
+    """
+    hashes, docs, tfs, lens = [], [], [], []
+    cache: Dict[str, int] = {}
+    for doc, text in enumerate(texts):
+        tokens = tokenize(text, stem_prefix)
+        lens.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            h = cache.get(term)
+            if h is None:
+                h = cache[term] = term_hash(term)
+            hashes.append(h)
+            docs.append(doc)
+            tfs.append(tf)
+
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    docs = np.asarray(docs, dtype=np.int32)
+    order = np.lexsort((docs, hashes))
+    hashes, docs = hashes[order], docs[order]
+    terms, starts = np.unique(hashes, return_index=True)
+    return {
+        'terms': terms,
+        'offsets': np.append(starts, len(hashes)).astype(np.int64),
+        'docs': docs,
+        'tf': np.minimum(np.asarray(tfs, dtype=np.int64)[order], np.iinfo(np.uint16).max).astype(np.uint16),
+        'lens': np.asarray(lens, dtype=np.int32),
+    }
+
+
+class BM25Postings:
+    """
+    Инвертированный индекс BM25 одного сегмента (файлы <prefix>.bm25_*.npy,
+    открываются через mmap).
+
+    IDF и средняя длина документа передаются снаружи: они считаются по всем
+    сегментам хранилища, чтобы оценки сегментов были сопоставимы.
+    """
+
+    def __init__(self, prefix: Path):
+        paths = bm25_paths(prefix)
+        for part in BM25_PARTS:
+            setattr(self, part, np.load(paths[part], mmap_mode='r'))
+        self.n_docs = len(self.lens)
+        self.total_len = int(self.lens.sum())
+
+    @staticmethod
+    def exists(prefix: Path) -> bool:
+        return all(path.is_file() for path in bm25_paths(prefix).values())
+
+    def _lookup(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        pos = np.searchsorted(self.terms, hashes)
+        pos_clipped = np.minimum(pos, len(self.terms) - 1)
+        found = (pos < len(self.terms)) & (self.terms[pos_clipped] == hashes) if len(self.terms) else \
+            np.zeros(len(hashes), dtype=bool)
+        return pos_clipped, found
+
+    def df(self, hashes: np.ndarray) -> np.ndarray:
+        """Документная частота терминов в сегменте (0 — термина нет)."""
+        pos, found = self._lookup(hashes)
+        if not len(self.terms):
+            return np.zeros(len(hashes), dtype=np.int64)
+        return np.where(found, self.offsets[pos + 1] - self.offsets[pos], 0)
+
+    def search(self, hashes: np.ndarray, idf: np.ndarray, avgdl: float, k: int,
+               k1: float = 1.2, b: float = 0.75) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k документов сегмента по BM25 (обработка по терминам с отсечением MaxScore).
+
+        Термины обрабатываются по убыванию idf. Как только сумма верхних границ
+        вклада оставшихся терминов (idf·(k1+1)) становится меньше k-й лучшей
+        оценки, новые документы в top-k попасть уже не могут: оставшиеся
+        термины только досчитывают оценки найденных кандидатов.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: оценки (по убыванию) и номера документов.
+        """
+        pos, found = self._lookup(hashes)
+        order = [i for i in np.argsort(-idf, kind='stable') if found[i] and idf[i] > 0]
+        upper = np.array([idf[i] * (k1 + 1) for i in order])
+        remaining = np.append(np.cumsum(upper[::-1])[::-1], 0.0)[1:] if len(order) else upper
+
+        cand_docs = np.empty(0, dtype=np.int64)
+        cand_scores = np.empty(0, dtype=np.float32)
+        pruned = False
+        for j, i in enumerate(order):
+            start, end = self.offsets[pos[i]], self.offsets[pos[i] + 1]
+            docs = np.asarray(self.docs[start:end], dtype=np.int64)
+            tf = np.asarray(self.tf[start:end], dtype=np.float32)
+            norm = k1 * (1 - b + b * np.asarray(self.lens[docs], dtype=np.float32) / avgdl)
+            contrib = (idf[i] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+            if pruned:
+                idx = np.minimum(np.searchsorted(cand_docs, docs), len(cand_docs) - 1)
+                hit = cand_docs[idx] == docs
+                cand_scores[idx[hit]] += contrib[hit]
+                continue
+
+            cand_docs, inverse = np.unique(np.concatenate([cand_docs, docs]), return_inverse=True)
+            cand_scores = np.bincount(inverse, weights=np.concatenate([cand_scores, contrib]),
+                                      minlength=len(cand_docs)).astype(np.float32)
+            if len(cand_docs) >= k and remaining[j] < np.partition(cand_scores, -k)[-k]:
+                pruned = True
+
+        if len(cand_docs) > k:
+            top = np.argpartition(-cand_scores, k - 1)[:k]
+            cand_docs, cand_scores = cand_docs[top], cand_scores[top]
+        top = np.argsort(-cand_scores, kind='stable')
+        return cand_scores[top], cand_docs[top]
+
+
+def bm25_idf(df: np.ndarray, n_docs: int) -> np.ndarray:
+    """IDF BM25 (вариант Lucene, всегда неотрицательный)."""
+    return np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+
+def reciprocal_rank_fusion(rankings: List[List], rrf_k: int = 60) -> List[Tuple[object, float]]:
+    """
+    Объединяет ранжированные списки ключей: score = Σ 1 / (rrf_k + rank).
+
+    Returns:
+        List[Tuple[key, float]]: ключи по убыванию итоговой оценки.
+    """
+    scores: Dict = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])
@@ -0,0 +1,119 @@
+import re
+from typing import Callable, Dict, List, Optional, Set
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+_WORD = re.compile(r'\w+')
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence for sentence in _SENTENCE_END.split(text.strip()) if sentence]
+
+
+def shingles(text: str, size: int) -> Set[tuple]:
+    """Множество n-грамм слов (в нижнем регистре) для оценки похожести текстов."""
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a: Set, b: Set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextPacker:
+    """
+    Упаковка найденных абзацев в контекст prompt с ограничением по токенам.
+
+    Абзацы берутся в порядке оценки (от ближайшего к запросу):
+    - почти дубликаты уже выбранных абзацев (сходство Жаккара по n-граммам слов
+      не меньше dedup_threshold) отбрасываются;
+    - абзац длиннее max_passage_tokens обрезается по границам предложений;
+    - абзац, не помещающийся в остаток бюджета целиком, сокращается до
+      помещающихся первых предложений (если остаток не меньше min_fragment_tokens),
+      после чего упаковка заканчивается;
+    - если не помещается уже первое предложение, оно обрезается по токенам.
+
+    Args:
+        count_tokens (Callable): Функция подсчёта токенов текста (токенизатор llama).
+        config_packing (Dict): Секция 'context_packing' конфигурации.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], config_packing: Dict):
+        self.count_tokens = count_tokens
+        self.max_context_tokens = config_packing.get('max_context_tokens')
+        self.max_passage_tokens = config_packing.get('max_passage_tokens', 1024)
+        self.min_fragment_tokens = config_packing.get('min_fragment_tokens', 32)
+        self.dedup_threshold = config_packing.get('dedup_threshold', 0.8)
+        self.shingle_size = config_packing.get('shingle_size', 3)
+        self.separator = '\n\n'
+        self._separator_tokens = count_tokens(self.separator)
+
+    def _truncate(self, text: str, budget: int) -> Optional[str]:
+        # самый длинный префикс текста не больше budget токенов (бинарный поиск по длине:
+        # число токенов префикса не убывает с ней), обрезанный по границе слова, если она есть
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(text[:middle]) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        head = text[:low]
+        if low < len(text) and not text[low].isspace() and not head[-1:].isspace() and len(head.split()) > 1:
+            head = head.rsplit(None, 1)[0]
+        return head.strip() or None
+
+    def _head(self, text: str, budget: int) -> Optional[str]:
+        # первые предложения абзаца, суммарно не больше budget токенов;
+        # если не помещается и первое предложение, оно обрезается по токенам
+        selected, used = [], 0
+        sentences = split_sentences(text)
+        for sentence in sentences:
+            tokens = self.count_tokens(sentence)
+            if used + tokens > budget:
+                break
+            selected.append(sentence)
+            used += tokens
+        if not selected and sentences:
+            return self._truncate(sentences[0], budget)
+        return ' '.join(selected) if selected else None
+
+    def pack(self, passages: List[str], budget: int) -> List[str]:
+        """
+        Args:
+            passages (List[str]): Абзацы в порядке убывания релевантности.
+            budget (int): Доступное число токенов под контекст.
+        Returns:
+            List[str]: Выбранные (возможно, сокращённые) абзацы.
+        """
+        if self.max_context_tokens is not None:
+            budget = min(budget, self.max_context_tokens)
+
+        packed, packed_shingles, used = [], [], 0
+        for passage in passages:
+            passage_shingles = shingles(passage, self.shingle_size)
+            if any(jaccard(passage_shingles, other) >= self.dedup_threshold for other in packed_shingles):
+                continue
+
+            remaining = budget - used - (self._separator_tokens if packed else 0)
+            tokens = self.count_tokens(passage)
+            if self.max_passage_tokens and tokens > self.max_passage_tokens:
+                passage = self._head(passage, min(self.max_passage_tokens, remaining))
+                if passage is None:
+                    continue
+                tokens = self.count_tokens(passage)
+
+            if tokens > remaining:
+                if remaining >= self.min_fragment_tokens:
+                    fragment = self._head(passage, remaining)
+                    if fragment is not None:
+                        packed.append(fragment)
+                break
+
+            packed.append(passage)
+            packed_shingles.append(passage_shingles)
+            used = budget - remaining + tokens
+        return packed
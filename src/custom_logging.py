@@ -1,5 +1,6 @@
 import logging
 from pathlib import Path
+from src.telemetry import queue_logging
 
 class Customlogger:
     '''
@@ -14,6 +15,8 @@ class Customlogger:
     - info_file (str): имя файла для INFO и WARNING (по умолчанию 'info.log').
     - error_file (str): имя файла для ERROR (по умолчанию 'error.log').
     - logger_name (str): имя логгера (по умолчанию 'logger_1').
+    - use_queue (bool): писать файлы в фоновом потоке через QueueHandler / QueueListener
+      (по умолчанию True), чтобы запись в файл не задерживала обработку запроса.
 
     Основные методы:
     - info(msg): записывает информационное сообщение.
@@ -22,7 +25,8 @@ class Customlogger:
     - warning_console(msg): выводит предупреждение в консоль.
     - error_console(msg): выводит ошибку в консоль.
     '''
-    def __init__(self, log_dir='logs', info_file='info.log', error_file='error.log', logger_name='logger_1'):
+    def __init__(self, log_dir='logs', info_file='info.log', error_file='error.log', logger_name='logger_1',
+                 use_queue=True):
         base_dir = Path.cwd()
         log_dir_path = base_dir / log_dir
         log_dir_path.mkdir(exist_ok=True)
@@ -53,6 +57,7 @@ class Customlogger:
 
         self.logger.addHandler(info_handler)
         self.logger.addHandler(error_handler)
+        self.listener = queue_logging(self.logger) if use_queue else None
 
     def info(self, msg):
         self.logger.info(msg)
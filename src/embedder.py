@@ -0,0 +1,139 @@
+import re
+import json
+import hashlib
+import time
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional
+from sentence_transformers import SentenceTransformer
+
+BACKENDS = ('torch', 'onnx', 'onnx_int8')
+
+
+def _export_dir(path_model: Path, model_name: str) -> Path:
+    return Path(path_model)/'onnx'/re.sub(r'[^\w.-]+', '--', model_name)
+
+
+def _quantized_file(quantization: str) -> str:
+    return f'onnx/model_qint8_{quantization}.onnx'
+
+
+def agreement(reference: np.ndarray, embs: np.ndarray) -> Dict:
+    """Косинусное сходство эмбеддингов backend с эталонными (torch) построчно: среднее и минимум."""
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    embs = embs / np.linalg.norm(embs, axis=1, keepdims=True)
+    cosine = np.sum(reference * embs, axis=1)
+    return {'mean_cosine': float(cosine.mean()), 'min_cosine': float(cosine.min())}
+
+
+def load_torch(model_name: str, path_model: Path, device: str = 'cpu',
+               max_seq_length: int = 512) -> SentenceTransformer:
+    model = SentenceTransformer(model_name, cache_folder=path_model, device=device)
+    model.max_seq_length = max_seq_length
+    return model
+
+
+def load_onnx(model_name: str, path_model: Path, backend: str, config_embedder: Dict,
+              max_seq_length: int = 512, logger=None) -> SentenceTransformer:
+    """
+    Модель ONNX Runtime из локальной директории экспорта (.cashe/onnx/<модель>);
+    при первом запуске граф экспортируется (и для onnx_int8 динамически
+    квантуется в int8) и сохраняется туда.
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    path_export = _export_dir(path_model, model_name)
+    if not (path_export/'onnx'/'model.onnx').is_file():
+        model = SentenceTransformer(model_name, backend='onnx', cache_folder=path_model, device='cpu')
+        model.save(str(path_export))
+        if logger is not None:
+            logger.info(f'Модель {model_name} экспортирована в ONNX: {path_export}')
+
+    model_kwargs = {'provider': 'CPUExecutionProvider'}
+    if backend == 'onnx_int8':
+        quantization = config_embedder.get('quantization', 'avx512_vnni')
+        if not (path_export/_quantized_file(quantization)).is_file():
+            model = SentenceTransformer(str(path_export), backend='onnx', device='cpu')
+            export_dynamic_quantized_onnx_model(model, quantization, str(path_export))
+            if logger is not None:
+                logger.info(f'Граф ONNX квантован в int8 ({quantization}): {path_export/_quantized_file(quantization)}')
+        model_kwargs['file_name'] = _quantized_file(quantization)
+
+    model = SentenceTransformer(str(path_export), backend='onnx', device='cpu', model_kwargs=model_kwargs)
+    model.max_seq_length = max_seq_length
+    return model
+
+
+def load_embedder(config: Dict, path_model: Path, device: str = 'cpu', logger=None,
+                  check_texts: Optional[List[str]] = None) -> SentenceTransformer:
+    """
+    Модель эмбеддингов по секции 'embedder' конфигурации:
+    - torch — SentenceTransformer на PyTorch (на device);
+    - onnx — экспортированный граф ONNX Runtime (CPU);
+    - onnx_int8 — тот же граф с динамической int8-квантизацией весов (CPU).
+
+    Для onnx / onnx_int8 при agreement_check эмбеддинги check_texts сравниваются
+    с torch (косинус) и замеряется скорость обоих; результат пишется в лог и
+    agreement_<backend>.json директории экспорта (проверка выполняется один раз и
+    повторяется, если изменились модель, quantization, max_seq_length или check_texts —
+    поле key отчёта). Если минимальный косинус меньше min_cosine, используется torch.
+
+    Returns:
+        SentenceTransformer: Модель с max_seq_length из config_embedder; выбранный
+        backend — в атрибуте embed_backend (входит в ключ кэша эмбеддингов).
+    """
+    config_embedder = config.get('embedder', {})
+    backend = config_embedder.get('backend', 'torch')
+    max_seq_length = config_embedder.get('max_seq_length', 512)
+    model_name = config['model_embed_name']
+    if backend not in BACKENDS:
+        raise ValueError(f'Неизвестный backend эмбеддингов {backend!r}, допустимы {BACKENDS}')
+    if backend == 'torch' or device != 'cpu':
+        model = load_torch(model_name, path_model, device, max_seq_length)
+        model.embed_backend = 'torch'
+        return model
+
+    model = load_onnx(model_name, path_model, backend, config_embedder, max_seq_length, logger)
+    model.embed_backend = backend
+    if not config_embedder.get('agreement_check', True) or not check_texts:
+        return model
+
+    texts_hash = hashlib.blake2b(digest_size=16)
+    for text in check_texts:
+        texts_hash.update(text.encode('utf-8') + b'\0')
+    key = {'model': model_name, 'backend': backend, 'max_seq_length': max_seq_length,
+           'quantization': config_embedder.get('quantization', 'avx512_vnni') if backend == 'onnx_int8' else None,
+           'check_texts': texts_hash.hexdigest()}
+    path_report, report = _export_dir(path_model, model_name)/f'agreement_{backend}.json', None
+    if path_report.is_file():
+        with open(path_report, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    if report is None or report.get('key') != key:
+        reference_model = load_torch(model_name, path_model, 'cpu', max_seq_length)
+        report = {'key': key, 'backend': backend, 'texts': len(check_texts)}
+        embs = {}
+        for name, candidate in (('torch', reference_model), (backend, model)):
+            candidate.encode(check_texts[:2])  # прогрев
+            start = time.perf_counter()
+            embs[name] = np.asarray(candidate.encode(check_texts, batch_size=config.get('encoding', {}).get('batch_size', 16)),
+                                    dtype=np.float32)
+            report[f'{name}_texts_per_sec'] = len(check_texts) / (time.perf_counter() - start)
+        report.update(agreement(embs['torch'], embs[backend]))
+        del reference_model
+        with open(path_report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+
+    ok = report['min_cosine'] >= config_embedder.get('min_cosine', 0.99)
+    if logger is not None:
+        message = (f"Backend эмбеддингов {backend}: косинус с torch средний {report['mean_cosine']:.4f}, "
+                   f"минимальный {report['min_cosine']:.4f}; {report[f'{backend}_texts_per_sec']:.1f} текстов/с "
+                   f"против {report['torch_texts_per_sec']:.1f} у torch")
+        if ok:
+            logger.info(message)
+        else:
+            logger.warning(f'{message} — ниже min_cosine, используется torch')
+    if ok:
+        return model
+    model = load_torch(model_name, path_model, device, max_seq_length)
+    model.embed_backend = 'torch'
+    return model
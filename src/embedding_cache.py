@@ -0,0 +1,170 @@
+import os
+import re
+import json
+import fcntl
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+from pathlib import Path
+from typing import Callable, Dict, List
+
+KEY_SIZE = 16
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для ключа кэша: NFC, схлопывание пробелов, strip."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=KEY_SIZE).digest()
+
+
+class EmbeddingCache:
+    """
+    Дисковый кэш эмбеддингов с ключом (модель, max_seq_length, хэш нормализованного текста).
+
+    Для каждой пары (модель, max_seq_length) ведётся отдельная директория:
+    - vectors.bin — векторы подряд (float16 или float32), дописываются в конец;
+    - keys.bin — 16-байтовые хэши текстов в том же порядке;
+    - meta.json — модель, размерность и тип хранения.
+    Векторы пишутся раньше ключей, поэтому после сбоя при загрузке
+    учитывается только согласованный префикс. Директорию могут разделять
+    несколько процессов (воркеры uvicorn, процессы кодирования): запись идёт под
+    файловой блокировкой (lock), перед ней подчитываются строки, дописанные другими.
+
+    Args:
+        path_dir (Path): Корневая директория кэша.
+        model_name (str): Имя модели эмбеддингов.
+        max_seq_length (int): Максимальная длина последовательности модели.
+        dim (int): Размерность эмбеддингов.
+        dtype (str): Тип хранения: 'float16' или 'float32'.
+        logger: Экземпляр логгера (Customlogger).
+    """
+
+    def __init__(self, path_dir: Path, model_name: str, max_seq_length: int, dim: int,
+                 dtype: str = 'float16', logger=None):
+        namespace = hashlib.sha1(f'{model_name}|{max_seq_length}'.encode('utf-8')).hexdigest()[:12]
+        self.path_dir = Path(path_dir)/namespace
+        self.path_dir.mkdir(parents=True, exist_ok=True)
+        self.path_vectors = self.path_dir/'vectors.bin'
+        self.path_keys = self.path_dir/'keys.bin'
+        self.path_lock = self.path_dir/'lock'
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.logger = logger
+        self._lock = threading.Lock()
+
+        meta = {'model_name': model_name, 'max_seq_length': max_seq_length, 'dim': dim, 'dtype': self.dtype.name}
+        path_meta = self.path_dir/'meta.json'
+        if path_meta.is_file():
+            with open(path_meta, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored != meta:
+                # другой формат хранения — кэш создаётся заново
+                for path in (self.path_vectors, self.path_keys):
+                    path.unlink(missing_ok=True)
+        with open(path_meta, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=4)
+        self._load()
+
+    def _load(self) -> None:
+        self._rows: Dict[bytes, int] = {}
+        self._n = 0
+        self._sync()
+        self._open_vectors()
+
+    def _consistent_rows(self) -> int:
+        # число строк, для которых записаны и вектор, и ключ
+        row_bytes = self.dim * self.dtype.itemsize
+        n_vectors = self.path_vectors.stat().st_size // row_bytes if self.path_vectors.is_file() else 0
+        n_keys = self.path_keys.stat().st_size // KEY_SIZE if self.path_keys.is_file() else 0
+        return min(n_vectors, n_keys)
+
+    def _sync(self) -> None:
+        # подчитывает ключи строк, дописанных после последнего чтения (в том числе другими процессами)
+        n = self._consistent_rows()
+        if n > self._n:
+            keys = np.fromfile(self.path_keys, dtype=f'S{KEY_SIZE}', count=n - self._n, offset=self._n * KEY_SIZE)
+            self._rows.update((bytes(key), self._n + row) for row, key in enumerate(keys))
+            self._n = n
+            self._open_vectors()
+
+    def _open_vectors(self) -> None:
+        self._vectors = (np.memmap(self.path_vectors, dtype=self.dtype, mode='r', shape=(self._n, self.dim))
+                         if self._n else np.empty((0, self.dim), dtype=self.dtype))
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _append(self, keys: List[bytes], embs: np.ndarray) -> None:
+        # вызывается под self._lock; между процессами запись упорядочивает файловая блокировка
+        with open(self.path_lock, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._sync()
+                # тексты, которые успел дописать параллельный вызов или другой процесс, повторно не пишутся
+                new = [j for j, key in enumerate(keys) if key not in self._rows]
+                if not new:
+                    return
+                keys = [keys[j] for j in new]
+                # хвост прерванной записи (вектор без ключа) отрезается, новые строки дописываются в конец
+                for path, row_bytes in ((self.path_vectors, self.dim * self.dtype.itemsize), (self.path_keys, KEY_SIZE)):
+                    if path.is_file() and path.stat().st_size > self._n * row_bytes:
+                        os.truncate(path, self._n * row_bytes)
+                with open(self.path_vectors, 'ab') as f:
+                    f.write(np.ascontiguousarray(embs[new], dtype=self.dtype).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.path_keys, 'ab') as f:
+                    f.write(b''.join(keys))
+                self._rows.update((key, self._n + row) for row, key in enumerate(keys))
+                self._n += len(keys)
+                self._open_vectors()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Возвращает эмбеддинги текстов: найденные берутся из кэша, для промахов
+        вызывается encode_fn (один раз на уникальный текст), результат дописывается в кэш.
+
+        Args:
+            texts (List[str]): Тексты.
+            encode_fn (Callable): Функция кодирования списка текстов в матрицу (n, dim).
+        Returns:
+            np.ndarray: Матрица эмбеддингов float32 размера (len(texts), dim).
+        """
+        keys = [text_key(text) for text in texts]
+        result = np.empty((len(texts), self.dim), dtype=np.float32)
+
+        with self._lock:
+            self._sync()
+            rows = [self._rows.get(key) for key in keys]
+            hit_pos = [i for i, row in enumerate(rows) if row is not None]
+            if hit_pos:
+                result[hit_pos] = self._vectors[[rows[i] for i in hit_pos]]
+
+        # уникальные промахи
+        miss_first: Dict[bytes, int] = {}
+        for i, row in enumerate(rows):
+            if row is None and keys[i] not in miss_first:
+                miss_first[keys[i]] = i
+        if miss_first:
+            miss_keys = list(miss_first)
+            # кодирование — вне блокировки: параллельные вызовы не ждут друг друга
+            embs = np.asarray(encode_fn([texts[miss_first[key]] for key in miss_keys]), dtype=np.float32)
+            with self._lock:
+                self._append(miss_keys, embs)
+            # промахи проходят то же приведение типа, что и попадания
+            embs = embs.astype(self.dtype).astype(np.float32)
+            by_key = dict(zip(miss_keys, embs))
+            for i, row in enumerate(rows):
+                if row is None:
+                    result[i] = by_key[keys[i]]
+
+        if self.logger is not None and texts:
+            self.logger.info(f'Кэш эмбеддингов: {len(hit_pos)}/{len(texts)} попаданий '
+                             f'({len(hit_pos) / len(texts):.1%}), закодировано {len(miss_first)}, размер кэша {self._n}')
+        return result
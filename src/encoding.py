@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+import numpy as np
+from tqdm import tqdm
+from contextlib import contextmanager
+from typing import Dict, List
+from sentence_transformers import SentenceTransformer
+
+_THREAD_ENV = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+@contextmanager
+def _thread_env(threads: int):
+    # дочерние процессы пула (spawn) читают число потоков torch из окружения при старте
+    saved = {name: os.environ.get(name) for name in _THREAD_ENV}
+    try:
+        if threads:
+            for name in _THREAD_ENV:
+                os.environ[name] = str(threads)
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+class CorpusEncoder:
+    """
+    Кодирование корпуса для построения индекса.
+
+    При workers <= 1 используется обычный model.encode в текущем процессе.
+    Иначе тексты делятся на порции и кодируются пулом процессов
+    sentence-transformers (start_multi_process_pool) на CPU; число потоков
+    torch в каждом процессе ограничивается threads_per_worker, чтобы процессы
+    не конкурировали за ядра. Пул запускается при первом большом задании и
+    живёт до close().
+
+    При length_bucketing тексты перед кодированием сортируются по длине в
+    токенах и режутся на пакеты batch_size подряд, так что в пакет попадают
+    тексты близкой длины и паддинг минимален; затем исходный порядок
+    восстанавливается. В лог пишутся токены/с и доля паддинга (с сортировкой
+    и для исходного порядка).
+
+    Args:
+        model (SentenceTransformer): Модель эмбеддингов.
+        config_encoding (Dict): Секция 'encoding' конфигурации
+            (batch_size, workers, threads_per_worker, chunk_size, min_parallel_texts, length_bucketing).
+        logger: Экземпляр логгера (Customlogger).
+    """
+
+    def __init__(self, model: SentenceTransformer, config_encoding: Dict, logger=None):
+        self.model = model
+        self.logger = logger
+        self.batch_size = config_encoding.get('batch_size', 16)
+        self.workers = config_encoding.get('workers', 1)
+        if getattr(model, 'embed_backend', 'torch') != 'torch' and self.workers > 1:
+            # сессия ONNX Runtime сама использует все ядра и не передаётся в процессы пула
+            self.workers = 1
+        self.threads_per_worker = config_encoding.get('threads_per_worker')
+        if self.workers > 1 and not self.threads_per_worker:
+            self.threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.chunk_size = config_encoding.get('chunk_size')
+        self.min_parallel_texts = config_encoding.get('min_parallel_texts', 1000)
+        self.length_bucketing = config_encoding.get('length_bucketing', True)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with _thread_env(self.threads_per_worker):
+                self._pool = self.model.start_multi_process_pool(target_devices=['cpu'] * self.workers)
+            if self.logger is not None:
+                self.logger.info(f'Запущен пул кодирования: {self.workers} процессов по {self.threads_per_worker} потоков')
+        return self._pool
+
+    def token_lengths(self, texts: List[str]) -> np.ndarray:
+        """Длины текстов в токенах с учётом спецтокенов и усечения до max_seq_length."""
+        encoded = self.model.tokenizer(texts, truncation=True, max_length=self.model.max_seq_length,
+                                       return_attention_mask=False, return_token_type_ids=False)
+        return np.fromiter((len(ids) for ids in encoded['input_ids']), dtype=np.int64, count=len(texts))
+
+    def padding_ratio(self, lengths: np.ndarray) -> float:
+        """Доля паддинг-токенов при разбиении lengths (в данном порядке) на пакеты batch_size."""
+        padded = sum(int(batch.max()) * len(batch)
+                     for batch in np.array_split(lengths, range(self.batch_size, len(lengths), self.batch_size)))
+        return 1 - lengths.sum() / padded if padded else 0.0
+
+    def _encode_batches(self, texts: List[str]) -> np.ndarray:
+        if self.workers > 1 and len(texts) >= self.min_parallel_texts:
+            with self._lock:
+                return self.model.encode_multi_process(texts, self._get_pool(), batch_size=self.batch_size,
+                                                       chunk_size=self.chunk_size, show_progress_bar=True)
+        if not self.length_bucketing:
+            return self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=True)
+        # model.encode сам пересортирует тексты по длине в символах, поэтому
+        # пакеты, уже отсортированные по токенам, передаются по одному
+        return np.vstack([self.model.encode(texts[i:i + self.batch_size], batch_size=self.batch_size)
+                          for i in tqdm(range(0, len(texts), self.batch_size), desc='Batches')])
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Матрица эмбеддингов float32 размера (len(texts), dim).
+        """
+        if len(texts) == 0:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        start = time.perf_counter()
+        lengths = self.token_lengths(texts)
+        if self.length_bucketing:
+            order = np.argsort(-lengths, kind='stable')
+            embs_sorted = np.asarray(self._encode_batches([texts[i] for i in order]), dtype=np.float32)
+            embs = np.empty_like(embs_sorted)
+            embs[order] = embs_sorted
+            padding = self.padding_ratio(lengths[order])
+        else:
+            embs = np.asarray(self._encode_batches(texts), dtype=np.float32)
+            padding = self.padding_ratio(lengths)
+        elapsed = time.perf_counter() - start
+
+        if self.logger is not None:
+            self.logger.info(f'Закодировано {len(texts)} текстов за {elapsed:.1f} с '
+                             f'({len(texts) / elapsed:.1f} текстов/с, {lengths.sum() / elapsed:.0f} токенов/с), '
+                             f'паддинг {padding:.1%} (без сортировки {self.padding_ratio(lengths):.1%})')
+        return embs
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self.model.stop_multi_process_pool(self._pool)
+            self._pool = None
@@ -4,12 +4,22 @@ import pandas as pd
 import  json
 import pickle
 import gc
+import threading
+from itertools import islice
 import  torch
 from pathlib  import Path
 from src.custom_logging import Customlogger
 from src.preprocessing import DataPreprocessor
+from src.text_store import TextStore
+from src.segments import SegmentStore
+from src.embedding_cache import EmbeddingCache, text_key, normalize_text
+from src.caching import LRUCache
+from src.streaming import iter_records, iter_chunks
+from src.encoding import CorpusEncoder
+from src.telemetry import span
+from src.sharding import shard_of, shard_mask
 from sentence_transformers import SentenceTransformer
-from typing import Literal, List, Dict, Tuple
+from typing import Literal, List, Dict, Optional, Tuple
 
 class FaissIndexerService:
     """
@@ -26,6 +36,8 @@ class FaissIndexerService:
         path_faiss (Path): Путь к директории для хранения индекса и связанного  файла с текстами.
         path_json_init (Path): Путь к исходному JSON-файлу с текстами.
         config (Dict): Словарь с конфигурационными параметрами.
+        shard (Tuple[int, int]): (номер шарда, число шардов) — из JSON-файлов берутся только
+            документы шарда (по хэшу uid); None — весь корпус.
     """
 
 
@@ -35,7 +47,8 @@ class FaissIndexerService:
                  logger,
                  path_faiss: Path,
                  path_json_init,
-                 config:  Dict
+                 config:  Dict,
+                 shard: Tuple[int, int] = None
      ):
         
 
@@ -44,81 +57,262 @@ class FaissIndexerService:
         self.path_faiss = path_faiss
         self.path_json_init = path_json_init
         self.config = config
+        self.shard = shard
+        # инициализация и удаление хранилища выполняются под блокировкой; поиск берёт ссылку
+        # на готовое хранилище из _live_store одним чтением (None — хранилище не готово)
+        self._store_lock = threading.RLock()
+        self._live_store = None
         self.dim_emb = model.get_sentence_embedding_dimension()
 
-
-
-    def _create_list_texts(self, path_json: Path, add: bool = False):
+        # кодирование корпуса: один процесс или пул процессов (секция 'encoding' config)
+        self.encoder = CorpusEncoder(model, config.get('encoding', {}), logger)
+
+        # дисковый кэш эмбеддингов корпуса: повторное индексирование кодирует только новые тексты
+        config_cache = config.get('embedding_cache', {})
+        self.embedding_cache = None
+        if config_cache.get('enabled', True):
+            # эмбеддинги ONNX / int8 немного отличаются от torch: у каждого backend свой кэш
+            backend = getattr(model, 'embed_backend', 'torch')
+            model_key = config['model_embed_name'] if backend == 'torch' else f"{config['model_embed_name']}:{backend}"
+            self.embedding_cache = EmbeddingCache(Path(path_faiss).parent/config_cache.get('folder', 'emb_cache'),
+                                                  model_key, model.max_seq_length,
+                                                  self.dim_emb, config_cache.get('dtype', 'float16'), logger)
+
+        # кэши поисковых запросов: нормализованный запрос -> эмбеддинг (зависит только от модели)
+        # и (версия индекса, запрос, параметры поиска) -> (расстояния, тексты, эмбеддинг)
+        config_query_cache = config.get('query_cache', {})
+        self.query_embeddings = self.query_results = None
+        if config_query_cache.get('enabled', True):
+            config_embeddings = config_query_cache.get('embeddings', {})
+            config_results = config_query_cache.get('results', {})
+            self.query_embeddings = LRUCache(config_embeddings.get('max_size', 10_000), config_embeddings.get('ttl_s'))
+            self.query_results = LRUCache(config_results.get('max_size', 10_000), config_results.get('ttl_s'))
+
+
+
+    def _create_list_texts(self, path_json: Path, add: bool = False) -> List[str]:
           """
         Загружает и очищает тексты из JSON-файла, формируя список текстов для индексирования.
-        Сохраняет список текстов в pickle-файл( начальный корпус текстов).
         Args:
             path_json (Path): Путь к JSON-файлу с текстами.
             add (bool): Флаг, указывающий, добавочные ли это тексты (True) или начальный корпус (False).
+        Returns:
+            List[str]: Список очищенных текстов.
         """
 
           MIN_WORDS = self.config['min_words']
 
           #  инициализируем  DataPreprocessor  обработчик текстов(проверки на пропуски,дубликаты, мин длина текста)
-          dp = DataPreprocessor(path_json, self.logger, min_words=MIN_WORDS) 
+          dp = DataPreprocessor(path_json, self.logger, min_words=MIN_WORDS, **self.config.get('preprocessing', {}))
 
           # создает атрибут .df_clean датафрейм  с очищенным текстом
           dp.clean() 
 
           # создает атрибут .list_text - список  очищенных текстов
+          texts = dp.list_texts()
+          # метаданные (uid, ru_wiki_pageid) в том же порядке, что и тексты
+          self.meta_texts = dp.metadata()
+          if self.shard is not None:
+              mine = shard_mask(self.meta_texts['uid'], *self.shard)
+              texts = [text for text, keep in zip(texts, mine) if keep]
+              self.meta_texts = self.meta_texts[mine].reset_index(drop=True)
           if add: #
-              path_file = self.path_faiss/self.config['file_name_texts_add']
-              self.texts_index_add =dp.list_texts()
-          else: 
-              path_file = self.path_faiss/self.config['file_name_texts']
-              self.texts_index =dp.list_texts()# self.list_text
-              with open(path_file, 'wb') as f:
-                  pickle.dump(self.texts_index, f)
-              self.logger.info(f"Создан список текстов и сохранён в {path_file}")  
+              self.texts_index_add = texts
+          self.logger.info(f"Создан список текстов ({len(texts)}) из {path_json}")
+          return texts
 
+    def _encode_corpus(self, texts: List[str]) -> np.ndarray:
+        """
+        Кодирует тексты корпуса; при включённом кэше модель вызывается только для промахов.
+        """
+        if self.embedding_cache is None:
+            return self.encoder.encode(texts)
+        return self.embedding_cache.encode(texts, self.encoder.encode)
 
+    def _drop_near_duplicates(self, texts: List[str], meta: pd.DataFrame) -> Tuple[List[str], pd.DataFrame]:
+        """
+        Убирает тексты, почти совпадающие (MinHash/LSH) с уже проиндексированными
+        или с предыдущими текстами того же пакета, а также тексты с uid, которые
+        уже есть в индексе (замена документов — через upsert_documents).
+        """
+        drop = self.store.near_duplicates(texts)
+        if drop.any():
+            self.logger.info(f'Пропущено {int(drop.sum())} почти дубликатов из {len(texts)} текстов')
+        existing = self.store.locate(meta['uid'].tolist())
+        if existing:
+            self.logger.info(f'Пропущено {len(existing)} документов с uid, уже имеющимися в индексе')
+            drop |= meta['uid'].astype(str).isin(existing).to_numpy()
+        if drop.any():
+            texts = [text for text, dropped in zip(texts, drop) if not dropped]
+            meta = meta[~drop].reset_index(drop=True)
+        return texts, meta
+
+    def _migrate_legacy(self) -> bool:
+        """
+        Переносит хранилище прежних версий (index_file.index + texts_index.pkl / TextStore)
+        в сегментное хранилище.
+        """
+        path_index = self.path_faiss/self.config['file_name_index']
+        path_store = self.path_faiss/self.config['file_name_texts_store']
+        path_file = self.path_faiss/self.config['file_name_texts']
+        if not TextStore.exists(path_store) and path_file.is_file() and path_index.is_file():
+            with open(path_file, 'rb') as f:
+                TextStore.write(path_store, pickle.load(f))
+            path_file.unlink()
+        return self.store.migrate_legacy(path_index, path_store)
 
     def create_index(self):
          """
-        Инициализирует FAISS-индекс:
-        - Загружает существующий индекс и тексты, если они есть.
-        - Иначе создаёт новый индекс из текстов и сохраняет его.
+        Инициализирует FAISS-индекс (под блокировкой: параллельные первые запросы
+        не строят и не загружают хранилище повторно):
+        - Загружает существующие сегменты индекса и текстов по манифесту, если они есть;
+          прерванная потоковая загрузка path_json_init при этом продолжается с чекпоинта.
+        - Иначе создаёт новый индекс из текстов и сохраняет его первым сегментом.
 
         """
 
-         MIN_WORDS = self.config['min_words']
-         self.index = faiss.IndexFlatL2(self.dim_emb)
-
-         path_index = self.path_faiss/self.config['file_name_index']
-         path_file = self.path_faiss/self.config['file_name_texts']
-
-
-         try:
-             self.index = faiss.read_index(str(path_index))
-             with open(path_file, 'rb') as f:
-                 self.texts_index = pickle.load(f)
-             assert len( self.texts_index) ==  self.index.ntotal 
-             self.logger.info(f'FAISS-индекс dim: {self.index.ntotal}и связанный список текстов успешно загружены из файлов')
+         with self._store_lock:
+             self._create_index()
+             self._live_store = self.store
+
+    def _create_index(self):
+         if self._open_store():
+             self.logger.info(f'FAISS-индекс dim: {self.store.ntotal} ({len(self.store.segments)} сегментов) и связанные тексты успешно загружены из файлов')
+             checkpoint = self.store.state.get('ingest', {})
+             path_json_init = Path(self.path_json_init)
+             if (not checkpoint.get('done', True) and path_json_init.is_file()
+                     and checkpoint.get('source', {}).get('path') == str(path_json_init.resolve())):
+                 self.ingest_stream(path_json_init)
+             return
+
+         self.logger.info('Выполняется инициализация FAISS-индекса и списка текстов')
+         if self.config.get('streaming', {}).get('create_index', False):
+             # потоковая инициализация: память ограничена размером порции
+             self.ingest_stream(self.path_json_init)
+             return
+         # базовая  инициализация
+         texts, meta = self._drop_near_duplicates(self._create_list_texts(self.path_json_init), self.meta_texts)
+         embs = self._encode_corpus(texts)
+         # тип индекса (Flat / IVF-Flat / IVF-PQ / HNSW) задаётся секцией 'index_type' config
+         self.store.add(embs, texts, meta=meta)
+         self.logger.info(f'FAISS-индекс dim: {self.store.ntotal} и связанный список текстов созданы  и сохранены')
+
+    def _ensure_store(self) -> SegmentStore:
+        """
+        Готовое хранилище; при первом обращении (или после delete_index_files) индекс
+        инициализируется create_index.
+        """
+        store = self._live_store
+        if store is None:
+            with self._store_lock:
+                if self._live_store is None:
+                    self.logger.warning(f"Индекс не инициализирован")
+                    self.create_index()
+                store = self._live_store
+        return store
+
+    def _open_store(self) -> bool:
+        """
+        Создаёт SegmentStore и загружает сохранённые сегменты (или переносит хранилище прежнего формата).
+        Индекс создаётся заново только при отсутствии манифеста: ошибка загрузки существующего
+        хранилища пробрасывается — иначе новый манифест перезаписал бы добавленные документы,
+        а их сегменты были бы удалены как не попавшие в манифест.
 
-         except:
-             self.logger.info('Выполняется инициализация FAISS-индекса и списка текстов')
-             if path_file.is_file():
-                with open(path_file, 'rb') as f:
-                     self.texts_index = pickle.load(f)
-                self.logger.info(f"Загружен список текстов из{path_file}")
-             else:
-                  # базовая  инициализация     
-                  self._create_list_texts(self.path_json_init) 
+        Returns:
+            bool: True, если найдено непустое сохранённое хранилище.
+        Raises:
+            RuntimeError: манифест или сегменты не удалось прочитать.
+        """
+        self.store = SegmentStore(self.path_faiss, self.config, self.logger)
+        try:
+            return (self.store.load() or self._migrate_legacy()) and self.store.ntotal > 0
+        except Exception as e:
+            del self.store
+            self.logger.error(f'Ошибка загрузки хранилища {self.path_faiss}: {e!r}, индекс не пересоздаётся')
+            raise RuntimeError(f'Не удалось загрузить хранилище {self.path_faiss}: {e!r}') from e
+
+    def ingest_stream(self, path_json) -> int:
+        """
+        Потоковая загрузка корпуса из JSON-массива (формат RuBQ) или JSONL.
+        Записи читаются порциями по streaming.chunk_size, каждая порция очищается
+        (DataPreprocessor), дедуплицируется с предыдущими порциями (uid и хэш текста),
+        кодируется и добавляется в индекс отдельным сегментом. Номер обработанной
+        записи фиксируется в манифесте вместе с сегментом, поэтому прерванная
+        загрузка того же файла продолжается с места остановки.
 
-             embs =self.model.encode(self.texts_index, batch_size=16, show_progress_bar=True) 
-             self.index.add(embs) 
-             faiss.write_index(self.index, str(path_index))
-             self.logger.info(f'FAISS-индекс dim: {self.index.ntotal} и связанный список текстов созданы  и сохранены')
+        Args:
+            path_json (Path): Путь к JSON / JSONL файлу.
+        Returns:
+            int: Количество добавленных текстов.
+        """
+        path_json = Path(path_json)
+        with self._store_lock:
+            if not hasattr(self, 'store'):
+                self._open_store()
+                self._live_store = self.store
+
+        chunk_size = self.config.get('streaming', {}).get('chunk_size', 10_000)
+        source = {'path': str(path_json.resolve()), 'size': path_json.stat().st_size}
+        checkpoint = self.store.state.get('ingest', {})
+
+        seen_uids, seen_texts = set(), set()
+        if checkpoint.get('source') == source and not checkpoint.get('done'):
+            records_done = checkpoint['records_done']
+            first_segment = checkpoint['first_segment']
+            # восстанавливаем множество текстов, добавленных этой загрузкой до сбоя
+            for segment in self.store.segments:
+                if int(segment.name.split('_')[1]) >= first_segment:
+                    seen_texts.update(text_key(text) for text in segment.texts)
+            self.logger.info(f'Потоковая загрузка {path_json} продолжается с записи {records_done}')
+        else:
+            records_done = 0
+            first_segment = self.store.next_segment
+
+        added = 0
+        records = islice(iter_records(path_json), records_done, None)
+        for chunk in iter_chunks(records, chunk_size):
+            records_done += len(chunk)
+            if self.shard is not None:
+                chunk = [record for record in chunk if shard_of(record.get('uid'), self.shard[1]) == self.shard[0]]
+                if not chunk:
+                    continue
+            # как в пакетном пути: первая колонка — uid, лишние поля записей отбрасываются
+            df = pd.DataFrame.from_records(chunk).reindex(columns=['uid', 'ru_wiki_pageid', 'text'])
+            dp = DataPreprocessor(path_json, self.logger, min_words=self.config['min_words'],
+                                  df=df, **self.config.get('preprocessing', {}))
+            df_clean = dp.clean()
+
+            texts, rows = [], []
+            meta = dp.metadata()
+            col_uid = df_clean.columns[0]
+            for row, (uid, text) in enumerate(zip(df_clean[col_uid], df_clean.text)):
+                key = text_key(text)
+                if uid in seen_uids or key in seen_texts:
+                    continue
+                seen_uids.add(uid)
+                seen_texts.add(key)
+                texts.append(text)
+                rows.append(row)
+            texts, meta = self._drop_near_duplicates(texts, meta.iloc[rows].reset_index(drop=True))
+
+            embs = self._encode_corpus(texts) if texts else None
+            state = {'ingest': {'source': source, 'records_done': records_done,
+                                'first_segment': first_segment, 'done': False}}
+            self.store.add(embs, texts, state=state, meta=meta)
+            added += len(texts)
+            self.logger.info(f'Потоковая загрузка {path_json.name}: обработано {records_done} записей, добавлено {added} текстов')
+
+        self.store.update_state({'ingest': {'source': source, 'records_done': records_done,
+                                            'first_segment': first_segment, 'done': True}})
+        self.invalidate_query_results()
+        self.logger.info(f'Потоковая загрузка {path_json} завершена: добавлено {added} текстов, всего в индексе {self.store.ntotal}')
+        return added
 
     def add_index(self, path_json_add: str):
         """
         Добавляет новые тексты из JSON в существующий индекс.
-        Обновляет список текстов и сохраняет его.
+        Новые векторы и тексты записываются отдельным неизменяемым сегментом,
+        существующие файлы не переписываются.
 
         Args:
             path_json_add (Path): Путь к JSON-файлу с новыми текстами.
@@ -127,57 +321,208 @@ class FaissIndexerService:
         path_json_add = Path(path_json_add)
 
         #  проверка инициализации индекса + инициализация 
-        if not hasattr(self, 'index'):
-            self.logger.warning(f"Индекс не инициализирован")
-            self.create_index()
+        self._ensure_store()
 
-
-        path_index = self.path_faiss/self.config['file_name_index']
-        path_file = self.path_faiss/self.config['file_name_texts']
         # обоаботает  текст + создаст атрибут self.texts_index_add =dp.list_texts()(список текстов)
         self._create_list_texts( path_json_add, add=True)
+        # проверка на почти дубликаты с корпусом и внутри добавки
+        self.texts_index_add, meta = self._drop_near_duplicates(self.texts_index_add, self.meta_texts)
 
-        embs =self.model.encode(self.texts_index_add, batch_size=16, show_progress_bar=True)
-        self.index.add(embs)
-        faiss.write_index(self.index, str(path_index))
-        self.texts_index.extend(self.texts_index_add)
+        embs = self._encode_corpus(self.texts_index_add)
+        self.store.add(embs, self.texts_index_add, meta=meta)
+        self.invalidate_query_results()
 
-        with open(path_file, 'wb') as f:
-            pickle.dump(self.texts_index, f)
+    def upsert_documents(self, records: List[Dict]) -> Dict:
+        """
+        Добавляет или заменяет документы по uid. Новые версии записываются одним
+        сегментом, прежние помечаются удалёнными в том же коммите манифеста —
+        стоимость пропорциональна числу изменённых документов, а не корпуса.
 
+        Args:
+            records (List[Dict]): Документы с полями uid, text и необязательными метаданными (ru_wiki_pageid).
+        Returns:
+            Dict: Число записанных документов и uid, отклонённые при очистке.
+        """
+        self._ensure_store()
+
+        texts, meta, rejected = self._clean_records(records)
+        embs = self._encode_corpus(texts) if texts else None
+        self.store.add(embs, texts, meta=meta, replace=True)
+        self.invalidate_query_results()
+        return {'upserted': len(texts), 'rejected': rejected}
+
+    def add_documents(self, records: List[Dict]) -> Dict:
+        """
+        Добавляет документы с семантикой add_index: почти дубликаты корпуса и
+        документы с uid, уже имеющимися в индексе, пропускаются (не заменяются).
+        Используется маршрутизатором шардов для /add_index.
+
+        Args:
+            records (List[Dict]): Документы с полями uid, text и необязательными метаданными (ru_wiki_pageid).
+        Returns:
+            Dict: Число добавленных и пропущенных документов и uid, отклонённые при очистке.
+        """
+        self._ensure_store()
 
-    def  search_texts (self, text: str) -> Tuple[np.ndarray, List[str]]:
+        texts, meta, rejected = self._clean_records(records)
+        n_clean = len(texts)
+        texts, meta = self._drop_near_duplicates(texts, meta)
+        embs = self._encode_corpus(texts) if texts else None
+        self.store.add(embs, texts, meta=meta)
+        self.invalidate_query_results()
+        return {'added': len(texts), 'skipped': n_clean - len(texts), 'rejected': rejected}
+
+    def _clean_records(self, records: List[Dict]) -> Tuple[List[str], pd.DataFrame, List[str]]:
+        """
+        Очищает документы (DataPreprocessor).
+
+        Returns:
+            Tuple[List[str], pd.DataFrame, List[str]]: тексты, их метаданные и uid, отклонённые при очистке.
+        """
+        # порядок столбцов как в корпусе RuBQ: uid, ru_wiki_pageid, text
+        df = pd.DataFrame.from_records(records).reindex(columns=['uid', 'ru_wiki_pageid', 'text'])
+        dp = DataPreprocessor(None, self.logger, min_words=self.config['min_words'],
+                              df=df, **self.config.get('preprocessing', {}))
+        dp.clean()
+        texts, meta = dp.list_texts(), dp.metadata()
+        rejected = sorted(set(df['uid'].astype(str)) - set(meta['uid'].astype(str)))
+        return texts, meta, rejected
+
+    def delete_documents(self, uids: List) -> Dict:
+        """
+        Удаляет документы по uid (tombstones, без перестроения индекса).
+
+        Returns:
+            Dict: Число удалённых документов и uid, которых нет в индексе.
+        """
+        self._ensure_store()
+        existing = self.store.locate(uids)
+        deleted = self.store.delete(uids)
+        self.invalidate_query_results()
+        return {'deleted': deleted, 'not_found': [uid for uid in uids if str(uid) not in existing]}
+
+
+    def  search_texts (self, text: str, nprobe: int = None, ef_search: int = None) -> Tuple[np.ndarray, List[str]]:
         """"
         Ищет наиболее похожие тексты в FAISS-индексе по входному запросу.
 
         Args:
             text (str): Запрос пользователя.
+            nprobe (int), ef_search (int): Параметры поиска ANN-индекса (опционально).
 
         Returns:
             Tuple[np.ndarray, List[str]]:
                 - Массив расстояний  до ближайших векторов.
                 - Список текстов, соответствующих ближайшим результатам.
         """
-        #  проверка инициализации индекса + инициализация 
-        if not hasattr(self, 'index'):
-            self.logger.warning(f"Индекс не инициализирован")
-            self.create_index()
+        distances, retrieved_texts = self.search_texts_batch([text], nprobe=nprobe, ef_search=ef_search)
+        return distances[0], retrieved_texts[0]
+
+    @property
+    def live_store(self) -> Optional[SegmentStore]:
+        """Готовое хранилище, None — индекс не инициализирован."""
+        return self._live_store
+
+    @property
+    def index_version(self) -> str:
+        """Версия индекса (для инвалидации кэшей у клиентов), None — индекс не инициализирован."""
+        store = self._live_store
+        return store.index_version if store is not None else None
+
+    def search_texts_batch(self, texts: List[str], k: int = None,
+                           nprobe: int = None, ef_search: int = None,
+                           return_embeddings: bool = False) -> Tuple[List[np.ndarray], List[List[str]]]:
+        """
+        Пакетный поиск: все запросы кодируются одним вызовом model.encode,
+        поиск выполняется одним вызовом index.search по матрице запросов в каждом сегменте.
+        При включённом bm25 результаты объединяются с лексическим поиском (RRF).
 
+        Args:
+            texts (List[str]): Список запросов.
+            k (int): Количество ближайших соседей (по умолчанию top_k_faiss из config).
+            nprobe (int): Число просматриваемых списков IVF для этого запроса (опционально).
+            ef_search (int): Параметр efSearch HNSW для этого запроса (опционально).
+            return_embeddings (bool): Вернуть также эмбеддинги запросов третьим элементом и
+                расстояния до ближайшего по FAISS текста (для проверки порога при гибридном поиске) четвёртым.
 
-        emb = self.model.encode(text).reshape(1,-1)
-        top_k = self.config['top_k_faiss']
-        i, d = self. index.search(emb, k=top_k)
-        retrieved_texts = [self.texts_index[int(i)] for i  in d.reshape(-1)]
-        return i.reshape(-1) ,retrieved_texts
+        Returns:
+            Tuple[List[np.ndarray], List[List[str]]]:
+                - Массивы расстояний (не длиннее k) для каждого запроса.
+                - Списки найденных текстов для каждого запроса.
+        """
+        #  проверка инициализации индекса + инициализация 
+        store = self._ensure_store()
+
+        top_k = k or self.config['top_k_faiss']
+        if len(texts) == 0:
+            return ([], [], [], []) if return_embeddings else ([], [])
+
+        # повторные запросы к той же версии индекса отдаются из кэша результатов
+        keys = [normalize_text(text) for text in texts]
+        version = store.index_version
+        result_keys = [(version, key, top_k, nprobe, ef_search) for key in keys]
+        cached = [self.query_results.get(result_key) for result_key in result_keys] \
+            if self.query_results is not None else [None] * len(texts)
+        missing = [i for i, hit in enumerate(cached) if hit is None]
+
+        if missing:
+            queries = [texts[i] for i in missing]
+            embs = self._encode_queries(queries, [keys[i] for i in missing])
+            # поиск по всем сегментам с объединением top-k (плотный + BM25 с RRF, если включён bm25)
+            with span('index_search', queries=len(missing)):
+                distances, retrieved_texts, nearest = store.search(embs, top_k, nprobe, ef_search, queries=queries)
+            for i, hit in zip(missing, zip(distances, retrieved_texts, embs, nearest)):
+                cached[i] = hit
+                if self.query_results is not None:
+                    self.query_results.put(result_keys[i], hit)
+
+        distances = [hit[0] for hit in cached]
+        retrieved_texts = [list(hit[1]) for hit in cached]
+        if return_embeddings:
+            return distances, retrieved_texts, [hit[2] for hit in cached], [float(hit[3]) for hit in cached]
+        return distances, retrieved_texts
     
+    def _encode_queries(self, texts: List[str], keys: List[str]) -> np.ndarray:
+        """Эмбеддинги запросов: из кэша query_embeddings, модель вызывается одним пакетом для промахов."""
+        embs = [self.query_embeddings.get(key) for key in keys] if self.query_embeddings is not None \
+            else [None] * len(texts)
+        missing = [i for i, emb in enumerate(embs) if emb is None]
+        if missing:
+            with span('encode', queries=len(missing)):
+                encoded = self.model.encode([texts[i] for i in missing], batch_size=len(missing))
+                encoded = np.asarray(encoded, dtype=np.float32).reshape(len(missing), -1)
+            for i, emb in zip(missing, encoded):
+                emb.flags.writeable = False
+                embs[i] = emb
+                if self.query_embeddings is not None:
+                    self.query_embeddings.put(keys[i], emb)
+        return np.vstack(embs)
+
+    def invalidate_query_results(self) -> None:
+        """Сбрасывает кэш результатов поиска (записи и так привязаны к версии индекса, сброс освобождает память)."""
+        if self.query_results is not None:
+            self.query_results.clear()
+
+    def query_cache_stats(self) -> Dict:
+        return {'enabled': self.query_embeddings is not None,
+                'embeddings': self.query_embeddings.stats() if self.query_embeddings is not None else None,
+                'results': self.query_results.stats() if self.query_results is not None else None}
+
     def delete_index_files(self) -> None:
         """
         Удаляет все файлы из директории индекса FAISS.
         Необходимо для  перед иннициализацией индекса новыми тестами!!!
         """
-        for file in  self.path_faiss.iterdir():
-            if file.is_file():
-                file.unlink()
+        with self._store_lock:
+            # поиски, уже получившие ссылку на хранилище, её дочитывают; новые ждут повторной инициализации
+            self._live_store = None
+            if hasattr(self, 'store'):
+                self.store.close()
+                del self.store
+            self.invalidate_query_results()
+            for file in  self.path_faiss.iterdir():
+                if file.is_file():
+                    file.unlink()
   
 
 
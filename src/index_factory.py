@@ -0,0 +1,225 @@
+import faiss
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+# формат хранения векторов внутри индекса: float32 (без сжатия), float16 / sq8 (скалярное
+# квантование, 2 / 1 байт на компоненту), pq (product quantization, pq_m·pq_nbits бит на вектор)
+STORAGE_TYPES = ('float32', 'float16', 'sq8', 'pq')
+
+
+def choose_index_type(n_vectors: int, config_index: Dict) -> str:
+    """
+    Выбирает тип индекса. При type == 'auto' тип определяется размером корпуса:
+    до flat_max — точный Flat, до ivf_flat_max — IVF-Flat, далее — IVF-PQ.
+    Корпуса (сегменты) меньше min_ann_size всегда индексируются точным Flat.
+
+    Args:
+        n_vectors (int): Количество векторов в корпусе.
+        config_index (Dict): Секция 'index_type' конфигурации.
+    Returns:
+        str: Один из INDEX_TYPES.
+    """
+    index_type = config_index.get('type', 'flat')
+    if n_vectors < config_index.get('min_ann_size', 10_000):
+        return 'flat'
+    if index_type != 'auto':
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f'Неизвестный тип индекса {index_type}, допустимые: {INDEX_TYPES}')
+        return index_type
+
+    thresholds = config_index.get('auto_thresholds', {})
+    if n_vectors <= thresholds.get('flat_max', 50_000):
+        return 'flat'
+    if n_vectors <= thresholds.get('ivf_flat_max', 1_000_000):
+        return 'ivf_flat'
+    return 'ivf_pq'
+
+
+def _nlist(n_vectors: int, config_index: Dict) -> int:
+    # эвристика faiss: ~4*sqrt(n) списков и не меньше 39 обучающих точек на список
+    nlist = config_index.get('nlist') or int(4 * np.sqrt(max(n_vectors, 1)))
+    return int(max(1, min(nlist, n_vectors // 39)))
+
+
+def _scalar_quantizer(storage: str) -> int:
+    return faiss.ScalarQuantizer.QT_fp16 if storage == 'float16' else faiss.ScalarQuantizer.QT_8bit
+
+
+def _pq_m(dim: int, config_index: Dict) -> int:
+    pq_m = config_index.get('pq_m', 48)
+    if dim % pq_m:
+        raise ValueError(f'pq_m={pq_m} должен делить размерность {dim}')
+    return pq_m
+
+
+def build_index(dim: int, n_vectors: int, config_index: Dict, index_type: str = None) -> faiss.Index:
+    """
+    Создаёт (ещё не обученный) FAISS-индекс выбранного типа.
+
+    Формат хранения векторов задаётся storage (STORAGE_TYPES), при pca_dim
+    векторы перед индексированием проецируются PCA в пространство меньшей
+    размерности (IndexPreTransform). Сжатие и PCA применяются к корпусам
+    (сегментам) от min_ann_size векторов; меньшие хранятся точным Flat.
+
+    Args:
+        dim (int): Размерность эмбеддингов.
+        n_vectors (int): Размер корпуса (для выбора типа и числа кластеров).
+        config_index (Dict): Секция 'index_type' конфигурации.
+        index_type (str): Явный тип индекса, иначе выбирается choose_index_type.
+    Returns:
+        faiss.Index: Индекс с метрикой L2.
+    """
+    compress = index_type is not None or n_vectors >= config_index.get('min_ann_size', 10_000)
+    index_type = index_type or choose_index_type(n_vectors, config_index)
+    storage = config_index.get('storage', 'float32') if compress else 'float32'
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f'Неизвестный формат хранения {storage}, допустимые: {STORAGE_TYPES}')
+    pca_dim = config_index.get('pca_dim') if compress else None
+    index_dim = pca_dim or dim
+
+    if index_type == 'flat':
+        if storage == 'pq':
+            index = faiss.IndexPQ(index_dim, _pq_m(index_dim, config_index), config_index.get('pq_nbits', 8))
+        elif storage != 'float32':
+            index = faiss.IndexScalarQuantizer(index_dim, _scalar_quantizer(storage), faiss.METRIC_L2)
+        else:
+            index = faiss.IndexFlatL2(index_dim)
+
+    elif index_type == 'hnsw':
+        hnsw_m = config_index.get('hnsw_m', 32)
+        if storage == 'pq':
+            index = faiss.IndexHNSWPQ(index_dim, _pq_m(index_dim, config_index), hnsw_m)
+        elif storage != 'float32':
+            index = faiss.IndexHNSWSQ(index_dim, _scalar_quantizer(storage), hnsw_m)
+        else:
+            index = faiss.IndexHNSWFlat(index_dim, hnsw_m)
+        index.hnsw.efConstruction = config_index.get('ef_construction', 200)
+        index.hnsw.efSearch = config_index.get('ef_search', 64)
+
+    else:
+        nlist = _nlist(n_vectors, config_index)
+        quantizer = faiss.IndexFlatL2(index_dim)
+        if index_type == 'ivf_pq' or storage == 'pq':
+            index = faiss.IndexIVFPQ(quantizer, index_dim, nlist, _pq_m(index_dim, config_index),
+                                     config_index.get('pq_nbits', 8))
+        elif storage != 'float32':
+            index = faiss.IndexIVFScalarQuantizer(quantizer, index_dim, nlist, _scalar_quantizer(storage),
+                                                  faiss.METRIC_L2)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, index_dim, nlist, faiss.METRIC_L2)
+        index.nprobe = min(config_index.get('nprobe', 16), nlist)
+
+    if pca_dim:
+        index = faiss.IndexPreTransform(faiss.PCAMatrix(dim, pca_dim), index)
+    return index
+
+
+def is_compressed(index: faiss.Index) -> bool:
+    """True, если индекс хранит векторы с потерями (квантование, PCA) и его расстояния приближённые."""
+    if isinstance(index, faiss.IndexPreTransform):
+        return True
+    return not isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat, faiss.IndexHNSWFlat))
+
+
+def rerank_exact(queries: np.ndarray, ids: np.ndarray, vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Пересчитывает расстояния L2 кандидатов по точным векторам (например, из
+    mmap-файла сегмента) и оставляет k ближайших.
+
+    Args:
+        queries (np.ndarray): Запросы (m, dim).
+        ids (np.ndarray): Кандидаты (m, k'), -1 — нет кандидата.
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: расстояния и id размера (m, min(k, k')).
+    """
+    valid = ids >= 0
+    candidates = np.asarray(vectors[np.where(valid, ids, 0).ravel()], dtype=np.float32).reshape(*ids.shape, -1)
+    distances = ((candidates - queries[:, None, :]) ** 2).sum(axis=2)
+    distances[~valid] = np.inf
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    return (np.take_along_axis(distances, order, axis=1).astype(np.float32),
+            np.where(np.take_along_axis(valid, order, axis=1), np.take_along_axis(ids, order, axis=1), -1))
+
+
+def train_index(index: faiss.Index, embs: np.ndarray, config_index: Dict, logger=None) -> None:
+    """
+    Обучает индекс (IVF/PQ) на случайной выборке эмбеддингов размера train_sample.
+    Для индексов, не требующих обучения, ничего не делает.
+    """
+    if index.is_trained:
+        return
+    sample_size = config_index.get('train_sample', 100_000)
+    if len(embs) > sample_size:
+        rng = np.random.default_rng(0)
+        sample = embs[np.sort(rng.choice(len(embs), sample_size, replace=False))]
+    else:
+        sample = embs
+    index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    if logger is not None:
+        logger.info(f'FAISS-индекс {type(index).__name__} обучен на {len(sample)} векторах')
+
+
+def search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                  selector: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    """
+    Формирует параметры поиска для одного запроса (не меняя общий индекс,
+    поэтому безопасно при параллельных запросах).
+
+    Args:
+        selector (faiss.IDSelector): Фильтр допустимых id (например, без удалённых документов).
+
+    Returns:
+        faiss.SearchParameters | None: None, если параметры не заданы или не применимы к индексу.
+    """
+    if isinstance(index, faiss.IndexPreTransform):
+        # параметры передаются вложенному индексу (id у PCA-обёртки те же)
+        index_params = search_params(faiss.downcast_index(index.index), nprobe, ef_search, selector)
+        if index_params is None:
+            return None
+        params = faiss.SearchParametersPreTransform()
+        params.index_params = index_params
+        params.referenced_objects = [index_params]
+        return params
+    if isinstance(index, faiss.IndexIVF) and (nprobe is not None or selector is not None):
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe if nprobe is not None else index.nprobe))
+    elif isinstance(index, faiss.IndexHNSW) and (ef_search is not None or selector is not None):
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search if ef_search is not None else index.hnsw.efSearch))
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def index_type_name(index: faiss.Index) -> str:
+    """
+    Возвращает тип индекса в терминах config ('flat', 'ivf_flat', ...) с форматом
+    хранения и PCA, если они отличны от умолчания (например, 'pca256+hnsw:sq8').
+    """
+    if isinstance(index, faiss.IndexPreTransform):
+        inner = faiss.downcast_index(index.index)
+        return f'pca{inner.d}+{index_type_name(inner)}'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivf_pq'
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        return f'ivf_flat:{_sq_name(index.sq)}'
+    if isinstance(index, faiss.IndexIVFFlat):
+        return 'ivf_flat'
+    if isinstance(index, faiss.IndexHNSWPQ):
+        return 'hnsw:pq'
+    if isinstance(index, faiss.IndexHNSWSQ):
+        return f'hnsw:{_sq_name(faiss.downcast_index(index.storage).sq)}'
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexPQ):
+        return 'flat:pq'
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return f'flat:{_sq_name(index.sq)}'
+    return 'flat'
+
+
+def _sq_name(sq) -> str:
+    return 'float16' if sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'sq8'
@@ -1,43 +1,113 @@
 
+import time
 import numpy as np
-from typing import Literal, List, Dict, Tuple
-from llama_cpp import Llama
+from typing import Literal, List, Dict, Optional, Tuple, Iterator
+from llama_cpp import Llama, LlamaRAMCache, LlamaDiskCache
+from src.context_packer import ContextPacker
+from src.telemetry import record_span
+
+# Статические части prompt идут первыми: llama.cpp переиспользует KV-состояние общего
+# префикса, и заново вычисляются только контекст и вопрос.
+PROMPT_NO_CONTEXT = """Инструкции:
+1. Сообщи, что в базе данных нет информации по этому вопросу
+2. Будь максимально точным и кратким
+3. Сохраняй ясность и доброжелательность
+4. Допустимый вариант ответа:
+  "Я не нашел информации по вашему запросу в доступных источниках."
+  "Попробуйте уточнить вопрос или обратиться к другим материалам."
+5.Не предлагай собственных предположений или примерных ответов.
+6. В ответе не должно быть текста  из инструкции.
+7. Начни со слова Ответ:
+"""
+
+PROMPT_CONTEXT = """Инструкции:
+1. При ответе  бери информацию из контекста.
+2. Первый  абзац контекста  самый важный.
+3. Будь максимально точным и кратким
+3. Сохраняй ясность и доброжелательность
+4.Не предлагай собственных предположений или примерных ответов.
+Контекст: """
+
 
 class LLMService:
-    def __init__(self, model: Llama, config: Dict ) -> None:
+    def __init__(self, model: Llama, config: Dict, generation: bool = True) -> None:
         """
         Args:
             model (Llama): Экземпляр модели Llama для генерации текста.
             config (Dict): Конфигурация с параметрами модели и порогами.
+            generation (bool): False — экземпляр только для подготовки prompt
+                (модель может быть загружена с vocab_only=True), KV-кэш не создаётся.
         """
         self.model = model
         self.config = config
+        # время последней потоковой генерации: обработка prompt (до первого токена), генерация, число токенов
+        self.last_timings: Dict = {}
+
+        # упаковка найденных абзацев в бюджет токенов контекстного окна
+        config_packing = config.get('context_packing', {})
+        self.packer = ContextPacker(self.count_tokens, config_packing) if config_packing.get('enabled', True) else None
+        self.n_ctx = config.get('llm_pool', {}).get('n_ctx', 10240)
+        self.reserve_tokens = config_packing.get('reserve_tokens', 64)
+
+        # кэш KV-состояний llama.cpp: состояние сохраняется после каждой генерации и
+        # восстанавливается для нового prompt с самым длинным совпадающим префиксом
+        config_cache = config.get('llm_cache', {})
+        if generation and config_cache.get('enabled', True):
+            capacity = config_cache.get('capacity_bytes', 2 << 30)
+            if config_cache.get('type', 'ram') == 'disk':
+                # директория на диске общая для всех воркеров пула
+                self.model.set_cache(LlamaDiskCache(config_cache.get('cache_dir', '.cashe/llama_cache'), capacity))
+            else:
+                # RAM-кэш свой у каждого процесса-воркера: capacity_bytes — бюджет на весь пул
+                workers = max(config.get('llm_pool', {}).get('workers', 1), 1)
+                self.model.set_cache(LlamaRAMCache(capacity // workers))
+            if config_cache.get('warmup', True):
+                self.warmup()
+
+    def warmup(self) -> None:
+        """
+        Вычисляет статические префиксы prompt, чтобы их KV-состояния были в кэше
+        до первого запроса.
+        """
+        for prefix in (PROMPT_NO_CONTEXT, PROMPT_CONTEXT):
+            self.model(prefix, max_tokens=1)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.model.tokenize(text.encode('utf-8'), add_bos=False, special=False))
 
-    def prompt_prepare(self, query: str, similarity_scores: np.ndarray, content: List[str]) -> str:
+    def context_budget(self, query: str) -> int:
+        """
+        Число токенов, доступное под контекст: окно n_ctx за вычетом инструкций,
+        вопроса, max_tokens ответа и запаса reserve_tokens.
+        """
+        overhead = self.count_tokens(f"{PROMPT_CONTEXT}\nВопрос: {query}\n") + 1
+        return self.n_ctx - overhead - self.config['config_LLM'].get('max_tokens', 0) - self.reserve_tokens
+
+    def prompt_prepare(self, query: str, similarity_scores: np.ndarray, content: List[str],
+                       nearest_distance: Optional[float] = None) -> str:
         """
         Формирует итоговый prompt для модели на основе запроса пользователя и оценок схожести.
         Args:
             query (str): Вопрос или запрос пользователя.
             similarity_scores (np.ndarray): Массив оценок схожести между запросом и контекстными документами.
             content (List[str]): Список текстов-контекстов для ответа.
+            nearest_distance (float): Расстояние до ближайшего по FAISS текста (nearest_distance indexer).
+                Если передано и выдача гибридная (RRF), порог threshold проверяется по нему, а в контекст
+                идут все найденные тексты в порядке RRF — иначе найденные только BM25 тексты отсекались
+                бы порогом по расстоянию.
         Returns:
             str: Сформированный prompt, который будет отправлен в LLM.
         """
-
-        if (similarity_scores.size == 0 or np.min(similarity_scores) > self.config["threshold"]):
-            prompt = f"""
-            Вопрос: {query}
-            Инструкции:
-            1. Сообщи, что в базе данных нет информации по этому вопросу
-            2. Будь максимально точным и кратким
-            3. Сохраняй ясность и доброжелательность
-            4. Допустимый вариант ответа:
-              "Я не нашел информации по вашему запросу в доступных источниках."
-              "Попробуйте уточнить вопрос или обратиться к другим материалам."
-            5.Не предлагай собственных предположений или примерных ответов.
-            6. В ответе не должно быть текста  из инструкции.
-            7. Начни со слова Ответ:
-            """
+        start = time.perf_counter()
+        config_bm25 = self.config.get('bm25', {})
+        hybrid = nearest_distance is not None and config_bm25.get('enabled', True) and config_bm25.get('hybrid', True)
+
+        if hybrid:
+            # гибридная выдача (RRF): релевантность запроса проверяется по ближайшему по FAISS тексту,
+            # найденные тексты идут в контекст в порядке RRF без порога по своему расстоянию
+            context = list(content) if content and nearest_distance <= self.config["threshold"] else None
+        elif (similarity_scores.size == 0 or np.min(similarity_scores) > self.config["threshold"]):
+            context = None
         else:
 
             context = []
@@ -46,17 +116,16 @@ class LLMService:
                 if score <= self.config["threshold"] and \
                    (score- similarity_scores.min()) <= self.config["distance_diff_vector"]:
                     context.append(content[i])
+
+        if context is None:
+            prompt = f"{PROMPT_NO_CONTEXT}Вопрос: {query}\n"
+        else:
+            if self.packer is not None:
+                # абзацы идут в порядке ранжирования indexer (по расстоянию или RRF)
+                context = self.packer.pack(context, self.context_budget(query))
             context_text = "\n\n".join(context)   
-            prompt = f"""
-            Вопрос: {query}
-            Контекст: {context_text}
-            Инструкции:
-            1. При ответе  бери информацию из контекста.
-            2. Первый  абзац контекста  самый важный.
-            3. Будь максимально точным и кратким
-            3. Сохраняй ясность и доброжелательность
-            4.Не предлагай собственных предположений или примерных ответов.
-            """
+            prompt = f"{PROMPT_CONTEXT}{context_text}\nВопрос: {query}\n"
+        record_span('prompt_prepare', time.perf_counter() - start)
         return prompt 
 
     def answer_question(self, prompt: str)-> str:
@@ -69,6 +138,27 @@ class LLMService:
         output = self.model( prompt, ** self.config['config_LLM'])
         return output['choices'][0]['text']
 
+    def answer_question_stream(self, prompt: str) -> Iterator[str]:
+        """
+        Потоковая генерация (llama.cpp stream=True): фрагменты текста отдаются по мере генерации.
+        Args:
+            prompt (str): Текст запроса для модели.
+        Returns:
+            Iterator[str]: Фрагменты (как правило, по одному токену) ответа.
+        """
+        start = time.perf_counter()
+        first_token_at, tokens = None, 0
+        for chunk in self.model(prompt, stream=True, ** self.config['config_LLM']):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            tokens += 1
+            text = chunk['choices'][0]['text']
+            if text:
+                yield text
+        end = time.perf_counter()
+        self.last_timings = {'prompt_eval_s': (first_token_at or end) - start,
+                             'generation_s': end - (first_token_at or end), 'tokens': tokens}
+
 
 
 
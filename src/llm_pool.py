@@ -0,0 +1,315 @@
+import time
+import heapq
+import queue
+import asyncio
+import itertools
+import threading
+import multiprocessing as mp
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional
+from src.telemetry import record_span, TOKENS_PER_SECOND
+
+
+class QueueFullError(Exception):
+    """Очередь запросов к LLM заполнена (admission control)."""
+
+
+class DeadlineExceededError(Exception):
+    """Запрос не успел выполниться до дедлайна."""
+
+
+def _worker_main(worker_id: int, model_path: str, config: Dict, tasks, results, cancel) -> None:
+    """
+    Процесс-воркер: загружает модель (веса GGUF отображаются через mmap и
+    разделяются процессами через кэш ОС) и выполняет задания из своей очереди.
+    Ответ всегда генерируется потоково, чтобы прервать генерацию по дедлайну
+    или по отмене: cancel (общий Value) содержит request_id отменённого запроса
+    (клиент больше не ждёт ответ), сравнение с текущим request_id исключает
+    отмену следующего запроса запоздавшей отменой предыдущего.
+    """
+    from src.llm_answer import LLMService
+    from src.llm_stub import load_llm
+
+    config_pool = config.get('llm_pool', {})
+    llama = load_llm(model_path, config, n_ctx=config_pool.get('n_ctx', 10240),
+                     n_threads=config_pool.get('n_threads'), use_mmap=True, verbose=False)
+    llm_service = LLMService(llama, config)
+    results.put((worker_id, None, 'ready', None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        request_id, prompt, deadline = task
+        if time.time() > deadline:
+            results.put((worker_id, request_id, 'error', 'deadline'))
+            continue
+        try:
+            for piece in llm_service.answer_question_stream(prompt):
+                results.put((worker_id, request_id, 'token', piece))
+                if time.time() > deadline:
+                    results.put((worker_id, request_id, 'error', 'deadline'))
+                    break
+                if cancel.value == request_id:
+                    results.put((worker_id, request_id, 'error', 'cancelled'))
+                    break
+            else:
+                results.put((worker_id, request_id, 'done', llm_service.last_timings))
+        except Exception as e:
+            results.put((worker_id, request_id, 'error', repr(e)))
+
+
+@dataclass(order=True)
+class _Request:
+    priority: int
+    seq: int
+    request_id: int = field(compare=False)
+    prompt: str = field(compare=False)
+    deadline: float = field(compare=False)
+    output: asyncio.Queue = field(compare=False)
+    submitted_at: float = field(default_factory=time.perf_counter, compare=False)
+    dispatched_at: Optional[float] = field(default=None, compare=False)
+    expiry: Optional[asyncio.TimerHandle] = field(default=None, compare=False)
+
+
+class Reservation:
+    """
+    Место в очереди ожидания, занятое до постановки запроса (LLMWorkerPool.reserve):
+    передаётся в submit, освобождается release() или само через timeout_s,
+    если запрос так и не был поставлен (клиент отключился до начала ответа).
+    """
+
+    def __init__(self, pool: 'LLMWorkerPool', timeout_s: float):
+        self._pool = pool
+        self.active = True
+        self._timer = pool._loop.call_later(timeout_s, self.release)
+
+    def release(self) -> None:
+        if self.active:
+            self.active = False
+            self._timer.cancel()
+            self._pool._reserved -= 1
+
+
+class LLMWorkerPool:
+    """
+    Пул процессов-воркеров LLM с ограниченной приоритетной очередью.
+
+    - N процессов, в каждом свой экземпляр Llama с n_threads потоками;
+    - очередь ожидания ограничена max_queue: при переполнении submit() бросает
+      QueueFullError (эндпоинт отвечает 429 с Retry-After);
+    - меньшее значение priority обслуживается раньше, при равенстве — по порядку поступления;
+    - у каждого запроса есть дедлайн: по его наступлении запрос снимается с очереди
+      по таймеру (даже если все воркеры заняты), генерация прерывается (DeadlineExceededError);
+    - место в очереди можно занять заранее (reserve) — потоковый эндпоинт отвечает 429
+      до начала ответа, а ставит запрос при отправке тела.
+
+    Args:
+        model_path (str): Путь к GGUF-файлу модели (None при llm_backend='stub').
+        config (Dict): Конфигурация (секция 'llm_pool' + параметры LLMService).
+    """
+
+    def __init__(self, model_path: str, config: Dict):
+        self.model_path = model_path
+        self.config = config
+        config_pool = config.get('llm_pool', {})
+        self.n_workers = config_pool.get('workers', 1)
+        self.max_queue = config_pool.get('max_queue', 32)
+        self.default_deadline_s = config_pool.get('default_deadline_s', 120)
+        self.retry_after_s = config_pool.get('retry_after_s', 5)
+        self.reservation_timeout_s = config_pool.get('reservation_timeout_s', 10)
+
+        self._ctx = mp.get_context('spawn')
+        self._results = self._ctx.Queue()
+        self._tasks: List = []
+        self._cancel: List = []
+        self._processes: List = []
+        self._idle: List[int] = []
+        self._running: Dict[int, _Request] = {}
+        self._pending: List[_Request] = []
+        self._requests: Dict[int, _Request] = {}
+        self._reserved = 0
+        self._seq = itertools.count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reader: Optional[threading.Thread] = None
+        self._closed = False
+        self.rejected = 0
+        self.expired = 0
+
+    def _spawn(self, worker_id: int) -> None:
+        tasks, cancel = self._ctx.Queue(), self._ctx.Value('q', -1)
+        process = self._ctx.Process(target=_worker_main, name=f'llm-worker-{worker_id}', daemon=True,
+                                    args=(worker_id, self.model_path, self.config, tasks, self._results, cancel))
+        process.start()
+        self._tasks[worker_id] = tasks
+        self._cancel[worker_id] = cancel
+        self._processes[worker_id] = process
+
+    async def start(self) -> None:
+        """Запускает процессы-воркеры и поток чтения результатов."""
+        self._loop = asyncio.get_running_loop()
+        self._tasks = [None] * self.n_workers
+        self._cancel = [None] * self.n_workers
+        self._processes = [None] * self.n_workers
+        for worker_id in range(self.n_workers):
+            self._spawn(worker_id)
+        self._reader = threading.Thread(target=self._read_results, name='llm-results', daemon=True)
+        self._reader.start()
+
+    def close(self) -> None:
+        self._closed = True
+        for tasks in self._tasks:
+            tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+    def stats(self) -> Dict:
+        return {'workers': self.n_workers, 'idle': len(self._idle), 'running': len(self._running),
+                'queued': len(self._pending), 'reserved': self._reserved, 'max_queue': self.max_queue,
+                'rejected': self.rejected, 'expired': self.expired}
+
+    def _check_capacity(self) -> None:
+        if len(self._pending) + self._reserved >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f'Очередь LLM заполнена ({self.max_queue})')
+
+    def reserve(self) -> Reservation:
+        """
+        Занимает место в очереди ожидания без постановки запроса.
+
+        Raises:
+            QueueFullError: очередь заполнена.
+        """
+        self._check_capacity()
+        self._reserved += 1
+        return Reservation(self, self.reservation_timeout_s)
+
+    async def submit(self, prompt: str, priority: int = 0, deadline_s: Optional[float] = None,
+                     reservation: Optional[Reservation] = None) -> AsyncIterator[str]:
+        """
+        Ставит prompt в очередь и возвращает асинхронный итератор фрагментов ответа.
+        С действующей reservation запрос занимает зарезервированное место без проверки очереди.
+
+        Raises:
+            QueueFullError: очередь заполнена.
+            DeadlineExceededError: (при итерации) дедлайн наступил раньше завершения генерации.
+        """
+        if reservation is not None and reservation.active:
+            reservation.release()
+        else:
+            self._check_capacity()
+        seq = next(self._seq)
+        request = _Request(priority, seq, seq, prompt,
+                           time.time() + (deadline_s or self.default_deadline_s), asyncio.Queue())
+        self._requests[request.request_id] = request
+        heapq.heappush(self._pending, request)
+        request.expiry = self._loop.call_later(max(request.deadline - time.time(), 0), self._expire, request)
+        self._dispatch()
+        return self._iterate(request)
+
+    async def generate(self, prompt: str, priority: int = 0, deadline_s: Optional[float] = None) -> str:
+        """Генерирует ответ целиком."""
+        return ''.join([piece async for piece in await self.submit(prompt, priority, deadline_s)])
+
+    async def _iterate(self, request: _Request) -> AsyncIterator[str]:
+        try:
+            while True:
+                kind, payload = await request.output.get()
+                if kind == 'token':
+                    yield payload
+                elif kind == 'done':
+                    self._record_timings(request, payload or {})
+                    return
+                elif payload == 'deadline':
+                    raise DeadlineExceededError('Дедлайн запроса к LLM истёк')
+                else:
+                    raise RuntimeError(f'Ошибка воркера LLM: {payload}')
+        finally:
+            # итерация прервана (клиент отключился): запрос убирается из очереди ожидания,
+            # чтобы не занимать место под max_queue, а начатая генерация останавливается в воркере
+            self._requests.pop(request.request_id, None)
+            if request.expiry is not None:
+                request.expiry.cancel()
+            if request in self._pending:
+                self._pending.remove(request)
+                heapq.heapify(self._pending)
+            for worker_id, running in self._running.items():
+                if running is request:
+                    self._cancel[worker_id].value = request.request_id
+
+    @staticmethod
+    def _record_timings(request: _Request, timings: Dict) -> None:
+        # выполняется в контексте запроса: spans получают его trace id
+        if request.dispatched_at is not None:
+            record_span('llm_queue', request.dispatched_at - request.submitted_at)
+        if timings:
+            record_span('llm_prompt_eval', timings['prompt_eval_s'])
+            record_span('llm_generation', timings['generation_s'], tokens=timings['tokens'])
+            if timings['generation_s'] > 0 and timings['tokens'] > 1:
+                TOKENS_PER_SECOND.observe((timings['tokens'] - 1) / timings['generation_s'])
+
+    def _dispatch(self) -> None:
+        # выполняется в event loop: раздаёт задания свободным воркерам в порядке приоритета
+        now = time.time()
+        while self._idle and self._pending:
+            request = heapq.heappop(self._pending)
+            if request.request_id not in self._requests:
+                continue
+            if request.deadline < now:
+                self.expired += 1
+                request.output.put_nowait(('error', 'deadline'))
+                continue
+            worker_id = self._idle.pop()
+            if request.expiry is not None:
+                # дальше дедлайн соблюдает воркер
+                request.expiry.cancel()
+            request.dispatched_at = time.perf_counter()
+            self._running[worker_id] = request
+            self._tasks[worker_id].put((request.request_id, request.prompt, request.deadline))
+
+    def _expire(self, request: _Request) -> None:
+        # таймер дедлайна: запрос, так и не полученный воркером, снимается с очереди и освобождает место
+        if request in self._pending:
+            self._pending.remove(request)
+            heapq.heapify(self._pending)
+            self.expired += 1
+            request.output.put_nowait(('error', 'deadline'))
+
+    def _on_result(self, worker_id: int, request_id: Optional[int], kind: str, payload) -> None:
+        if kind == 'ready':
+            self._idle.append(worker_id)
+        else:
+            request = self._requests.get(request_id)
+            if request is not None:
+                request.output.put_nowait((kind, payload))
+            if kind in ('done', 'error'):
+                self._running.pop(worker_id, None)
+                self._idle.append(worker_id)
+        self._dispatch()
+
+    def _on_worker_died(self, worker_id: int) -> None:
+        if self._closed or self._processes[worker_id].is_alive():
+            return
+        request = self._running.pop(worker_id, None)
+        if request is not None:
+            request.output.put_nowait(('error', f'воркер {worker_id} завершился аварийно'))
+        if worker_id in self._idle:
+            self._idle.remove(worker_id)
+        self._spawn(worker_id)
+
+    def _read_results(self) -> None:
+        # отдельный поток: блокирующее чтение межпроцессной очереди, передача в event loop;
+        # живость воркеров проверяется на каждой итерации, а не только при паузе в потоке
+        # результатов (иначе падение одного воркера не замечается, пока генерируют другие)
+        while not self._closed:
+            try:
+                message = self._results.get(timeout=1)
+            except queue.Empty:
+                message = None
+            if message is not None:
+                self._loop.call_soon_threadsafe(self._on_result, *message)
+            for worker_id, process in enumerate(self._processes):
+                if not process.is_alive() and not self._closed:
+                    self._loop.call_soon_threadsafe(self._on_worker_died, worker_id)
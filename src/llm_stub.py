@@ -0,0 +1,72 @@
+import re
+import time
+import zlib
+from typing import Dict, Iterator, List, Union
+
+_TOKEN = re.compile(r'\w+|[^\w\s]')
+
+
+class StubLlama:
+    """
+    Детерминированная замена llama_cpp.Llama для бенчмарков и CI без модели и GPU.
+
+    Реализует используемую LLMService часть интерфейса Llama: tokenize, set_cache
+    и вызов model(prompt, max_tokens=..., stream=...). Ответ собирается из слов
+    вопроса (последняя строка "Вопрос: ...") и контекста, выбор слов зависит только
+    от prompt и seed. Время работы модели имитируется задержками: обработка prompt
+    (prompt_ms_per_1k_tokens) и генерация каждого токена (token_delay_ms).
+
+    Args:
+        config_stub (Dict): Секция 'llm_stub' конфигурации.
+    """
+
+    def __init__(self, config_stub: Dict = None, **kwargs):
+        config_stub = config_stub or {}
+        self.answer_tokens = config_stub.get('answer_tokens', 48)
+        self.token_delay = config_stub.get('token_delay_ms', 20) / 1000
+        self.prompt_delay_per_token = config_stub.get('prompt_ms_per_1k_tokens', 50) / 1e6
+        self.vocab_size = config_stub.get('vocab_size', 32000)
+        self.seed = config_stub.get('seed', 0)
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [zlib.crc32(token.encode('utf-8')) % self.vocab_size
+                  for token in _TOKEN.findall(text.decode('utf-8', errors='ignore'))]
+        return [1] + tokens if add_bos else tokens
+
+    def set_cache(self, cache) -> None:
+        pass
+
+    def _answer(self, prompt: str, max_tokens: int) -> List[str]:
+        question = prompt.rsplit('Вопрос:', 1)[-1]
+        words = _TOKEN.findall(question) + _TOKEN.findall(prompt)[-512:]
+        state = zlib.crc32(prompt.encode('utf-8')) ^ self.seed
+        pieces = ['Ответ:']
+        for _ in range(min(max_tokens or self.answer_tokens, self.answer_tokens) - 1):
+            state = (state * 1103515245 + 12345) & 0x7fffffff
+            pieces.append(' ' + words[state % len(words)] if words else ' ...')
+        return pieces
+
+    def _stream(self, pieces: List[str]) -> Iterator[Dict]:
+        for piece in pieces:
+            time.sleep(self.token_delay)
+            yield {'choices': [{'text': piece, 'finish_reason': None}]}
+
+    def __call__(self, prompt: str, max_tokens: int = 16, stream: bool = False,
+                 **kwargs) -> Union[Dict, Iterator[Dict]]:
+        time.sleep(len(self.tokenize(prompt.encode('utf-8'))) * self.prompt_delay_per_token)
+        pieces = self._answer(prompt, max_tokens)
+        if stream:
+            return self._stream(pieces)
+        time.sleep(self.token_delay * len(pieces))
+        return {'choices': [{'text': ''.join(pieces), 'finish_reason': 'length'}]}
+
+
+def load_llm(model_path: str, config: Dict, **kwargs):
+    """
+    Модель генерации по config['llm_backend']: 'llama' — llama_cpp.Llama из GGUF-файла,
+    'stub' — StubLlama (модель не загружается, model_path может быть None).
+    """
+    if config.get('llm_backend', 'llama') == 'stub':
+        return StubLlama(config.get('llm_stub', {}))
+    from llama_cpp import Llama
+    return Llama(model_path=model_path, **kwargs)
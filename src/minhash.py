@@ -0,0 +1,130 @@
+import zlib
+import numpy as np
+from typing import Dict, List, Set
+from src.bm25 import tokenize
+
+_MIX = np.uint64(0x100000001B3)
+
+
+def shingle_hashes(text: str, size: int = 3) -> np.ndarray:
+    """64-битные хэши n-грамм слов текста (без повторов)."""
+    tokens = tokenize(text, stem_prefix=0)
+    hashes = np.fromiter((zlib.crc32(token.encode('utf-8')) for token in tokens), dtype=np.uint64, count=len(tokens))
+    if len(hashes) == 0:
+        return np.zeros(1, dtype=np.uint64)
+    size = min(size, len(hashes))
+    n = len(hashes) - size + 1
+    shingles = np.zeros(n, dtype=np.uint64)
+    for j in range(size):
+        shingles = shingles * _MIX + hashes[j:j + n]
+    return np.unique(shingles)
+
+
+class MinHasher:
+    """
+    MinHash-сигнатуры текстов по n-граммам слов: num_perm хэш-функций вида
+    (a·x + b) mod 2^64 >> 32; доля совпадающих позиций сигнатур оценивает
+    сходство Жаккара множеств n-грамм.
+
+    Args:
+        num_perm (int): Длина сигнатуры.
+        shingle_size (int): Длина n-граммы в словах.
+        seed (int): Зерно генератора хэш-функций (должно совпадать для всех сегментов).
+    """
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        high = np.iinfo(np.uint64).max
+        self.a = rng.integers(0, high, num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self.b = rng.integers(0, high, num_perm, dtype=np.uint64, endpoint=True)
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = shingle_hashes(text, self.shingle_size)
+        hashed = (shingles[:, None] * self.a[None, :] + self.b[None, :]) >> np.uint64(32)
+        return hashed.min(axis=0).astype(np.uint32)
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Матрица сигнатур uint32 размера (len(texts), num_perm).
+        """
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for i, text in enumerate(texts):
+            result[i] = self.signature(text)
+        return result
+
+
+def band_keys(signatures: np.ndarray, bands: int) -> np.ndarray:
+    """
+    Ключи LSH: сигнатура делится на bands полос по rows = num_perm // bands
+    позиций, каждая полоса сворачивается в 64-битный ключ.
+
+    Returns:
+        np.ndarray: Матрица ключей uint64 размера (n, bands).
+    """
+    rows = signatures.shape[1] // bands
+    banded = np.asarray(signatures[:, :bands * rows], dtype=np.uint64).reshape(len(signatures), bands, rows)
+    keys = np.zeros((len(signatures), bands), dtype=np.uint64)
+    for j in range(rows):
+        keys = keys * _MIX + banded[:, :, j]
+    return keys
+
+
+def similarity(signature: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """Оценка сходства Жаккара: доля совпадающих позиций сигнатур."""
+    return (others == signature).mean(axis=1)
+
+
+class LSHIndex:
+    """
+    LSH-индекс сигнатур одного сегмента: для каждой полосы отсортированный
+    массив ключей и перестановка номеров документов. Поиск кандидатов —
+    бинарный поиск ключей запроса (O(bands · log n) на текст).
+    """
+
+    def __init__(self, signatures: np.ndarray, bands: int):
+        self.bands = bands
+        keys = band_keys(signatures, bands)
+        self.order = np.argsort(keys, axis=0, kind='stable').T
+        self.keys = np.take_along_axis(keys, self.order.T, axis=0).T
+
+    def query(self, keys: np.ndarray) -> List[Set[int]]:
+        """
+        Args:
+            keys (np.ndarray): Ключи LSH запросов (m, bands).
+        Returns:
+            List[Set[int]]: Номера документов-кандидатов для каждого запроса.
+        """
+        candidates = [set() for _ in range(len(keys))]
+        for band in range(self.bands):
+            left = np.searchsorted(self.keys[band], keys[:, band], side='left')
+            right = np.searchsorted(self.keys[band], keys[:, band], side='right')
+            for row in np.flatnonzero(right > left):
+                candidates[row].update(self.order[band, left[row]:right[row]].tolist())
+        return candidates
+
+
+def near_duplicates_in_batch(signatures: np.ndarray, bands: int, threshold: float,
+                             skip: np.ndarray = None) -> np.ndarray:
+    """
+    Почти дубликаты внутри пакета: текст отмечается, если похож на один из
+    предыдущих неотмеченных текстов пакета.
+
+    Returns:
+        np.ndarray: Маска почти дубликатов.
+    """
+    keys = band_keys(signatures, bands)
+    duplicates = np.zeros(len(signatures), dtype=bool) if skip is None else skip.copy()
+    buckets: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+    for row in range(len(signatures)):
+        if duplicates[row]:
+            continue
+        candidates = {other for band in range(bands) for other in buckets[band].get(int(keys[row, band]), ())}
+        if candidates and similarity(signatures[row], signatures[sorted(candidates)]).max() >= threshold:
+            duplicates[row] = True
+            continue
+        for band in range(bands):
+            buckets[band].setdefault(int(keys[row, band]), []).append(row)
+    return duplicates
@@ -1,11 +1,42 @@
 from pathlib import Path
+import numpy as np
 import pandas as pd
-import re
 import json
 import pickle
-from typing import Literal, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Literal, List, Tuple
 from src.custom_logging import Customlogger
 
+# строки в Arrow (векторные regex-ядра pyarrow), если pyarrow установлен
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'string'
+
+# слово — непрерывная последовательность кириллических/латинских букв
+WORD_PATTERN = r'[а-яА-ЯёЁa-zA-Z]+'
+
+
+def text_stats(texts: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: число слов и 64-битный хэш каждого текста.
+    '''
+    counts = texts.str.count(WORD_PATTERN).fillna(0).to_numpy(dtype=np.int64)
+    hashes = pd.util.hash_pandas_object(texts, index=False).to_numpy()
+    return counts, hashes
+
+
+def text_stats_parallel(texts: pd.Series, workers: int = 1, chunk_rows: int = 200_000) -> Tuple[np.ndarray, np.ndarray]:
+    '''text_stats по порциям chunk_rows строк в пуле из workers процессов.'''
+    if workers <= 1 or len(texts) <= chunk_rows:
+        return text_stats(texts)
+    chunks = [texts.iloc[i:i + chunk_rows] for i in range(0, len(texts), chunk_rows)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(text_stats, chunks))
+    return np.concatenate([counts for counts, _ in results]), np.concatenate([hashes for _, hashes in results])
+
 
 class DataPreprocessor:
     '''
@@ -13,25 +44,32 @@ class DataPreprocessor:
     - path — путь к JSON-файлу с данными.
     - logger — инициализированный экземпляр логгера из модуля Customlogger.
     - min_words — минимальное количество слов в тексте для векторизации.
+    - df — готовый DataFrame (например, очередная порция потоковой загрузки); если задан, path не читается.
+    - workers — число процессов для подсчёта слов и хэшей текстов (1 — в текущем процессе).
+    - chunk_rows — размер порции строк при параллельной обработке.
 
     Private методы:
     - _load_json — загружает данные из JSON-файла по заданному пути и возвращает их в виде словаря.
-    - _check_missing — обрабатывает пропуски в данных.
-    - _check_duplicates — обрабатывает дубликаты: как по всей строке, так и по столбцу с id.
-    - _check_min_words — подсчитывает число слов в тексте, создаёт столбец с этим числом и возвращает отфильтрованный DataFrame.
+    - _check_missing — обрабатывает пропуски в данных, возвращает маску строк без пропусков.
+    - _check_duplicates — один проход по хэшам: дубликаты по столбцу с id и по тексту, возвращает маску.
+    - _check_min_words — возвращает маску текстов с числом слов не меньше min_words.
 
     публичные  методы :
     Публичные методы:
-    - clean — последовательно применяет _check_missing, _check_duplicates, _check_min_words, возвращает очищенный DataFrame в атрибуте self.df_clean.
+    - clean — строит маски _check_missing, _check_duplicates, _check_min_words и один раз отбирает строки, возвращает очищенный DataFrame в атрибуте self.df_clean.
     - save_csv_or_pickle — сохраняет DataFrame  формате CSV или pickle.( указать имя без  расширения)
     - list_text - Создаёт в классе атрибут self.list_text со списком текстов из self.df_clean и возвращает его.
                    Если self.df_clean отсутствует, пишет предупреждение в лог.
+    - metadata — метаданные очищенных текстов (все столбцы, кроме текста) в том же порядке.
     '''
-    def __init__(self,  path:  Path, logger, min_words: int = 20 ):
+    def __init__(self,  path:  Path, logger, min_words: int = 20, df: pd.DataFrame = None,
+                 workers: int = 1, chunk_rows: int = 200_000):
         self.path = path
         self.logger = logger
         self.min_words = min_words
-        self.df = pd.DataFrame(self._load_json(path))
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self.df = df if df is not None else pd.DataFrame(self._load_json(path))
 
     @staticmethod
     def _load_json(path: Path) -> dict:
@@ -47,102 +85,104 @@ class DataPreprocessor:
          
 
     @staticmethod
-    def _check_missing(df: pd.DataFrame,logger ) -> pd.DataFrame:
-        '''    
+    def _check_missing(df: pd.DataFrame, logger) -> np.ndarray:
+        '''
+        Заполняет пропуски 'ru_wiki_pageid' значением 'unknown' (на месте).
         Returns:
-            pd.DataFrame: DataFrame без строк с пропусками в 'uid' и 'text', с заполненными пропусками 'ru_wiki_pageid' значением 'unknown'.
-        '''    
-        col1, col2, col3 = df.columns
-
-        if df.isna().any(axis=1).sum() == 0:
-            logger.info('Пропуски не найдены')
-            return df
+            np.ndarray: Маска строк без пропусков в 'uid' и 'text'.
+        '''
+        col1, col2, col3 = df.columns[:3]
 
-        # Строки с пропусками в col1 или col3
-        mask = df[[col1, col3]].isna().any(axis=1)
-        if mask.sum() > 0:
-            indices = df.index[mask].tolist()
-            logger.warning(f'Строки с пропусками в столбцах {col1} или {col3} удалены: индексы {indices}')
-            df = df.drop(df.index[mask])
+        missing = df[[col1, col3]].isna().any(axis=1).to_numpy()
+        n_missing = int(missing.sum())
+        if n_missing > 0:
+            logger.warning(f'Удалено {n_missing} строк с пропусками в столбцах {col1} или {col3}')
 
-        # Пропуски в col2
         mask = df[col2].isna()
-        if mask.sum() > 0:
-            indices = df.index[mask].tolist()
-            logger.info(f'Пропуски в столбце {col2} заполнены значением "unknown", индексы: {indices}')
+        n_filled = int(mask.sum())
+        if n_filled > 0:
+            logger.info(f'Пропуски в столбце {col2} заполнены значением "unknown": {n_filled} строк')
             df[col2] = df[col2].fillna('unknown')
 
-        return df  
-    
+        if n_missing == 0 and n_filled == 0:
+            logger.info('Пропуски не найдены')
+        return ~missing
+
     @staticmethod
-    def _check_duplicates(df: pd.DataFrame, logger) -> pd.DataFrame:
+    def _check_duplicates(df: pd.DataFrame, hashes: np.ndarray, keep: np.ndarray, logger) -> np.ndarray:
         '''
+        Один проход по хэшам: сначала дубликаты по первому столбцу (id), затем среди
+        оставшихся — дубликаты по хэшу текста. Сохраняется первое вхождение.
         Returns:
-            pd.DataFrame: DataFrame без дубликатов по всем столбцам и по первому столбцу.'
+            np.ndarray: Маска строк, не являющихся дубликатами (среди строк keep).
         '''
-        col1 = df.columns[0] 
-        # Дубликаты во всём DataFrame (все столбцы)
-        duplicates = df[df.duplicated()]
-        if  len(duplicates)  > 0:
-            indices = duplicates.index.tolist()
-            logger.warning(f'Дубликаты удалены во всём DataFrame: индексы {indices}')
-            df = df.drop_duplicates()
+        col1 = df.columns[0]
+        rows = np.flatnonzero(keep)
+        dup_uid = pd.Series(df[col1].to_numpy()[rows]).duplicated().to_numpy()
+        rows_unique = rows[~dup_uid]
+        dup_text = pd.Series(hashes[rows_unique]).duplicated().to_numpy()
+
+        mask = np.ones(len(df), dtype=bool)
+        mask[rows[dup_uid]] = False
+        mask[rows_unique[dup_text]] = False
+
+        n_uid, n_text = int(dup_uid.sum()), int(dup_text.sum())
+        if n_uid + n_text > 0:
+            logger.warning(f'Удалено дубликатов: по столбцу {col1} — {n_uid}, по тексту — {n_text}')
         else:
             logger.info('Дубликаты не найдены')
-
-        # Дубликаты в столбце col1
-        duplicates = df[df.duplicated(subset=[col1])]
-        if  len(duplicates)  > 0:
-            indices = duplicates.index.tolist()
-            logger.warning(f'Дубликаты в столбце {col1} удалены: индексы {indices}')
-            df = df.drop_duplicates(subset=[col1])
-        else:
-            logger.info(f'Дубликаты в столбце {col1} не найдены')
-
-        return df    
-        
+        return mask
 
     @staticmethod
-    def _check_min_words(df: pd.DataFrame, logger, min_words) -> pd.DataFrame:
+    def _check_min_words(counts: np.ndarray, keep: np.ndarray, logger, min_words) -> np.ndarray:
         '''
          Returns:
-            pd.DataFrame: Отфильтрованный DataFrame по минимальному количеству слов  min_words  с добавленным столбцом 'count_words'
+            np.ndarray: Маска текстов, в которых не меньше min_words слов.
         '''
-        def count_words(text: str) -> int:
-            pattern = r'\b[а-яА-ЯёЁa-zA-Z]+\b'
-            return len(re.findall(pattern, text))
-        
-        col_text = df.columns[-1]
-        df[col_text] = df[col_text].astype(str)
-        df['count_words'] = df[col_text].map(count_words)
-     
-        mask_short_text = df['count_words'] < min_words
-        short_text_count = mask_short_text.sum()
+        mask_short_text = counts < min_words
+        short_text_count = int((mask_short_text & keep).sum())
 
         logger.warning(f'Удалено {short_text_count} строк с количеством слов меньше {min_words}')
-        return df[~mask_short_text]
+        return ~mask_short_text
 
     def clean (self)-> pd.DataFrame:
         '''
+        Очистка без копирования исходного DataFrame: проверки строят маски,
+        строки отбираются один раз в конце. Число слов и хэши текстов считаются
+        векторно (при workers > 1 — параллельно по порциям chunk_rows строк).
         Returns:
-            pd.DataFrame: Очищенный DataFrame, сохранённый в атрибуте self.df_clean.
-        '''    
-        df = self.df.copy()
+            pd.DataFrame: Очищенный DataFrame со столбцом 'count_words', сохранённый в атрибуте self.df_clean.
+        '''
+        df = self.df
         logger = self.logger
-        df = self._check_missing(df, logger)
-        df = self._check_duplicates(df, logger)
-        self.df_clean = self._check_min_words(df, logger, self.min_words)
+        col_text = df.columns[-1]
+
+        keep = self._check_missing(df, logger)
+        df[col_text] = df[col_text].astype(STRING_DTYPE)
+        counts, hashes = text_stats_parallel(df[col_text], self.workers, self.chunk_rows)
+        keep &= self._check_duplicates(df, hashes, keep, logger)
+        df['count_words'] = counts
+        keep &= self._check_min_words(counts, keep, logger, self.min_words)
+
+        self.df_clean = df[keep]
         return self.df_clean
-    
+
     def list_texts(self) -> List:
         logger = self.logger
         if hasattr(self, 'df_clean'):
-            self.list_text = [i for i in self.df_clean.text]
+            self.list_text = self.df_clean.text.tolist()
             return self.list_text
         else:
             self.logger.warning(f"Отсутствует атрибут 'df_clean' в объекте {self} — подготовленный DataFrame отсутствует.")
             self.logger.warning_console(f"Отсутствует атрибут 'df_clean' в объекте {self} — подготовленный DataFrame отсутствует.")    
     
+    def metadata(self) -> pd.DataFrame:
+        '''
+        Returns:
+            pd.DataFrame: Метаданные очищенных текстов (uid, ru_wiki_pageid, ...) в порядке list_texts.
+        '''
+        return self.df_clean.drop(columns=['text', 'count_words'], errors='ignore').reset_index(drop=True)
+
     def save_csv_or_pickle(self, df: pd.DataFrame, name: str, format: Literal['csv', 'pickle'] = 'csv') -> None:
         '''
         Сохраняет DataFrame в указанный путь в формате CSV или pickle.
@@ -169,7 +209,7 @@ class DataPreprocessor:
     def save_list_texts(self, name: str) -> None:
         logger = self.logger
         if hasattr(self, 'df_clean'):
-            list_text = [i for i in self.df_clean.text]
+            list_text = self.df_clean.text.tolist()
             path = Path().cwd() / 'data' / name
             path = path.with_suffix('.pkl')
             with open(path, 'wb') as f:
@@ -0,0 +1,713 @@
+import os
+import json
+import time
+import uuid
+import threading
+import faiss
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from src.index_factory import build_index, train_index, search_params, index_type_name, is_compressed, rerank_exact
+from src.text_store import TextStore
+from src.bm25 import BM25Postings, build_postings, bm25_paths, bm25_idf, term_hashes, tokenize, reciprocal_rank_fusion
+from src.minhash import MinHasher, LSHIndex, band_keys, similarity, near_duplicates_in_batch
+from src.telemetry import span, record_span
+
+
+def atomic_write_index(index: faiss.Index, path: Path) -> None:
+    tmp = path.with_name(path.name + '.tmp')
+    faiss.write_index(index, str(tmp))
+    os.replace(tmp, path)
+
+
+def atomic_save_npy(array: np.ndarray, path: Path) -> None:
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def atomic_write_json(data: Dict, path: Path) -> None:
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def atomic_write_feather(df: pd.DataFrame, path: Path) -> None:
+    tmp = path.with_name(path.name + '.tmp')
+    df.reset_index(drop=True).to_feather(tmp)
+    os.replace(tmp, path)
+
+
+def read_index(path_index: Path, mmap: bool, logger=None) -> Tuple[faiss.Index, bool]:
+    """
+    Читает FAISS-индекс. При mmap=True индекс отображается в память (IO_FLAG_MMAP):
+    воркеры разделяют страницы через кэш ОС, загрузка не зависит от размера индекса.
+    Если тип индекса не поддерживает mmap, он читается целиком.
+
+    Returns:
+        Tuple[faiss.Index, bool]: индекс и признак, что он открыт через mmap.
+    """
+    if mmap:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, 'IO_FLAG_MMAP_IFC', 0)
+        try:
+            return faiss.read_index(str(path_index), flags), True
+        except RuntimeError as e:
+            if not path_index.is_file():
+                raise
+            if logger is not None:
+                logger.info(f'mmap для FAISS-индекса {path_index.name} недоступен ({e}), индекс читается целиком')
+    return faiss.read_index(str(path_index)), False
+
+
+class Segment:
+    """
+    Неизменяемый сегмент хранилища: FAISS-индекс, тексты (TextStore) и исходные
+    векторы (для слияния сегментов при компакции).
+
+    Файлы сегмента <name>: <name>.index, <name>.texts.bin / .offsets.npy, <name>.vectors.npy,
+    <name>.bm25_*.npy (инвертированный индекс BM25), <name>.minhash.npy (MinHash-сигнатуры текстов),
+    <name>.meta.feather (колоночное хранилище метаданных: uid, ru_wiki_pageid, ...).
+
+    Удалённые документы не вырезаются из файлов, а помечаются (tombstones): их
+    позиции хранятся в манифесте и исключаются из поиска IDSelector'ом FAISS.
+    """
+
+    def __init__(self, path_dir: Path, name: str, mmap: bool = True, logger=None):
+        self.path_dir = Path(path_dir)
+        self.name = name
+        self.index, self.mmapped = read_index(self.path_index, mmap, logger)
+        self.texts = TextStore(self.path_texts)
+        if len(self.texts) != self.index.ntotal:
+            raise ValueError(f'Сегмент {name}: {len(self.texts)} текстов, {self.index.ntotal} векторов')
+        self.bm25 = BM25Postings(self.path_texts) if BM25Postings.exists(self.path_texts) else None
+        self.signatures = np.load(self.path_minhash, mmap_mode='r') if self.path_minhash.is_file() else None
+        self._vectors = None
+        self._lsh = None
+        self._uid_index = None
+        self.set_deleted(np.empty(0, dtype=np.int64))
+
+    @property
+    def path_index(self) -> Path:
+        return self.path_dir/f'{self.name}.index'
+
+    @property
+    def path_texts(self) -> Path:
+        return self.path_dir/f'{self.name}.texts'
+
+    @property
+    def path_vectors(self) -> Path:
+        return self.path_dir/f'{self.name}.vectors.npy'
+
+    @property
+    def path_minhash(self) -> Path:
+        return self.path_dir/f'{self.name}.minhash.npy'
+
+    @property
+    def path_meta(self) -> Path:
+        return self.path_dir/f'{self.name}.meta.feather'
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def n_live(self) -> int:
+        return self.ntotal - len(self.deleted)
+
+    def set_deleted(self, deleted: np.ndarray) -> None:
+        """Заменяет множество удалённых позиций и фильтр поиска FAISS."""
+        deleted = np.unique(np.asarray(deleted, dtype=np.int64))
+        selector = None
+        if len(deleted):
+            # IDSelectorNot не владеет вложенным селектором: пара (фильтр, вложенный селектор)
+            # подменяется одним присваиванием, поиск берёт её целиком в локальную переменную
+            batch = faiss.IDSelectorBatch(len(deleted), faiss.swig_ptr(deleted))
+            selector = (faiss.IDSelectorNot(batch), batch)
+        self.deleted = deleted
+        self._selector = selector
+
+    def live_mask(self, deleted: np.ndarray = None) -> np.ndarray:
+        mask = np.ones(self.ntotal, dtype=bool)
+        mask[self.deleted if deleted is None else deleted] = False
+        return mask
+
+    def metadata(self) -> Optional[pd.DataFrame]:
+        return pd.read_feather(self.path_meta) if self.path_meta.is_file() else None
+
+    def locate(self, uids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Позиции неудалённых документов с заданными uid (бинарный поиск по
+        отсортированному столбцу uid, строится при первом обращении).
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: позиции в сегменте и соответствующие им uid.
+        """
+        if self._uid_index is None:
+            if self.path_meta.is_file():
+                column = pd.read_feather(self.path_meta, columns=['uid'])['uid'].to_numpy(dtype=str)
+            else:
+                column = np.empty(0, dtype=str)
+            order = np.argsort(column, kind='stable')
+            self._uid_index = (column[order], order)
+        sorted_uids, order = self._uid_index
+        left = np.searchsorted(sorted_uids, uids, side='left')
+        right = np.searchsorted(sorted_uids, uids, side='right')
+        ids = np.concatenate([order[l:r] for l, r in zip(left, right)] or [np.empty(0, dtype=np.int64)])
+        found = np.repeat(uids, right - left)
+        live = ~np.isin(ids, self.deleted)
+        return ids[live].astype(np.int64), found[live]
+
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            self._vectors = np.load(self.path_vectors, mmap_mode='r')
+        return self._vectors
+
+    def build_bm25(self, stem_prefix: int = 6) -> None:
+        """Строит инвертированный индекс BM25 по текстам сегмента (для сегментов, записанных без него)."""
+        for part, array in build_postings(self.texts, stem_prefix).items():
+            atomic_save_npy(array, bm25_paths(self.path_texts)[part])
+        self.bm25 = BM25Postings(self.path_texts)
+
+    def set_signatures(self, signatures: np.ndarray) -> None:
+        """Сохраняет MinHash-сигнатуры текстов сегмента (для сегментов, записанных без них)."""
+        atomic_save_npy(signatures, self.path_minhash)
+        self.signatures = np.load(self.path_minhash, mmap_mode='r')
+        self._lsh = None
+
+    def lsh(self, bands: int) -> LSHIndex:
+        # LSH-индекс строится в памяти по сохранённым сигнатурам при первом обращении
+        if self._lsh is None or self._lsh.bands != bands:
+            self._lsh = LSHIndex(np.asarray(self.signatures), bands)
+        return self._lsh
+
+    def files(self) -> List[Path]:
+        return [path for path in self.path_dir.glob(f'{self.name}.*') if path.is_file()]
+
+    @classmethod
+    def write(cls, path_dir: Path, name: str, embs: np.ndarray, texts: List[str],
+              config_index: Dict, mmap: bool = True, logger=None, stem_prefix: int = 6,
+              signatures: np.ndarray = None, meta: pd.DataFrame = None) -> 'Segment':
+        """
+        Строит индекс сегмента и записывает все его файлы (через временные файлы
+        и rename). Сегмент становится видимым только после записи манифеста.
+        Метаданные meta (строка на текст, столбец 'uid') хранятся строками.
+        """
+        embs = np.ascontiguousarray(embs, dtype=np.float32)
+        index = build_index(embs.shape[1], len(embs), config_index)
+        train_index(index, embs, config_index, logger)
+        index.add(embs)
+        path_dir = Path(path_dir)
+        atomic_write_index(index, path_dir/f'{name}.index')
+        TextStore.write(path_dir/f'{name}.texts', texts)
+        # точные векторы (для re-ranking и компакции), float16 — вдвое меньше на диске и в кэше ОС
+        atomic_save_npy(embs.astype(config_index.get('vector_dtype', 'float32')), path_dir/f'{name}.vectors.npy')
+        for part, array in build_postings(texts, stem_prefix).items():
+            atomic_save_npy(array, bm25_paths(path_dir/f'{name}.texts')[part])
+        if signatures is not None:
+            atomic_save_npy(np.ascontiguousarray(signatures, dtype=np.uint32), path_dir/f'{name}.minhash.npy')
+        if meta is not None:
+            atomic_write_feather(meta.astype(str), path_dir/f'{name}.meta.feather')
+        return cls(path_dir, name, mmap, logger)
+
+    def search(self, embs: np.ndarray, k: int, nprobe: int = None, ef_search: int = None,
+               rerank_factor: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Поиск в сегменте. Для индексов со сжатием (SQ/PQ/PCA) при rerank_factor > 1
+        выбирается k·rerank_factor кандидатов, расстояния которых пересчитываются
+        по точным векторам из mmap-файла vectors.npy.
+        """
+        selector = self._selector
+        params = search_params(self.index, nprobe, ef_search, selector[0] if selector is not None else None)
+        k = min(k, self.ntotal)
+        if rerank_factor <= 1 or not is_compressed(self.index):
+            return self.index.search(embs, k=k, params=params)
+        _, ids = self.index.search(embs, k=min(k * rerank_factor, self.ntotal), params=params)
+        return rerank_exact(embs, ids, self.vectors(), k)
+
+
+class SegmentStore:
+    """
+    Сегментное append-only хранилище FAISS-индекса и текстов.
+
+    Каждое добавление записывает новый неизменяемый сегмент, после чего
+    атомарно (временный файл + rename) обновляется манифест — единственный
+    источник истины о составе хранилища. Поиск выполняется по всем сегментам
+    с объединением top-k по расстоянию. Удаление и замена (upsert) документов
+    по uid помечают прежние позиции удалёнными (tombstones в манифесте).
+    Мелкие сегменты и сегменты с большой долей удалённых документов
+    переписываются фоновой компакцией.
+
+    Args:
+        path_dir (Path): Директория хранилища.
+        config (Dict): Конфигурация (file_name_manifest, mmap_index, index_type, compaction, bm25, near_duplicates).
+        logger: Экземпляр логгера (Customlogger).
+    """
+
+    def __init__(self, path_dir: Path, config: Dict, logger):
+        self.path_dir = Path(path_dir)
+        self.config = config
+        self.logger = logger
+        self.path_manifest = self.path_dir/config.get('file_name_manifest', 'manifest.json')
+        self.mmap = config.get('mmap_index', True)
+        self.config_index = config.get('index_type', {})
+        self.config_compaction = config.get('compaction', {})
+        self.config_bm25 = config.get('bm25', {})
+        self.stem_prefix = self.config_bm25.get('stem_prefix', 6)
+        # MinHash-сигнатуры для поиска почти дубликатов при добавлении текстов
+        self.config_dedup = config.get('near_duplicates', {})
+        self.hasher = None
+        if self.config_dedup.get('enabled', True):
+            self.hasher = MinHasher(self.config_dedup.get('num_perm', 64), self.config_dedup.get('shingle_size', 3),
+                                    self.config_dedup.get('seed', 1))
+        self.segments: List[Segment] = []
+        self.version = 0
+        self.next_segment = 0
+        # идентификатор хранилища: меняется при пересоздании индекса с нуля
+        self.index_id = uuid.uuid4().hex[:12]
+        # служебное состояние, фиксируемое атомарно вместе с составом сегментов (например, чекпоинт загрузки)
+        self.state: Dict = {}
+        self._lock = threading.Lock()
+        self._compaction_thread = None
+        # сегменты, вытесненные компакцией: (время вытеснения, сегмент); их файлы удаляются
+        # спустя retire_grace_s, когда начатые до коммита поиски по ним завершились
+        self._retired: List[Tuple[float, Segment]] = []
+
+    @property
+    def ntotal(self) -> int:
+        return sum(segment.ntotal for segment in self.segments)
+
+    @property
+    def n_live(self) -> int:
+        return sum(segment.n_live for segment in self.segments)
+
+    @property
+    def index_version(self) -> str:
+        """Версия содержимого хранилища: меняется при любом изменении состава индекса."""
+        return f'{self.index_id}:{self.version}'
+
+    def load(self) -> bool:
+        """
+        Загружает сегменты по манифесту и удаляет файлы сегментов, не попавшие
+        в манифест (остатки прерванной записи).
+
+        Returns:
+            bool: True, если манифест найден.
+        """
+        if not self.path_manifest.is_file():
+            return False
+        with open(self.path_manifest, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.version = manifest['version']
+        self.index_id = manifest.get('index_id', self.index_id)
+        self.next_segment = manifest['next_segment']
+        self.state = manifest.get('state', {})
+        self.segments = []
+        for item in manifest['segments']:
+            segment = Segment(self.path_dir, item['name'], self.mmap, self.logger)
+            segment.set_deleted(item.get('deleted', []))
+            self.segments.append(segment)
+        self._remove_orphans()
+        if self.config_bm25.get('enabled', True):
+            # сегменты, записанные до появления BM25, индексируются один раз при загрузке
+            for segment in self.segments:
+                if segment.bm25 is None:
+                    segment.build_bm25(self.stem_prefix)
+                    self.logger.info(f'Построен индекс BM25 для сегмента {segment.name}')
+        if self.hasher is not None:
+            for segment in self.segments:
+                if segment.signatures is None or segment.signatures.shape[1] != self.hasher.num_perm:
+                    segment.set_signatures(self.hasher.signatures(list(segment.texts)))
+                    self.logger.info(f'Построены MinHash-сигнатуры для сегмента {segment.name}')
+        return True
+
+    def _manifest(self, segments: List[Segment]) -> Dict:
+        return {
+            'index_id': self.index_id,
+            'version': self.version,
+            'next_segment': self.next_segment,
+            'state': self.state,
+            'segments': [{'name': segment.name, 'n': segment.ntotal,
+                          'index_type': index_type_name(segment.index),
+                          'deleted': segment.deleted.tolist()} for segment in segments],
+        }
+
+    def _commit(self, segments: List[Segment]) -> None:
+        # вызывается под self._lock: сначала манифест на диск, затем подмена списка в памяти
+        self.version += 1
+        atomic_write_json(self._manifest(segments), self.path_manifest)
+        self.segments = segments
+
+    def _new_name(self) -> str:
+        name = f'seg_{self.next_segment:06d}'
+        self.next_segment += 1
+        return name
+
+    def _remove_orphans(self) -> None:
+        known = {segment.name for segment in self.segments}
+        for path in self.path_dir.glob('seg_*'):
+            if path.is_file() and path.name.split('.')[0] not in known:
+                path.unlink()
+
+    def add(self, embs: np.ndarray, texts: List[str], state: Dict = None,
+            meta: pd.DataFrame = None, replace: bool = False) -> Optional[Segment]:
+        """
+        Записывает новый сегмент и фиксирует его в манифесте.
+        Стоимость пропорциональна размеру добавки, а не корпуса.
+
+        Args:
+            embs (np.ndarray): Эмбеддинги текстов.
+            texts (List[str]): Тексты.
+            state (Dict): Обновление служебного состояния, записываемое в тот же манифест.
+            meta (pd.DataFrame): Метаданные текстов (столбец 'uid' обязателен).
+            replace (bool): upsert — прежние версии документов с теми же uid помечаются
+                удалёнными в том же коммите манифеста.
+        """
+        if len(texts) == 0:
+            if state:
+                self.update_state(state)
+            return None
+        with self._lock:
+            name = self._new_name()
+        signatures = self.hasher.signatures(texts) if self.hasher is not None else None
+        segment = Segment.write(self.path_dir, name, embs, texts, self.config_index, self.mmap, self.logger,
+                               self.stem_prefix, signatures, meta)
+        with self._lock:
+            replaced = 0
+            if replace and meta is not None:
+                replaced = self._tombstone(meta['uid'].astype(str).to_numpy(dtype=str))
+            if state:
+                self.state.update(state)
+            self._commit(self.segments + [segment])
+        self.logger.info(f'Добавлен сегмент {name} ({segment.ntotal} векторов, заменено {replaced}), '
+                         f'версия хранилища {self.version}')
+        self.maybe_compact()
+        return segment
+
+    def _tombstone(self, uids: np.ndarray) -> int:
+        # вызывается под self._lock: помечает удалёнными все живые документы с данными uid
+        n = 0
+        for segment in self.segments:
+            ids, _ = segment.locate(uids)
+            if len(ids):
+                segment.set_deleted(np.concatenate([segment.deleted, ids]))
+                n += len(ids)
+        return n
+
+    def locate(self, uids: List) -> set:
+        """
+        Returns:
+            set: uid из списка, которые есть в хранилище (среди неудалённых документов).
+        """
+        uids = np.asarray([str(uid) for uid in uids], dtype=str)
+        found = set()
+        for segment in self.segments:
+            found.update(segment.locate(uids)[1].tolist())
+        return found
+
+    def delete(self, uids: List) -> int:
+        """
+        Удаляет документы по uid: позиции помечаются удалёнными (tombstones) и
+        фиксируются в манифесте, файлы сегментов не переписываются. Место
+        освобождается компакцией, когда доля удалённых в сегменте превысит purge_ratio.
+
+        Returns:
+            int: Число удалённых документов.
+        """
+        uids = np.asarray([str(uid) for uid in uids], dtype=str)
+        with self._lock:
+            n = self._tombstone(uids)
+            if n:
+                self._commit(self.segments)
+        if n:
+            self.logger.info(f'Удалено {n} документов, версия хранилища {self.version}')
+            self.maybe_compact()
+        return n
+
+    def stats(self) -> Dict:
+        """
+        Returns:
+            Dict: Состав хранилища и расход памяти: для каждого сегмента тип индекса,
+            число векторов, байт на вектор в индексе и в файле точных векторов.
+        """
+        segments = []
+        for segment in self.segments:
+            index_bytes = segment.path_index.stat().st_size
+            vectors_bytes = segment.path_vectors.stat().st_size
+            segments.append({'name': segment.name, 'index_type': index_type_name(segment.index),
+                             'n': segment.ntotal, 'deleted': len(segment.deleted),
+                             'index_bytes_per_vector': index_bytes / max(segment.ntotal, 1),
+                             'vectors_bytes_per_vector': vectors_bytes / max(segment.ntotal, 1)})
+        n = self.ntotal
+        return {'index_version': self.index_version, 'n': n, 'n_live': self.n_live,
+                'index_bytes_per_vector': sum(item['index_bytes_per_vector'] * item['n'] for item in segments) / max(n, 1),
+                'segments': segments}
+
+    def near_duplicates(self, texts: List[str]) -> np.ndarray:
+        """
+        Находит почти дубликаты среди новых текстов: по LSH-индексам сегментов
+        (кандидаты проверяются по оценке сходства Жаккара сигнатур) и внутри
+        самого пакета. Время не зависит от размера корпуса линейно: на каждый
+        текст — бинарный поиск ключей полос в каждом сегменте.
+
+        Returns:
+            np.ndarray: Маска текстов, похожих (не меньше threshold) на уже
+            проиндексированные или на предыдущие тексты пакета.
+        """
+        if self.hasher is None or len(texts) == 0:
+            return np.zeros(len(texts), dtype=bool)
+        bands = self.config_dedup.get('bands', 8)
+        threshold = self.config_dedup.get('threshold', 0.8)
+        signatures = self.hasher.signatures(texts)
+        keys = band_keys(signatures, bands)
+
+        duplicates = np.zeros(len(texts), dtype=bool)
+        for segment in self.segments:
+            if segment.signatures is None or segment.ntotal == 0:
+                continue
+            for row, candidates in enumerate(segment.lsh(bands).query(keys)):
+                if candidates and not duplicates[row]:
+                    # удалённые документы не считаются (иначе upsert совпал бы со своей прежней версией)
+                    candidates = np.setdiff1d(np.fromiter(candidates, dtype=np.int64), segment.deleted)
+                    if len(candidates):
+                        others = np.asarray(segment.signatures[candidates])
+                        duplicates[row] = similarity(signatures[row], others).max() >= threshold
+        return near_duplicates_in_batch(signatures, bands, threshold, skip=duplicates)
+
+    def update_state(self, state: Dict) -> None:
+        """Атомарно обновляет служебное состояние в манифесте."""
+        with self._lock:
+            self.state.update(state)
+            self._commit(self.segments)
+
+    def _search_dense(self, segments: List[Segment], embs: np.ndarray, k: int, nprobe: int = None,
+                      ef_search: int = None) -> List[List[Tuple[float, int, int]]]:
+        # top-k по всем сегментам: для каждого запроса список (расстояние, номер сегмента, id)
+        all_distances, all_ids, all_segments = [], [], []
+        for number, segment in enumerate(segments):
+            distances, ids = segment.search(embs, k, nprobe, ef_search, self.config_index.get('rerank_factor', 4))
+            all_distances.append(distances)
+            all_ids.append(ids)
+            all_segments.append(np.full(ids.shape, number))
+        distances = np.hstack(all_distances)
+        ids = np.hstack(all_ids)
+        numbers = np.hstack(all_segments)
+        # -1 (нет результата) в конец списка
+        distances = np.where(ids >= 0, distances, np.inf)
+        order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        return [[(float(distances[row, j]), int(numbers[row, j]), int(ids[row, j]))
+                 for j in row_order if ids[row, j] >= 0]
+                for row, row_order in enumerate(order)]
+
+    def _search_lexical(self, segments: List[Segment], query: str, k: int) -> List[Tuple[float, int, int]]:
+        # top-k BM25 по всем сегментам с глобальными idf и средней длиной документа
+        indexed = [(number, segment.bm25, segment.deleted) for number, segment in enumerate(segments)
+                   if segment.bm25 is not None]
+        hashes = term_hashes(sorted(set(tokenize(query, self.stem_prefix))))
+        if not indexed or len(hashes) == 0:
+            return []
+        n_docs = sum(bm25.n_docs for _, bm25, _ in indexed)
+        avgdl = sum(bm25.total_len for _, bm25, _ in indexed) / max(n_docs, 1)
+        idf = bm25_idf(sum(bm25.df(hashes) for _, bm25, _ in indexed), n_docs)
+        k1, b = self.config_bm25.get('k1', 1.2), self.config_bm25.get('b', 0.75)
+
+        hits = []
+        for number, bm25, deleted in indexed:
+            # с запасом на удалённые документы, которые отбрасываются после оценки
+            scores, docs = bm25.search(hashes, idf, avgdl, k + len(deleted), k1, b)
+            live = ~np.isin(docs, deleted)
+            hits.extend((float(score), number, int(doc)) for score, doc in zip(scores[live][:k], docs[live][:k]))
+        hits.sort(key=lambda hit: -hit[0])
+        return hits[:k]
+
+    def search(self, embs: np.ndarray, k: int, nprobe: int = None, ef_search: int = None,
+               queries: List[str] = None) -> Tuple[List[np.ndarray], List[List[str]], np.ndarray]:
+        """
+        Ищет по всем сегментам и объединяет top-k по расстоянию.
+
+        Если переданы тексты запросов queries и включён bm25, выполняется гибридный
+        поиск: списки глубины depth плотного (FAISS) и лексического (BM25) поиска
+        объединяются reciprocal rank fusion. Для найденных только BM25 текстов
+        расстояние до запроса считается по сохранённым векторам сегмента.
+
+        Returns:
+            Tuple[List[np.ndarray], List[List[str]], np.ndarray]: расстояния и тексты для
+            каждого запроса (при гибридном поиске — в порядке RRF) и расстояние до ближайшего
+            по FAISS текста (np.inf — ничего не найдено): по нему проверяется порог
+            релевантности, даже если сам текст в выдачу RRF не попал.
+        """
+        segments = self.segments
+        nearest = np.full(len(embs), np.inf, dtype=np.float32)
+        if not segments:
+            return [np.empty(0, dtype=np.float32) for _ in range(len(embs))], [[] for _ in range(len(embs))], nearest
+
+        hybrid = queries is not None and self.config_bm25.get('enabled', True) and \
+            self.config_bm25.get('hybrid', True)
+        depth = max(k, self.config_bm25.get('depth', 20)) if hybrid else k
+        with span('faiss_search', queries=len(embs), segments=len(segments)):
+            dense = self._search_dense(segments, embs, depth, nprobe, ef_search)
+
+        result_distances, result_texts = [], []
+        lexical_s = 0.0
+        for row, dense_hits in enumerate(dense):
+            if dense_hits:
+                nearest[row] = dense_hits[0][0]
+            if hybrid:
+                start = time.perf_counter()
+                lexical_hits = self._search_lexical(segments, queries[row], depth)
+                lexical_s += time.perf_counter() - start
+                distance_of = {(number, i): distance for distance, number, i in dense_hits}
+                fused = [key for key, _ in reciprocal_rank_fusion([[(number, i) for _, number, i in dense_hits],
+                                                                   [(number, i) for _, number, i in lexical_hits]],
+                                                                  self.config_bm25.get('rrf_k', 60))[:k]]
+                hits = []
+                for number, i in fused:
+                    distance = distance_of.get((number, i))
+                    if distance is None:
+                        vector = np.asarray(segments[number].vectors()[i], dtype=np.float32)
+                        distance = float(np.sum((vector - embs[row]) ** 2))
+                    hits.append((distance, number, i))
+            else:
+                hits = dense_hits
+            result_distances.append(np.array([distance for distance, _, _ in hits], dtype=np.float32))
+            result_texts.append([segments[number].texts[i] for _, number, i in hits])
+        if hybrid:
+            record_span('bm25_search', lexical_s, queries=len(embs))
+        return result_distances, result_texts, nearest
+
+    def maybe_compact(self) -> None:
+        """
+        Запускает фоновую компакцию, если мелких сегментов (меньше min_segment_size)
+        накопилось больше max_small_segments или в каком-то сегменте доля удалённых
+        документов достигла purge_ratio.
+        """
+        self._purge_retired()
+        if not self.config_compaction.get('enabled', True):
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        if len(self._small_segments()) > self.config_compaction.get('max_small_segments', 8) or self._dirty_segments():
+            self._compaction_thread = threading.Thread(target=self.compact, name='compaction', daemon=True)
+            self._compaction_thread.start()
+
+    def _small_segments(self) -> List[Segment]:
+        min_size = self.config_compaction.get('min_segment_size', 50_000)
+        return [segment for segment in self.segments if segment.ntotal < min_size]
+
+    def _dirty_segments(self) -> List[Segment]:
+        purge_ratio = self.config_compaction.get('purge_ratio', 0.2)
+        return [segment for segment in self.segments
+                if len(segment.deleted) and len(segment.deleted) >= purge_ratio * segment.ntotal]
+
+    def compact(self) -> None:
+        """
+        Сливает мелкие сегменты и сегменты с большой долей удалённых документов
+        в один, удалённые документы при этом вырезаются. Новый сегмент строится
+        вне блокировки, затем манифест атомарно заменяет слитые сегменты новым;
+        удаления, пришедшие во время компакции, переносятся на новый сегмент.
+        Файлы слитых сегментов удаляются не сразу, а через retire_grace_s
+        (при следующей проверке maybe_compact): поиски, начатые до коммита, их дочитывают.
+        """
+        small = self._small_segments()
+        dirty = self._dirty_segments()
+        targets = [segment for segment in self.segments
+                   if (len(small) >= 2 and segment in small) or segment in dirty]
+        if not targets:
+            return
+        with self._lock:
+            name = self._new_name()
+            snapshot = {segment.name: segment.deleted for segment in targets}
+            masks = [segment.live_mask(snapshot[segment.name]) for segment in targets]
+
+        embs = np.vstack([np.asarray(segment.vectors())[mask] for segment, mask in zip(targets, masks)])
+        texts = [text for segment, mask in zip(targets, masks)
+                 for text, live in zip(segment.texts, mask) if live]
+        signatures = None
+        if self.hasher is not None:
+            signatures = np.vstack([(np.asarray(segment.signatures) if segment.signatures is not None
+                                     else self.hasher.signatures(list(segment.texts)))[mask]
+                                    for segment, mask in zip(targets, masks)])
+        meta = None
+        metas = [segment.metadata() for segment in targets]
+        if any(frame is not None for frame in metas):
+            meta = pd.concat([(frame if frame is not None else pd.DataFrame({'uid': [''] * segment.ntotal}))[mask]
+                              for segment, frame, mask in zip(targets, metas, masks)], ignore_index=True)
+        merged = None
+        if texts:
+            merged = Segment.write(self.path_dir, name, embs, texts, self.config_index, self.mmap, self.logger,
+                                   self.stem_prefix, signatures, meta)
+
+        merged_names = {segment.name for segment in targets}
+        with self._lock:
+            if merged is not None:
+                # удаления во время компакции: позиции переводятся в нумерацию нового сегмента
+                late, offset = [], 0
+                for segment, mask in zip(targets, masks):
+                    kept = np.flatnonzero(mask)
+                    new = np.setdiff1d(segment.deleted, snapshot[segment.name])
+                    late.append(offset + np.searchsorted(kept, new))
+                    offset += len(kept)
+                merged.set_deleted(np.concatenate(late))
+            # слитые сегменты заменяются новым на месте первого из них, порядок корпуса сохраняется
+            segments = []
+            for segment in self.segments:
+                if segment.name not in merged_names:
+                    segments.append(segment)
+                elif merged is not None and merged not in segments:
+                    segments.append(merged)
+            self._commit(segments)
+            self._retired.extend((time.monotonic(), segment) for segment in targets)
+        purged = sum(len(snapshot[segment.name]) for segment in targets)
+        self.logger.info(f'Компакция: {len(targets)} сегментов слиты в {name} '
+                         f'({merged.ntotal if merged is not None else 0} векторов, вырезано удалённых {purged})')
+
+    def _purge_retired(self, force: bool = False) -> None:
+        """Удаляет файлы сегментов, вытесненных компакцией не менее retire_grace_s секунд назад."""
+        deadline = time.monotonic() - self.config_compaction.get('retire_grace_s', 60)
+        with self._lock:
+            expired = [segment for retired_at, segment in self._retired if force or retired_at <= deadline]
+            self._retired = [(retired_at, segment) for retired_at, segment in self._retired
+                             if segment not in expired]
+        for segment in expired:
+            for path in segment.files():
+                path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        """Дожидается завершения фоновой компакции и удаляет файлы вытесненных ею сегментов."""
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+        self._purge_retired(force=True)
+
+    def migrate_legacy(self, path_index: Path, path_texts: Path) -> bool:
+        """
+        Переносит индекс и тексты прежнего формата (один файл индекса + TextStore)
+        в сегмент хранилища. Векторы восстанавливаются из индекса.
+
+        Returns:
+            bool: True, если перенос выполнен.
+        """
+        if self.path_manifest.is_file() or not path_index.is_file() or not TextStore.exists(path_texts):
+            return False
+        index = faiss.read_index(str(path_index))
+        if isinstance(index, faiss.IndexIVF):
+            index.make_direct_map()
+        embs = index.reconstruct_n(0, index.ntotal)
+        texts = list(TextStore(path_texts))
+        with self._lock:
+            name = self._new_name()
+        signatures = self.hasher.signatures(texts) if self.hasher is not None else None
+        segment = Segment.write(self.path_dir, name, embs, texts, self.config_index, self.mmap, self.logger,
+                               self.stem_prefix, signatures)
+        with self._lock:
+            self._commit([segment])
+        path_index.unlink()
+        for path in TextStore._paths(path_texts):
+            path.unlink()
+        self.logger.info(f'Индекс прежнего формата перенесён в сегмент {name}')
+        return True
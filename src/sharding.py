@@ -0,0 +1,195 @@
+import time
+import asyncio
+import hashlib
+import numpy as np
+import httpx
+from typing import Dict, Iterable, List, Optional, Tuple
+from src.bm25 import reciprocal_rank_fusion
+from src.telemetry import trace_headers, record_span
+
+
+def shard_of(uid, n_shards: int) -> int:
+    """Номер шарда документа: стабильный хэш uid (одинаковый во всех процессах)."""
+    digest = hashlib.blake2b(str(uid).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % n_shards
+
+
+def shard_mask(uids: Iterable, shard_id: int, n_shards: int) -> np.ndarray:
+    """Маска документов, принадлежащих шарду shard_id."""
+    return np.fromiter((shard_of(uid, n_shards) == shard_id for uid in uids), dtype=bool)
+
+
+def merge_top_k(results: List[Tuple[List[float], List[str]]], k: int) -> Tuple[List[float], List[str]]:
+    """Объединяет top-k шардов по расстоянию (меньше — ближе)."""
+    hits = [(distance, text) for distances, texts in results for distance, text in zip(distances, texts)]
+    hits.sort(key=lambda hit: hit[0])
+    return [distance for distance, _ in hits[:k]], [text for _, text in hits[:k]]
+
+
+def merge_by_rank(results: List[Tuple[List[float], List[str]]], k: int,
+                  rrf_k: int = 60) -> Tuple[List[float], List[str]]:
+    """
+    Объединяет top-k шардов reciprocal rank fusion по позициям в выдаче шарда
+    (для гибридного поиска: шард возвращает тексты в порядке RRF, а не по расстоянию).
+    """
+    fused = [key for key, _ in reciprocal_rank_fusion([[(shard, rank) for rank in range(len(texts))]
+                                                       for shard, (_, texts) in enumerate(results)], rrf_k)[:k]]
+    return [results[shard][0][rank] for shard, rank in fused], [results[shard][1][rank] for shard, rank in fused]
+
+
+class ShardRouter:
+    """
+    Маршрутизатор запросов к шардам indexer (каждый шард — процесс main_indexer.py
+    со своим срезом корпуса).
+
+    - поиск: запрос рассылается всем шардам параллельно, top-k шардов объединяются
+      по расстоянию (при гибридном поиске — RRF по позициям в выдаче шардов);
+      шарды, не ответившие за deadline_s, пропускаются (ответ помечается partial,
+      index_version не возвращается), при ответе меньше min_shards шардов — ошибка;
+    - запись: документы распределяются по шардам по хэшу uid (shard_of) и
+      отправляются в /add_documents, /upsert_documents и /delete_documents нужного шарда порциями.
+
+    Args:
+        config_sharding (Dict): Секция 'sharding' конфигурации.
+        shards (List[str]): Базовые URL шардов (по умолчанию config_sharding['shards']).
+        config_bm25 (Dict): Секция 'bm25' конфигурации (гибридный поиск шардов и rrf_k).
+    """
+
+    def __init__(self, config_sharding: Dict, shards: Optional[List[str]] = None, config_bm25: Dict = None):
+        self.shards = [url.rstrip('/') + '/' for url in (shards or config_sharding.get('shards', []))]
+        if not self.shards:
+            raise ValueError('Не задан список шардов (sharding.shards)')
+        self.deadline_s = config_sharding.get('deadline_s', 2.0)
+        self.min_shards = config_sharding.get('min_shards', 1)
+        self.ingest_batch = config_sharding.get('ingest_batch', 1000)
+        self.timeout_s = config_sharding.get('timeout_s', 600)
+        config_bm25 = config_bm25 or {}
+        self.hybrid = config_bm25.get('enabled', True) and config_bm25.get('hybrid', True)
+        self.rrf_k = config_bm25.get('rrf_k', 60)
+        self.client: Optional[httpx.AsyncClient] = None
+        self.timeouts = [0] * len(self.shards)
+        self.failures = [0] * len(self.shards)
+
+    @property
+    def n_shards(self) -> int:
+        return len(self.shards)
+
+    async def start(self) -> None:
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout_s, connect=5),
+                                        limits=httpx.Limits(max_connections=20 * self.n_shards,
+                                                            max_keepalive_connections=10 * self.n_shards))
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+
+    async def _call(self, shard: int, method: str, endpoint: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, self.shards[shard] + endpoint,
+                                                 headers=trace_headers(), **kwargs)
+            response.raise_for_status()
+            return response.json()
+        finally:
+            record_span('shard_request', time.perf_counter() - start, shard=shard, endpoint=endpoint)
+
+    async def scatter(self, method: str, endpoint: str, deadline_s: Optional[float] = None,
+                      **kwargs) -> Dict[int, object]:
+        """
+        Параллельный запрос ко всем шардам.
+
+        Returns:
+            Dict[int, object]: Ответы шардов, уложившихся в дедлайн и ответивших без ошибки.
+        """
+        tasks = {asyncio.create_task(self._call(shard, method, endpoint, **kwargs)): shard
+                 for shard in range(self.n_shards)}
+        done, pending = await asyncio.wait(tasks, timeout=deadline_s)
+        for task in pending:
+            task.cancel()
+            self.timeouts[tasks[task]] += 1
+        results = {}
+        for task in done:
+            if task.exception() is None:
+                results[tasks[task]] = task.result()
+            else:
+                self.failures[tasks[task]] += 1
+        return results
+
+    def _check_quorum(self, results: Dict) -> None:
+        if len(results) < self.min_shards:
+            raise RuntimeError(f'Ответили {len(results)} из {self.n_shards} шардов (min_shards={self.min_shards})')
+
+    @staticmethod
+    def _index_version(results: Dict) -> str:
+        return '|'.join(f"{shard}:{results[shard].get('index_version')}" for shard in sorted(results))
+
+    def _merge(self, results: List[Tuple[List[float], List[str]]], k: int) -> Tuple[List[float], List[str]]:
+        return merge_by_rank(results, k, self.rrf_k) if self.hybrid else merge_top_k(results, k)
+
+    async def search(self, text: str, k: int, params: Dict) -> Dict:
+        """Поиск по всем шардам с объединением top-k; формат ответа как у /search_texts indexer."""
+        results = await self.scatter('POST', 'search_texts', self.deadline_s, json=text, params=params)
+        self._check_quorum(results)
+        start = time.perf_counter()
+        distances, texts = self._merge([(result['similarity_scores'], result['retrieved_texts'])
+                                        for result in results.values()], k)
+        record_span('shard_merge', time.perf_counter() - start, shards=len(results))
+        partial = len(results) < self.n_shards
+        response = {'similarity_scores': distances, 'retrieved_texts': texts,
+                    'shards': len(results), 'partial': partial}
+        nearest = [result['nearest_distance'] for result in results.values()
+                   if result.get('nearest_distance') is not None]
+        response['nearest_distance'] = min(nearest) if nearest else None
+        if not partial:
+            # версия по ответу части шардов не описывает индекс и сбрасывала бы кэш ответов answer
+            response['index_version'] = self._index_version(results)
+        embedding = next((result['query_embedding'] for result in results.values() if 'query_embedding' in result), None)
+        if embedding is not None:
+            response['query_embedding'] = embedding
+        return response
+
+    async def search_batch(self, texts: List[str], k: int, params: Dict) -> List[Dict]:
+        results = await self.scatter('POST', 'search_texts_batch', self.deadline_s, json=texts,
+                                     params={**params, 'k': k})
+        self._check_quorum(results)
+        merged = []
+        for row in range(len(texts)):
+            distances, found = self._merge([(result[row]['similarity_scores'], result[row]['retrieved_texts'])
+                                            for result in results.values()], k)
+            merged.append({'similarity_scores': distances, 'retrieved_texts': found})
+        return merged
+
+    async def _send_grouped(self, endpoint: str, items: List, key) -> List[Dict]:
+        # порции документов по шардам; шарды обрабатываются параллельно, порции шарда — по очереди
+        groups: Dict[int, List] = {}
+        for item in items:
+            groups.setdefault(shard_of(key(item), self.n_shards), []).append(item)
+
+        async def send(shard: int, group: List) -> List[Dict]:
+            return [await self._call(shard, 'POST', endpoint, json=group[i:i + self.ingest_batch])
+                    for i in range(0, len(group), self.ingest_batch)]
+
+        responses = await asyncio.gather(*(send(shard, group) for shard, group in groups.items()))
+        return [response for shard_responses in responses for response in shard_responses]
+
+    async def add(self, records: List[Dict]) -> Dict:
+        """Добавляет документы в шарды по хэшу uid с семантикой /add_index (существующие uid пропускаются)."""
+        responses = await self._send_grouped('add_documents', records, lambda record: record['uid'])
+        return {'added': sum(response['added'] for response in responses),
+                'skipped': sum(response['skipped'] for response in responses),
+                'rejected': sorted(uid for response in responses for uid in response['rejected'])}
+
+    async def upsert(self, records: List[Dict]) -> Dict:
+        """Записывает документы в шарды по хэшу uid."""
+        responses = await self._send_grouped('upsert_documents', records, lambda record: record['uid'])
+        return {'upserted': sum(response['upserted'] for response in responses),
+                'rejected': sorted(uid for response in responses for uid in response['rejected'])}
+
+    async def delete(self, uids: List) -> Dict:
+        responses = await self._send_grouped('delete_documents', uids, lambda uid: uid)
+        return {'deleted': sum(response['deleted'] for response in responses),
+                'not_found': [uid for response in responses for uid in response['not_found']]}
+
+    def stats(self) -> Dict:
+        return {'shards': self.n_shards, 'deadline_s': self.deadline_s,
+                'timeouts': dict(enumerate(self.timeouts)), 'failures': dict(enumerate(self.failures))}
@@ -0,0 +1,94 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(path: Path, buffer_size: int = 1 << 20, max_object_size: int = None) -> Iterator[Dict]:
+    """
+    Инкрементально разбирает JSON-файл вида [ {...}, {...}, ... ], не загружая его целиком.
+    Память ограничена размером буфера и одного объекта: объект длиннее max_object_size
+    символов (по умолчанию 8 * buffer_size) или некорректный JSON — ValueError
+    с байтовым смещением начала объекта в файле.
+    """
+    max_object_size = max_object_size or 8 * buffer_size
+    decoder = json.JSONDecoder()
+    # newline='' — без преобразования \r\n, чтобы смещения в символах переводились в байты файла
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        buffer = ''
+        pos = 0
+        offset = 0  # байтовое смещение начала buffer в файле
+        started = False
+
+        def fill() -> bool:
+            nonlocal buffer, pos, offset
+            chunk = f.read(buffer_size)
+            offset += len(buffer[:pos].encode('utf-8'))
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return bool(chunk)
+
+        def position() -> int:
+            return offset + len(buffer[:pos].encode('utf-8'))
+
+        while True:
+            # пропускаем пробелы и разделители
+            while True:
+                while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buffer):
+                    break
+                if not fill():
+                    return
+            char = buffer[pos]
+            if not started:
+                if char != '[':
+                    raise ValueError(f'{path}: ожидался JSON-массив (байт {position()})')
+                started = True
+                pos += 1
+                continue
+            if char == ',':
+                pos += 1
+                continue
+            if char == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if len(buffer) - pos > max_object_size:
+                    raise ValueError(f'{path}: объект с байта {position()} длиннее {max_object_size} символов '
+                                     f'или JSON некорректен ({e.msg})') from e
+                # объект не поместился в буфер — дочитываем
+                if not fill():
+                    raise ValueError(f'{path}: некорректный JSON в объекте с байта {position()} ({e.msg})') from e
+                continue
+            pos = end
+            yield record
+
+
+def iter_jsonl(path: Path) -> Iterator[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_records(path: Path) -> Iterator[Dict]:
+    """Потоковое чтение записей: *.jsonl построчно, иначе JSON-массив."""
+    path = Path(path)
+    if path.suffix == '.jsonl':
+        return iter_jsonl(path)
+    return iter_json_array(path)
+
+
+def iter_chunks(records: Iterator[Dict], chunk_size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
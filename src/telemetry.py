@@ -0,0 +1,161 @@
+import json
+import time
+import uuid
+import atexit
+import logging
+import logging.handlers
+import queue
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from prometheus_client import Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+TRACE_HEADER = 'X-Trace-Id'
+
+# trace id текущего запроса: задаётся middleware, передаётся answer -> indexer заголовком X-Trace-Id
+trace_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('trace_id', default=None)
+
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram('rag_stage_seconds', 'Длительность этапа обработки запроса, с',
+                          ['stage'], buckets=_BUCKETS)
+HTTP_SECONDS = Histogram('rag_http_request_seconds', 'Длительность HTTP-запроса, с',
+                         ['path', 'status'], buckets=_BUCKETS)
+TOKENS_PER_SECOND = Histogram('rag_llm_tokens_per_second', 'Скорость генерации LLM, токенов/с',
+                              buckets=(1, 2, 5, 10, 15, 20, 30, 50, 100, 200))
+
+_span_logger = logging.getLogger('spans')
+_span_logger.propagate = False
+
+
+def new_trace_id(value: Optional[str] = None) -> str:
+    """Устанавливает trace id запроса (переданный или новый) в текущий контекст."""
+    trace_id = value or uuid.uuid4().hex
+    trace_id_var.set(trace_id)
+    return trace_id
+
+
+def trace_headers() -> Dict[str, str]:
+    trace_id = trace_id_var.get()
+    return {TRACE_HEADER: trace_id} if trace_id else {}
+
+
+def record_span(stage: str, seconds: float, **attrs) -> None:
+    """Записывает длительность этапа в гистограмму и (если включено) строку JSON в журнал spans."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if _span_logger.handlers:
+        _span_logger.info(json.dumps({'trace_id': trace_id_var.get(), 'stage': stage,
+                                      'duration_ms': round(seconds * 1000, 3), **attrs}, ensure_ascii=False))
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    """Замер этапа: with span('encode', n=len(texts)): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start, **attrs)
+
+
+def queue_logging(logger: logging.Logger) -> logging.handlers.QueueListener:
+    """
+    Переносит обработчики логгера в фоновый поток: логгер пишет записи в очередь
+    (QueueHandler), файлы пишет QueueListener — запись в файл не выполняется
+    в потоке обработки запроса.
+    """
+    records = queue.SimpleQueue()
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def setup_spans(config: Dict, log_dir: str = 'logs') -> None:
+    """
+    Журнал spans (секция 'telemetry' конфигурации): при log_spans каждая запись
+    этапа пишется строкой JSON в log_dir/spans_file через очередь.
+    """
+    config_telemetry = config.get('telemetry', {})
+    if not config_telemetry.get('log_spans', True) or _span_logger.handlers:
+        return
+    path = Path.cwd()/log_dir/config_telemetry.get('spans_file', 'spans.log')
+    path.parent.mkdir(exist_ok=True)
+    handler = logging.FileHandler(path, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    _span_logger.setLevel(logging.INFO)
+    _span_logger.addHandler(handler)
+    queue_logging(_span_logger)
+
+
+class StatsCollector:
+    """
+    Экспорт числовых значений словаря статистики (stats() кэшей, пула, хранилища)
+    как gauge-метрик prometheus: rag_<prefix>_<ключ>, значения читаются при каждом опросе /metrics.
+    """
+
+    def __init__(self, prefix: str, stats_fn: Callable[[], Dict]):
+        self.prefix = prefix
+        self.stats_fn = stats_fn
+
+    def _flatten(self, stats: Dict, name: str):
+        for key, value in stats.items():
+            if isinstance(value, dict):
+                yield from self._flatten(value, f'{name}_{key}')
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f'{name}_{key}', value
+
+    def collect(self):
+        try:
+            stats = self.stats_fn()
+        except Exception:
+            return
+        for name, value in self._flatten(stats or {}, f'rag_{self.prefix}'):
+            metric = GaugeMetricFamily(name, f'{self.prefix}: {name}')
+            metric.add_metric([], value)
+            yield metric
+
+
+def register_stats(prefix: str, stats_fn: Callable[[], Dict]) -> None:
+    REGISTRY.register(StatsCollector(prefix, stats_fn))
+
+
+async def trace_middleware(request, call_next):
+    """
+    HTTP middleware FastAPI: trace id из заголовка X-Trace-Id (или новый) на время
+    запроса, возврат его в ответе и гистограмма длительности по эндпоинтам.
+    Длительность потокового ответа (SSE) замеряется до отправки последнего фрагмента тела.
+    """
+    trace_id = new_trace_id(request.headers.get(TRACE_HEADER))
+    start = time.perf_counter()
+    response = await call_next(request)
+    path = request.url.path if response.status_code != 404 else 'unmatched'
+    histogram = HTTP_SECONDS.labels(path, str(response.status_code))
+    response.headers[TRACE_HEADER] = trace_id
+    body_iterator = getattr(response, 'body_iterator', None)
+    if body_iterator is None:
+        histogram.observe(time.perf_counter() - start)
+        return response
+
+    async def observed_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            # в том числе при обрыве соединения клиентом
+            histogram.observe(time.perf_counter() - start)
+
+    response.body_iterator = observed_body()
+    return response
+
+
+def metrics_body() -> tuple:
+    """Тело и content-type ответа /metrics."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
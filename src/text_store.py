@@ -0,0 +1,82 @@
+import os
+import numpy as np
+from pathlib import Path
+from typing import Iterable, Iterator
+
+
+class TextStore:
+    """
+    Дисковое хранилище текстов с доступом по позиции через memory-map.
+
+    Тексты хранятся одним файлом UTF-8 байт (<prefix>.bin) и массивом смещений
+    int64 длины n+1 (<prefix>.offsets.npy). Оба файла открываются через mmap,
+    поэтому несколько воркеров разделяют страницы через кэш ОС, а открытие
+    хранилища не зависит от размера корпуса.
+
+    Поддерживает интерфейс списка: len(store), store[i] и итерацию.
+
+    Args:
+        prefix (Path): Путь к файлам хранилища без расширения.
+    """
+
+    def __init__(self, prefix: Path):
+        self.prefix = Path(prefix)
+        self._open()
+
+    @staticmethod
+    def _paths(prefix: Path):
+        prefix = Path(prefix)
+        return prefix.with_name(prefix.name + '.bin'), prefix.with_name(prefix.name + '.offsets.npy')
+
+    @classmethod
+    def exists(cls, prefix: Path) -> bool:
+        return all(path.is_file() for path in cls._paths(prefix))
+
+    @classmethod
+    def write(cls, prefix: Path, texts: Iterable[str]) -> 'TextStore':
+        """
+        Создаёт хранилище из списка текстов (перезаписывает существующее).
+        Файлы пишутся во временные и атомарно переименовываются.
+        """
+        path_bin, path_offsets = cls._paths(prefix)
+        offsets = [0]
+        tmp_bin = path_bin.with_name(path_bin.name + '.tmp')
+        with open(tmp_bin, 'wb') as f:
+            for text in texts:
+                data = text.encode('utf-8')
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        cls._write_offsets(path_offsets, np.asarray(offsets, dtype=np.int64))
+        os.replace(tmp_bin, path_bin)
+        return cls(prefix)
+
+    @staticmethod
+    def _write_offsets(path_offsets: Path, offsets: np.ndarray) -> None:
+        tmp = path_offsets.with_name(path_offsets.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, offsets)
+        os.replace(tmp, path_offsets)
+
+    def _open(self) -> None:
+        path_bin, path_offsets = self._paths(self.prefix)
+        self._offsets = np.load(path_offsets, mmap_mode='r')
+        # np.memmap не умеет отображать пустой файл
+        if path_bin.stat().st_size > 0:
+            self._data = np.memmap(path_bin, dtype=np.uint8, mode='r')
+        else:
+            self._data = np.empty(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f'TextStore index {i} out of range')
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return self._data[start:end].tobytes().decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
@@ -0,0 +1,71 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from src.segments import Segment, SegmentStore
+
+CONFIG = {
+    'index_type': {'type': 'flat'},
+    'compaction': {'enabled': False, 'min_segment_size': 1000},
+    'near_duplicates': {'enabled': False},
+}
+
+
+def _store(path_dir) -> SegmentStore:
+    return SegmentStore(path_dir, CONFIG, logging.getLogger('test_segments'))
+
+
+def _add(store: SegmentStore, uids, rng) -> None:
+    texts = [f'документ {uid}' for uid in uids]
+    embs = rng.standard_normal((len(uids), 8)).astype(np.float32)
+    store.add(embs, texts, meta=pd.DataFrame({'uid': uids}))
+
+
+def test_delete_during_compaction(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    store = _store(tmp_path)
+    for start in range(0, 9, 3):
+        _add(store, [str(uid) for uid in range(start, start + 3)], rng)
+    store.delete(['1'])
+
+    # удаление приходит, пока компакция вне блокировки записывает слитый сегмент
+    write = Segment.write.__func__
+
+    def write_with_delete(cls, *args, **kwargs):
+        store.delete(['4', '7'])
+        return write(cls, *args, **kwargs)
+
+    monkeypatch.setattr(Segment, 'write', classmethod(write_with_delete))
+    store.compact()
+    monkeypatch.undo()
+
+    assert len(store.segments) == 1
+    assert store.segments[0].ntotal == 8
+    assert store.n_live == 6
+    live = {str(uid) for uid in range(9)} - {'1', '4', '7'}
+    assert store.locate([str(uid) for uid in range(9)]) == live
+
+    reloaded = _store(tmp_path)
+    assert reloaded.load()
+    assert reloaded.locate([str(uid) for uid in range(9)]) == live
+    _, texts, _ = reloaded.search(np.zeros((1, 8), dtype=np.float32), k=9)
+    assert sorted(texts[0]) == sorted(f'документ {uid}' for uid in live)
+
+
+def test_hybrid_keeps_lexical_match(tmp_path):
+    store = _store(tmp_path)
+    embs = np.eye(2, 8, dtype=np.float32)
+    texts = ['кошка спит на тёплом подоконнике', 'телескоп наблюдает далёкие звёзды']
+    store.add(embs, texts, meta=pd.DataFrame({'uid': ['cat', 'telescope']}))
+    # запрос по смыслу ближе к первому тексту, по словам совпадает только со вторым
+    query = embs[:1]
+
+    _, dense_texts, _ = store.search(query, k=1)
+    distances, hybrid_texts, nearest = store.search(query, k=1, queries=['телескоп'])
+
+    assert dense_texts == [[texts[0]]]
+    assert hybrid_texts == [[texts[1]]]
+    # порог релевантности проверяется по ближайшему плотному результату, которого нет в выдаче RRF
+    assert nearest[0] == 0.0
+    assert distances[0][0] > nearest[0]